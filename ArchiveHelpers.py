@@ -0,0 +1,188 @@
+# ArchiveHelpers.py implements hot/cold archival of completed donations into an attached database
+
+import datetime
+from TransactionHelpers import unitOfWork
+from LocationHelpers import removeDonationLocation
+
+# Functions:
+# attachArchive()
+# detachArchive()
+# archiveAttached()
+# unionSource()
+# archiveCompleted()
+
+# Completed donations older than the retention window move, with their items, from the
+# hot donations/items tables to the same tables in an attached archive database. Pending
+# queries then only ever touch recent rows, while the completed getters in DonationHelpers
+# read both databases through unionSource() once the archive is attached.
+ARCHIVE_SCHEMA = 'archive'
+ARCHIVE_RETENTION_DAYS = 365
+ARCHIVE_BATCH_SIZE = 1000
+
+# Archive tables mirror the hot tables column for column so rows copy with SELECT *
+# Archived items are keyed by donation, since hot item ids may be reused once archived
+ARCHIVE_TABLES = [
+	'''CREATE TABLE IF NOT EXISTS archive.donations(
+		id INTEGER PRIMARY KEY,
+		provider TEXT NOT NULL,
+		receiver TEXT DEFAULT "pending",
+		created TIMESTAMP,
+		completed TIMESTAMP DEFAULT 0)''',
+	'''CREATE INDEX IF NOT EXISTS archive.donations_provider_created ON donations(provider, completed, created)''',
+	'''CREATE INDEX IF NOT EXISTS archive.donations_receiver_created ON donations(receiver, completed, created)''',
+	'''CREATE TABLE IF NOT EXISTS archive.items(
+		id INTEGER NOT NULL,
+		did INTEGER NOT NULL,
+		barcode TEXT,
+		title TEXT NOT NULL,
+		count INTEGER NOT NULL,
+		units TEXT NOT NULL,
+		PRIMARY KEY(did, id)) WITHOUT ROWID''',
+]
+
+# Hot and archived rows as one table; a donation still in the hot tables is authoritative,
+# so copies left by an interrupted archive run are never read twice
+UNION_SOURCES = {
+	'donations': '''(SELECT * FROM main.donations UNION ALL SELECT * FROM archive.donations a
+		WHERE NOT EXISTS (SELECT 1 FROM main.donations m WHERE m.id = a.id))''',
+	'items': '''(SELECT * FROM main.items UNION ALL SELECT * FROM archive.items a
+		WHERE NOT EXISTS (SELECT 1 FROM main.donations m WHERE m.id = a.did))''',
+}
+
+
+# Function attachArchive()
+# Purpose: Attach an archive database to a connection, creating its tables if missing
+# Syntax: attachArchive(<connection>, <archive_path>)
+# Returns: True if attached, False if the connection cannot record it (not from createSchema())
+# Note: Attach on every connection that reads completed donations; unattached connections
+#       see only the hot tables. Donation ids continue above every archived id, which covers
+#       archives filled before migration 15 made hot ids AUTOINCREMENT.
+def attachArchive(db, path):
+
+	if not hasattr(db, 'archive'):
+		return False
+	if db.archive:
+		return True
+
+	c = db.cursor()
+	c.execute('ATTACH DATABASE ? AS {0}'.format(ARCHIVE_SCHEMA), (path,))
+	for statement in ARCHIVE_TABLES:
+		c.execute(statement)
+	_reserveArchivedIds(c)
+	db.commit()
+	c.close()
+	db.archive = True
+	return True
+
+
+# Function _reserveArchivedIds raises the donations AUTOINCREMENT counter past the archive's highest id
+# Note: Writes only when the counter is behind, so read-only connections can attach an archive
+#       that a read-write connection has already attached
+def _reserveArchivedIds(c):
+
+	c.execute('''SELECT MAX(id) FROM archive.donations''')
+	archived = c.fetchone()[0]
+	if archived is None:
+		return
+	c.execute('''SELECT seq FROM main.sqlite_sequence WHERE name = ?''', ('donations',))
+	result = c.fetchone()
+	if result is None:
+		c.execute('''INSERT INTO main.sqlite_sequence(name, seq) VALUES(?,?)''', ('donations', archived))
+	elif result[0] < archived:
+		c.execute('''UPDATE main.sqlite_sequence SET seq = ? WHERE name = ?''', (archived, 'donations'))
+
+
+# Function detachArchive()
+# Purpose: Detach the archive database from a connection
+# Syntax: detachArchive(<connection>)
+def detachArchive(db):
+
+	if getattr(db, 'archive', False):
+		db.commit()
+		db.execute('DETACH DATABASE {0}'.format(ARCHIVE_SCHEMA))
+		db.archive = False
+
+
+# Function archiveAttached checks whether a connection reads from the archive
+def archiveAttached(db):
+	return getattr(db, 'archive', False)
+
+
+# Function unionSource()
+# Purpose: Name the rows a query over donations or items should read
+# Syntax: unionSource(<connection>, <table>)
+# Returns: table itself if no archive is attached, else a subquery over hot and archived rows
+# Note: SQLite pushes WHERE terms into both arms, so each arm still uses its own indexes
+def unionSource(db, table):
+	return UNION_SOURCES[table] if archiveAttached(db) else table
+
+
+# Function archiveCompleted()
+# Purpose: Move completed donations older than the retention window into the archive
+# Syntax: archiveCompleted(<connection>, <retention_days>, <batch_size>, <now>)
+# Returns: number of donations archived, -1 if no archive is attached or inside a unit of work
+# Note: Each batch is copied to the archive in one transaction and removed from the hot
+#       tables in a second, so a crash between them leaves a copy but never loses a row;
+#       the next run finishes the move. Writers wait for at most one batch at a time.
+#       Donation ids are AUTOINCREMENT, so an archived id is never handed out again.
+def archiveCompleted(db, retentionDays=ARCHIVE_RETENTION_DAYS, batchSize=ARCHIVE_BATCH_SIZE, now=None):
+
+	if not archiveAttached(db) or db.in_transaction:
+		return -1
+
+	now = now or datetime.datetime.now().replace(microsecond=0)
+	cutoff = now - datetime.timedelta(days=retentionDays)
+
+	archived = 0
+	c = db.cursor()
+	try:
+		while True:
+			c.execute('''SELECT id FROM main.donations WHERE completed != 0 AND completed < ?
+				ORDER BY completed LIMIT ?''', (cutoff, batchSize))
+			batch = [row[0] for row in c.fetchall()]
+			if not batch:
+				break
+			SQLin = ','.join('?' * len(batch))
+
+			# Copy: donations whose archived row matches the hot row take their items along
+			with unitOfWork(db):
+				c.execute(''.join(['INSERT OR IGNORE INTO archive.donations SELECT * FROM main.donations WHERE id IN (', SQLin, ')']), batch)
+				c.execute(''.join(['''SELECT d.id FROM main.donations d JOIN archive.donations a ON a.id = d.id
+					AND a.provider = d.provider AND a.created IS d.created WHERE d.id IN (''', SQLin, ')']), batch)
+				moved = [row[0] for row in c.fetchall()]
+				if moved:
+					SQLmoved = ','.join('?' * len(moved))
+					c.execute(''.join(['DELETE FROM archive.items WHERE did IN (', SQLmoved, ')']), moved)
+					c.execute(''.join(['INSERT INTO archive.items SELECT * FROM main.items WHERE did IN (', SQLmoved, ')']), moved)
+
+			# Remove: only donations now safely in the archive leave the hot tables
+			if moved:
+				with unitOfWork(db):
+					c.execute(''.join(['DELETE FROM main.items WHERE did IN (', SQLmoved, ')']), moved)
+					c.execute(''.join(['DELETE FROM main.donations WHERE id IN (', SQLmoved, ')']), moved)
+					for did in moved:
+						removeDonationLocation(c, did)
+			archived += len(moved)
+
+			if len(moved) < len(batch) or len(batch) < batchSize:
+				break # Done, or rows that collide with archived ids: leave them hot
+	finally:
+		c.close()
+	return archived
+
+
+if __name__ == '__main__':
+
+	# Usage: python3 ArchiveHelpers.py <database_path> <archive_path> [retention_days]
+	import sys
+	from Schema import createSchema
+
+	if len(sys.argv) < 3:
+		print('Usage: python3 ArchiveHelpers.py <database_path> <archive_path> [retention_days]')
+		sys.exit(1)
+
+	db = createSchema(sys.argv[1])
+	attachArchive(db, sys.argv[2])
+	days = int(sys.argv[3]) if len(sys.argv) > 3 else ARCHIVE_RETENTION_DAYS
+	print('Archived {0} donations completed more than {1} days ago'.format(archiveCompleted(db, days), days))
+	db.close()
@@ -0,0 +1,101 @@
+# AsyncHelpers.py implements an asyncio facade over DonationHelpers and UserHelpers
+
+import asyncio, threading, weakref
+from concurrent.futures import ThreadPoolExecutor
+from Schema import createSchema
+import DonationHelpers, UserHelpers
+
+# Helpers exposed as coroutines with the same names and arguments, except that the
+# first argument is a DatabaseExecutor instead of a connection:
+#
+#	dbx = DatabaseExecutor('donations.db')
+#	packages = await getUnclaimed(dbx)
+#	claimed = await claimDonation(dbx, packages[0][0], 'R_Usr_1')
+#	dbx.close()
+#
+# stream*() getters are not exposed: their rows are tied to a worker's connection.
+DONATION_HELPERS = [
+	'addDonation', 'deleteDonation', 'editDonation', 'addItemByManual', 'addItemByBarcode',
+	'getProviderPending', 'getProviderComplete', 'getReceiverPending', 'getReceiverComplete', 'getUnclaimed',
+	'getProviderPendingPage', 'getProviderCompletePage', 'getReceiverPendingPage', 'getReceiverCompletePage', 'getUnclaimedPage',
+	'getProviderPendingWithItems', 'getProviderCompleteWithItems', 'getReceiverPendingWithItems',
+	'getReceiverCompleteWithItems', 'getUnclaimedWithItems', 'getDonationItems',
+	'claimDonation', 'unclaimDonation', 'completeDonation',
+	'addBarcode', 'getBarcode', 'existBarcode', 'existItem', 'existDonation',
+]
+USER_HELPERS = [
+	'existUser', 'validUser', 'changePassword', 'writeUser', 'provisionUsers', 'deleteUser',
+	'isAdmin', 'isOrg', 'isProvider', 'isReceiver', 'getPerms',
+]
+
+
+# Class DatabaseExecutor runs helpers on worker threads that each own a connection
+# Syntax: DatabaseExecutor(<database_path>, <profile>, <workers>, <max_pending>)
+# Note: At most max_pending calls are queued or running; further callers wait for a slot,
+#       which pushes back on request handlers instead of growing an unbounded queue.
+#       The bound applies per event loop, so one executor can serve successive asyncio.run() calls.
+#       An in-memory database is private to one connection, so ':memory:' uses one worker.
+class DatabaseExecutor:
+
+	def __init__(self, path=':memory:', profile='throughput', workers=4, maxPending=256):
+		self.path = path
+		self.profile = profile
+		self.workers = 1 if path == ':memory:' else workers
+		self.maxPending = maxPending
+		self._local = threading.local()
+		self._connections = []
+		self._lock = threading.Lock()
+		self._slots = weakref.WeakKeyDictionary() # event loop -> asyncio.Semaphore bound to it
+		self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='db', initializer=self._open)
+
+	# Method _open gives each worker thread its own connection
+	# Connections may be used by any thread so close() can run on the caller's thread
+	def _open(self):
+		db = createSchema(self.path, self.profile, anyThread=True)
+		self._local.db = db
+		with self._lock:
+			self._connections.append(db)
+
+	def _call(self, func, args, kwargs):
+		return func(self._local.db, *args, **kwargs)
+
+	# Method run()
+	# Purpose: Run a helper on a worker connection without blocking the event loop
+	# Syntax: await dbx.run(<helper>, <args...>)
+	# Returns: the helper's result; exceptions raised by the helper propagate
+	async def run(self, func, *args, **kwargs):
+
+		loop = asyncio.get_running_loop()
+		with self._lock:
+			slots = self._slots.get(loop)
+			if slots is None:
+				slots = self._slots[loop] = asyncio.Semaphore(self.maxPending)
+		async with slots:
+			return await loop.run_in_executor(self._pool, self._call, func, args, kwargs)
+
+	# Method close()
+	# Purpose: Wait for running calls, then close every worker connection
+	def close(self):
+		self._pool.shutdown(wait=True)
+		with self._lock:
+			for db in self._connections:
+				db.close()
+			self._connections = []
+
+
+# Function _coroutine builds the async counterpart of a helper
+def _coroutine(func):
+
+	async def helper(dbx, *args, **kwargs):
+		return await dbx.run(func, *args, **kwargs)
+
+	helper.__name__ = func.__name__
+	helper.__qualname__ = func.__name__
+	helper.__doc__ = 'Async {0}(); first argument is a DatabaseExecutor.'.format(func.__name__)
+	return helper
+
+
+for _name in DONATION_HELPERS:
+	globals()[_name] = _coroutine(getattr(DonationHelpers, _name))
+for _name in USER_HELPERS:
+	globals()[_name] = _coroutine(getattr(UserHelpers, _name))
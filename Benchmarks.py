@@ -0,0 +1,427 @@
+# Benchmarks.py implements timing comparisons for the database helpers
+
+import os, sys, time, random, shutil, tempfile, threading, asyncio, sqlite3, json, http.client
+from Schema import createSchema, PROFILES
+from UserHelpers import writeUser
+from DonationHelpers import addDonation, addItemByManual, getUnclaimed, getUnclaimedPage, getDonationItems, claimDonation
+import AsyncHelpers
+from WriterHelpers import WriteQueue
+from DonationService import DonationService
+
+# FUNCTIONS:
+# tempDatabase() - Path to a database file in a fresh temporary directory
+# seedUsers(db) - Write the admin/org/provider/receiver accounts used by every benchmark
+# benchProfiles(donations, items, readers, seed) - Compare storage profiles on one workload
+# benchContention(donations, claimants, profile, seed) - Race receivers to claim the same donations
+# benchAsync(donations, requests, concurrency, workers, seed) - Latency of the async facade against sync calls on the event loop
+# benchGroupCommit(operations, producers, latencies, profile, seed) - Write throughput of per-call commits vs WriteQueue batches
+# loadTest(host, port, requests, clients, seed) - Drive claim/list-unclaimed/add-item traffic at a running DonationService
+# benchService(donations, requests, clients, workers, seed) - loadTest() against a temporary DonationService
+# percentile(values, p) - Nearest-rank percentile of a list
+
+
+# Function tempDatabase()
+# Purpose: Build a path for a throwaway database file
+# Syntax: tempDatabase()
+# Returns: (<directory>, <database_path>); caller removes directory when done
+def tempDatabase():
+	directory = tempfile.mkdtemp(prefix='donations-bench-')
+	return directory, os.path.join(directory, 'donations.db')
+
+
+# Function seedUsers()
+# Purpose: Write the standard benchmark accounts
+# Syntax: seedUsers(<connection>)
+def seedUsers(db):
+	writeUser(db, 'admin', 'admin', 0b1111, 'admin')
+	writeUser(db, 'admin', 'P_Org', 0b110, 'P_Org')
+	writeUser(db, 'admin', 'R_Org', 0b101, 'R_Org')
+	writeUser(db, 'P_Org', 'P_Usr_1', 0b10, 'P_Usr_1')
+	writeUser(db, 'R_Org', 'R_Usr_1', 0b1, 'R_Usr_1')
+
+
+# Function benchProfiles()
+# Purpose: Run the same write and concurrent-read workload against each storage profile
+# Syntax: benchProfiles(<donation_count>, <items_per_donation>, <reader_threads>, <seed>)
+# Returns: dict of profile -> {'write': seconds, 'read': seconds, 'reads': count}
+# Note: Each profile gets its own file database so results do not share page cache
+def benchProfiles(donations=200, items=5, readers=4, seed=361):
+
+	results = dict()
+	for profile in PROFILES:
+		random.seed(seed)
+		directory, path = tempDatabase()
+		try:
+			db = createSchema(path, profile)
+			seedUsers(db)
+
+			# Write phase: helpers commit per call, as they do in production
+			start = time.perf_counter()
+			for i in range(donations):
+				did = addDonation(db, 'P_Usr_1', None)
+				for j in range(items):
+					addItemByManual(db, did, 'Item {0}'.format(random.randint(0, 50)), random.randint(1, 50), 'lb')
+			write = time.perf_counter() - start
+			db.close()
+
+			# Read phase: each reader opens its own connection, as worker processes would
+			counts = [0] * readers
+			def reader(index):
+				rdb = createSchema(path, profile)
+				for d in getUnclaimed(rdb):
+					getDonationItems(rdb, d[0])
+					counts[index] += 1
+				rdb.close()
+
+			threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+			start = time.perf_counter()
+			for t in threads: t.start()
+			for t in threads: t.join()
+			read = time.perf_counter() - start
+
+			results[profile] = {'write': write, 'read': read, 'reads': sum(counts)}
+		finally:
+			shutil.rmtree(directory, ignore_errors=True)
+
+	return results
+
+
+def printProfiles(results):
+	print('{0}{1}{2}{3}'.format('profile'.ljust(14), 'write s'.ljust(12), 'read s'.ljust(12), 'reads/s'))
+	for profile, r in results.items():
+		rate = r['reads'] / r['read'] if r['read'] > 0 else 0
+		print('{0}{1}{2}{3:.0f}'.format(profile.ljust(14), '{0:.3f}'.format(r['write']).ljust(12), '{0:.3f}'.format(r['read']).ljust(12), rate))
+
+
+# Function benchContention()
+# Purpose: Have many receivers race to claim every donation, each on its own connection
+# Syntax: benchContention(<donation_count>, <claimant_threads>, <profile>, <seed>)
+# Returns: dict with attempts, wins, seconds, claims/sec and donations won more or less than once
+# Note: Passes when 'double', 'unclaimed' and 'mismatch' are all 0: exactly one claimant per donation
+def benchContention(donations=500, claimants=8, profile='throughput', seed=361):
+
+	directory, path = tempDatabase()
+	try:
+		db = createSchema(path, profile)
+		seedUsers(db)
+		dids = [addDonation(db, 'P_Usr_1', None) for i in range(donations)]
+		db.close()
+
+		wins = [[] for i in range(claimants)]
+		barrier = threading.Barrier(claimants)
+		def claimant(index):
+			cdb = createSchema(path, profile)
+			order = dids[:]
+			random.Random(seed + index).shuffle(order)
+			barrier.wait() # Start every claimant together
+			for did in order:
+				if claimDonation(cdb, did, 'R_Usr_{0}'.format(index)):
+					wins[index].append(did)
+			cdb.close()
+
+		threads = [threading.Thread(target=claimant, args=(i,)) for i in range(claimants)]
+		start = time.perf_counter()
+		for t in threads: t.start()
+		for t in threads: t.join()
+		seconds = time.perf_counter() - start
+
+		# Every donation must have exactly one winner, and the table must agree with the winners
+		winners = dict()
+		for index, won in enumerate(wins):
+			for did in won:
+				winners.setdefault(did, []).append(index)
+		db = createSchema(path, profile)
+		c = db.cursor()
+		c.execute('''SELECT id, receiver FROM donations''')
+		stored = dict(c.fetchall())
+		c.close()
+		db.close()
+		double = sum(1 for did in dids if len(winners.get(did, [])) > 1)
+		unclaimed = sum(1 for did in dids if did not in winners)
+		mismatch = sum(1 for did, idx in winners.items() if stored[did] != 'R_Usr_{0}'.format(idx[0]))
+
+		attempts = donations * claimants
+		return {'attempts': attempts, 'wins': sum(len(w) for w in wins), 'seconds': seconds,
+			'claims/sec': attempts / seconds if seconds > 0 else 0,
+			'double': double, 'unclaimed': unclaimed, 'mismatch': mismatch}
+	finally:
+		shutil.rmtree(directory, ignore_errors=True)
+
+
+def printContention(result):
+	for key in ['attempts', 'wins', 'seconds', 'claims/sec', 'double', 'unclaimed', 'mismatch']:
+		value = result[key]
+		print('{0}{1}'.format(key.ljust(14), '{0:.3f}'.format(value) if isinstance(value, float) else value))
+	print('PASS: one claimant per donation' if result['double'] == 0 and result['unclaimed'] == 0 and result['mismatch'] == 0 else 'FAIL: claim race detected')
+
+
+# Function percentile()
+# Purpose: Nearest-rank percentile
+# Syntax: percentile(<values>, <percent>)
+# Returns: value at percent (0-100) of the sorted values, 0 if values is empty
+def percentile(values, p):
+	if not values:
+		return 0
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))]
+
+
+# Function benchAsync()
+# Purpose: Compare request latency when handlers call helpers directly vs through AsyncHelpers
+# Syntax: benchAsync(<donation_count>, <request_count>, <concurrency>, <workers>, <seed>)
+# Returns: dict of mode -> {'p50', 'p99', 'req/s', 'stall'} with times in milliseconds
+# Note: Requests are 80% list-unclaimed pages and 20% claims, issued concurrency at a time.
+#       stall is the longest the event loop went without running a 1ms ticker; blocking
+#       sync calls stall it for the whole batch, the facade should keep it near zero.
+def benchAsync(donations=2000, requests=2000, concurrency=200, workers=4, seed=361):
+
+	directory, path = tempDatabase()
+	try:
+		db = createSchema(path, 'throughput')
+		seedUsers(db)
+		dids = [addDonation(db, 'P_Usr_1', None) for i in range(donations)]
+		db.close()
+
+		rng = random.Random(seed)
+		workload = [('claim', rng.choice(dids)) if rng.random() < 0.2 else ('list', None) for i in range(requests)]
+
+		async def drive(handler):
+			latencies = []
+			stall = [0.0]
+			done = [False]
+
+			async def ticker():
+				last = time.perf_counter()
+				while not done[0]:
+					await asyncio.sleep(0.001)
+					now = time.perf_counter()
+					stall[0] = max(stall[0], now - last)
+					last = now
+
+			async def timed(op, did):
+				start = time.perf_counter()
+				await handler(op, did)
+				latencies.append(time.perf_counter() - start)
+
+			tick = asyncio.ensure_future(ticker())
+			start = time.perf_counter()
+			for i in range(0, len(workload), concurrency):
+				await asyncio.gather(*[timed(op, did) for op, did in workload[i:i + concurrency]])
+			seconds = time.perf_counter() - start
+			done[0] = True
+			await tick
+			return {'p50': percentile(latencies, 50) * 1000, 'p99': percentile(latencies, 99) * 1000,
+				'req/s': len(latencies) / seconds if seconds > 0 else 0, 'stall': stall[0] * 1000}
+
+		results = dict()
+
+		# Sync: handlers call helpers on one shared connection from the event loop thread
+		sdb = createSchema(path, 'throughput')
+		async def syncHandler(op, did):
+			await asyncio.sleep(0) # Yield once, as a real handler would on socket I/O
+			if op == 'claim': claimDonation(sdb, did, 'R_Usr_1')
+			else: getUnclaimedPage(sdb, 50)
+		results['sync'] = asyncio.run(drive(syncHandler))
+		sdb.close()
+
+		# Reset claims so both modes see the same workload
+		rdb = createSchema(path, 'throughput')
+		rdb.execute('''UPDATE donations SET receiver = 'pending' ''')
+		rdb.commit()
+		rdb.close()
+
+		# Async: handlers await the facade, which runs helpers on worker connections
+		dbx = AsyncHelpers.DatabaseExecutor(path, 'throughput', workers)
+		async def asyncHandler(op, did):
+			if op == 'claim': await AsyncHelpers.claimDonation(dbx, did, 'R_Usr_1')
+			else: await AsyncHelpers.getUnclaimedPage(dbx, 50)
+		results['async'] = asyncio.run(drive(asyncHandler))
+		dbx.close()
+
+		return results
+	finally:
+		shutil.rmtree(directory, ignore_errors=True)
+
+
+def printLatency(results):
+	print('{0}{1}{2}{3}{4}'.format('mode'.ljust(10), 'p50 ms'.ljust(12), 'p99 ms'.ljust(12), 'req/s'.ljust(12), 'max stall ms'))
+	for mode, r in results.items():
+		print('{0}{1}{2}{3}{4:.1f}'.format(mode.ljust(10), '{0:.2f}'.format(r['p50']).ljust(12), '{0:.2f}'.format(r['p99']).ljust(12), '{0:.0f}'.format(r['req/s']).ljust(12), r['stall']))
+
+
+# Function benchGroupCommit()
+# Purpose: Compare intake write throughput with per-call commits against WriteQueue group commit
+# Syntax: benchGroupCommit(<operation_count>, <producer_threads>, <batch_latencies>, <profile>, <seed>)
+# Returns: dict of mode -> {'ops/s', 'p50', 'p99', 'batch'} with times in milliseconds
+# Note: Each operation adds one item to a donation. 'direct' has every producer call the helper
+#       on its own connection, committing per call and retrying when the database is locked;
+#       'batch Nms' sends the same calls through a WriteQueue with max latency N ms.
+def benchGroupCommit(operations=4000, producers=32, latencies=(0, 0.001, 0.005, 0.02), profile='durable', seed=361):
+
+	titles = ['Item {0}'.format(i) for i in range(50)]
+	results = dict()
+
+	def drive(call):
+		latencies = [[] for i in range(producers)]
+		barrier = threading.Barrier(producers)
+		def producer(index):
+			rng = random.Random(seed + index)
+			barrier.wait()
+			for i in range(index, operations, producers):
+				start = time.perf_counter()
+				call(index, rng.choice(titles), rng.randint(1, 50))
+				latencies[index].append(time.perf_counter() - start)
+		threads = [threading.Thread(target=producer, args=(i,)) for i in range(producers)]
+		start = time.perf_counter()
+		for t in threads: t.start()
+		for t in threads: t.join()
+		seconds = time.perf_counter() - start
+		flat = [value for values in latencies for value in values]
+		return {'ops/s': len(flat) / seconds if seconds > 0 else 0,
+			'p50': percentile(flat, 50) * 1000, 'p99': percentile(flat, 99) * 1000}
+
+	for mode in ['direct'] + list(latencies):
+		directory, path = tempDatabase()
+		try:
+			db = createSchema(path, profile)
+			seedUsers(db)
+			did = addDonation(db, 'P_Usr_1', None)
+			db.close()
+
+			if mode == 'direct':
+				connections = [createSchema(path, profile, anyThread=True) for i in range(producers)]
+				def direct(index, title, count):
+					while True:
+						try:
+							return addItemByManual(connections[index], did, title, count, 'lb')
+						except sqlite3.OperationalError:
+							connections[index].rollback() # database is locked: retry
+				result = drive(direct)
+				result['batch'] = 1.0
+				for connection in connections:
+					connection.close()
+				results['direct'] = result
+			else:
+				writer = WriteQueue(path, profile, maxLatency=mode)
+				result = drive(lambda index, title, count: writer.submit(addItemByManual, did, title, count, 'lb').result())
+				writer.close()
+				result['batch'] = writer.stats['calls'] / writer.stats['batches'] if writer.stats['batches'] else 0
+				results['batch {0:g}ms'.format(mode * 1000)] = result
+		finally:
+			shutil.rmtree(directory, ignore_errors=True)
+
+	return results
+
+
+def printGroupCommit(results):
+	print('{0}{1}{2}{3}{4}'.format('mode'.ljust(14), 'ops/s'.ljust(12), 'p50 ms'.ljust(12), 'p99 ms'.ljust(12), 'calls/batch'))
+	for mode, r in results.items():
+		print('{0}{1}{2}{3}{4:.1f}'.format(mode.ljust(14), '{0:.0f}'.format(r['ops/s']).ljust(12), '{0:.2f}'.format(r['p50']).ljust(12), '{0:.2f}'.format(r['p99']).ljust(12), r['batch']))
+
+
+# Function loadTest()
+# Purpose: Load-test a running DonationService over keep-alive HTTP connections
+# Syntax: loadTest(<host>, <port>, <request_count>, <client_threads>, <seed>)
+# Returns: dict of operation -> {'count', 'errors', 'p50', 'p99', 'req/s'} plus 'total', times in milliseconds
+# Note: Traffic is 20% claims, 60% list-unclaimed pages and 20% add-item calls against the
+#       service's current unclaimed donations, which must exist (see benchService()).
+def loadTest(host, port, requests=5000, clients=16, seed=361):
+
+	def post(conn, name, body):
+		conn.request('POST', '/' + name, json.dumps(body), {'Content-Type': 'application/json'})
+		response = conn.getresponse()
+		payload = response.read()
+		return response.status, json.loads(payload)
+
+	setup = http.client.HTTPConnection(host, port)
+	dids = [row[0] for row in post(setup, 'getUnclaimed', [])[1]['result']]
+	setup.close()
+	if not dids:
+		return dict()
+
+	samples = [[] for i in range(clients)] # (operation, seconds, ok) per request
+	barrier = threading.Barrier(clients)
+	def client(index):
+		rng = random.Random(seed + index)
+		conn = http.client.HTTPConnection(host, port)
+		barrier.wait()
+		for i in range(index, requests, clients):
+			roll = rng.random()
+			start = time.perf_counter()
+			if roll < 0.2:
+				op, (status, body) = 'claim', post(conn, 'claimDonation', [rng.choice(dids), 'R_Usr_{0}'.format(index)])
+			elif roll < 0.8:
+				op, (status, body) = 'list-unclaimed', post(conn, 'getUnclaimedPage', [50])
+			else:
+				op, (status, body) = 'add-item', post(conn, 'addItemByManual', [rng.choice(dids), 'Item {0}'.format(rng.randint(0, 50)), rng.randint(1, 50), 'lb'])
+			samples[index].append((op, time.perf_counter() - start, status == 200))
+		conn.close()
+
+	threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+	start = time.perf_counter()
+	for t in threads: t.start()
+	for t in threads: t.join()
+	seconds = time.perf_counter() - start
+
+	flat = [sample for values in samples for sample in values]
+	results = dict()
+	for op in ['claim', 'list-unclaimed', 'add-item', 'total']:
+		chosen = [sample for sample in flat if op == 'total' or sample[0] == op]
+		times = [sample[1] for sample in chosen]
+		results[op] = {'count': len(chosen), 'errors': sum(1 for sample in chosen if not sample[2]),
+			'p50': percentile(times, 50) * 1000, 'p99': percentile(times, 99) * 1000,
+			'req/s': len(chosen) / seconds if seconds > 0 else 0}
+	return results
+
+
+# Function benchService()
+# Purpose: Seed a temporary database, serve it with DonationService and load-test it
+# Syntax: benchService(<donation_count>, <request_count>, <client_threads>, <workers>, <seed>)
+# Returns: loadTest() results
+def benchService(donations=2000, requests=5000, clients=16, workers=None, seed=361):
+
+	directory, path = tempDatabase()
+	try:
+		db = createSchema(path, 'throughput')
+		seedUsers(db)
+		for i in range(donations):
+			addDonation(db, 'P_Usr_1', None)
+		db.close()
+
+		service = DonationService(path, port=0, workers=workers)
+		server = threading.Thread(target=service.serve_forever)
+		server.start()
+		try:
+			return loadTest(service.server_address[0], service.server_address[1], requests, clients, seed)
+		finally:
+			service.shutdown()
+			server.join()
+	finally:
+		shutil.rmtree(directory, ignore_errors=True)
+
+
+def printService(results):
+	print('{0}{1}{2}{3}{4}{5}'.format('operation'.ljust(16), 'count'.ljust(8), 'errors'.ljust(8), 'p50 ms'.ljust(10), 'p99 ms'.ljust(10), 'req/s'))
+	for op, r in results.items():
+		print('{0}{1}{2}{3}{4}{5:.0f}'.format(op.ljust(16), str(r['count']).ljust(8), str(r['errors']).ljust(8), '{0:.2f}'.format(r['p50']).ljust(10), '{0:.2f}'.format(r['p99']).ljust(10), r['req/s']))
+
+
+if __name__ == '__main__':
+
+	# Usage: python3 Benchmarks.py [profiles|contention|async|groupcommit|service [host:port]]
+	suite = sys.argv[1] if len(sys.argv) > 1 else 'profiles'
+
+	if suite == 'profiles':
+		printProfiles(benchProfiles())
+	elif suite == 'contention':
+		printContention(benchContention())
+	elif suite == 'async':
+		printLatency(benchAsync())
+	elif suite == 'groupcommit':
+		printGroupCommit(benchGroupCommit())
+	elif suite == 'service':
+		if len(sys.argv) > 2:
+			host, port = sys.argv[2].rsplit(':', 1)
+			printService(loadTest(host, int(port)))
+		else:
+			printService(benchService())
@@ -0,0 +1,135 @@
+# CacheHelpers.py implements in-process row caches that notice writes from other connections and processes
+
+import collections, threading
+from TransactionHelpers import inUnitOfWork, afterCommit
+
+# Class RowCache keeps a bounded LRU of rows per database, shared by every connection to it.
+# Entries stay valid across connections and processes by two checks:
+#	cache_versions  Triggers bump a per-table counter (see Schema.py migrations). When
+#	                PRAGMA data_version shows another connection has committed since this
+#	                connection last looked, the counter is re-read; if it moved, every entry
+#	                for that database is dropped.
+#	generation      Each invalidation advances a per-database generation. A fill that started
+#	                before an invalidation is not stored, so a lookup racing a write cannot
+#	                put the old row back.
+# Writes made through the helpers invalidate their own entries directly; the counter covers
+# writes from other processes and from raw SQL on other connections.
+# A connection with an open transaction (e.g. inside unitOfWork()) neither reads nor fills the
+# cache: it may see its own uncommitted writes, which a rollback would leave cached.
+#
+#	hit, value, token = cache.get(db, key)
+#	if not hit:
+#		value = <read row>
+#		cache.put(db, key, value, token)
+class RowCache:
+
+	def __init__(self, table, size):
+		self.table = table # cache_versions row bumped by this table's triggers
+		self.size = size
+		self.stats = {'hits': 0, 'misses': 0}
+		self._entries = collections.OrderedDict() # (database key, key) -> value, least recently used first
+		self._generations = dict() # database key -> generation
+		self._versions = dict() # database key -> last cache_versions value seen
+		self._lock = threading.Lock()
+
+	# Method get()
+	# Purpose: Look up a cached row
+	# Syntax: cache.get(<connection>, <key>)
+	# Returns: (hit, value, token); on a miss pass token to put() with the row read
+	# Note: Connections not opened by Schema.createSchema(), and connections with an open
+	#       transaction, bypass the cache
+	def get(self, db, key):
+
+		dbKey = getattr(db, 'cacheKey', None)
+		if dbKey is None or db.in_transaction:
+			return False, None, None
+		self._sync(db, dbKey)
+
+		with self._lock:
+			entry = (dbKey, key)
+			if entry in self._entries:
+				self._entries.move_to_end(entry)
+				self.stats['hits'] += 1
+				return True, self._entries[entry], None
+			self.stats['misses'] += 1
+			return False, None, self._generations.get(dbKey, 0)
+
+	# Method put()
+	# Purpose: Store a row read after a miss
+	# Syntax: cache.put(<connection>, <key>, <value>, <token>)
+	# Note: Dropped if the cache was invalidated for the database since get() issued token
+	def put(self, db, key, value, token):
+
+		if token is None:
+			return
+		dbKey = db.cacheKey
+		with self._lock:
+			if self._generations.get(dbKey, 0) != token:
+				return
+			entry = (dbKey, key)
+			self._entries[entry] = value
+			self._entries.move_to_end(entry)
+			while len(self._entries) > self.size:
+				self._entries.popitem(last=False)
+
+	# Method invalidate()
+	# Purpose: Drop one cached row, or every row for the database if key is None
+	# Syntax: cache.invalidate(<connection>, <key>)
+	# Note: Inside a unit of work the entry is dropped again after the outermost commit, so
+	#       another connection cannot cache the old row in between
+	def invalidate(self, db, key=None):
+
+		dbKey = getattr(db, 'cacheKey', None)
+		if dbKey is None:
+			return
+		with self._lock:
+			self._invalidate(dbKey, key)
+		if inUnitOfWork(db):
+			afterCommit(db, lambda: self._committed(dbKey, key))
+
+	# Method _committed repeats an invalidation once the unit of work that wrote the row commits
+	def _committed(self, dbKey, key):
+		with self._lock:
+			self._invalidate(dbKey, key)
+
+	# Method info()
+	# Purpose: Report cache effectiveness
+	# Returns: dict with hits, misses and size
+	def info(self):
+		with self._lock:
+			return {'hits': self.stats['hits'], 'misses': self.stats['misses'], 'size': len(self._entries)}
+
+	# Method _invalidate drops entries and advances the generation; caller holds _lock
+	def _invalidate(self, dbKey, key):
+
+		self._generations[dbKey] = self._generations.get(dbKey, 0) + 1
+		if key is not None:
+			self._entries.pop((dbKey, key), None)
+		else:
+			for entry in [entry for entry in self._entries if entry[0] == dbKey]:
+				del self._entries[entry]
+
+	# Method _sync drops the database's entries if another connection changed the table
+	# Note: data_version only changes for commits made by other connections, so the common
+	#       case costs one PRAGMA; the counter is read only after a commit elsewhere
+	def _sync(self, db, dbKey):
+
+		seen = getattr(db, 'cacheSeen', None)
+		if seen is None:
+			seen = db.cacheSeen = dict()
+		c = db.cursor()
+		c.execute('PRAGMA data_version')
+		dataVersion = c.fetchone()[0]
+		if seen.get(self.table) == dataVersion:
+			c.close()
+			return
+		c.execute('''SELECT version FROM cache_versions WHERE name = ?''', (self.table,))
+		result = c.fetchone()
+		c.close()
+		version = result[0] if result is not None else None
+
+		with self._lock:
+			if self._versions.get(dbKey) != version:
+				self._invalidate(dbKey, None)
+				self._versions[dbKey] = version
+		seen[self.table] = dataVersion
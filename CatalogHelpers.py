@@ -0,0 +1,121 @@
+# CatalogHelpers.py implements streaming bulk import of barcode catalogs
+
+import sys, csv, time, itertools
+from DonationHelpers import invalidateBarcode
+from TransactionHelpers import unitOfWork
+
+# Functions:
+# normalizeCode()
+# readCatalog()
+# importCatalog()
+
+# Header names recognised in the first column of a catalog file
+HEADERS = ('code', 'barcode', 'upc', 'plu')
+
+
+# Function normalizeCode()
+# Purpose: Reduce a supplier barcode to the form stored in barcodes.code
+# Syntax: normalizeCode(<barcode>)
+# Returns: code with surrounding whitespace, inner spaces and dashes removed
+# Note: Leading zeros are kept; "0-11535-50192-4" and "011535501924" are the same code
+def normalizeCode(code):
+	return code.strip().replace(' ', '').replace('-', '')
+
+
+# Function readCatalog()
+# Purpose: Stream (code, title, units) rows from a CSV or TSV catalog
+# Syntax: readCatalog(<text_stream>, <delimiter>)
+# Returns: generator of (code, title, units); rows missing any field yield None
+# Note: delimiter None picks tab if the first line contains one, else comma.
+#       A header row whose first field is code/barcode/upc/plu is skipped.
+def readCatalog(stream, delimiter=None):
+
+	first = stream.readline()
+	if not first:
+		return
+	if delimiter is None:
+		delimiter = '\t' if '\t' in first else ','
+
+	for row in csv.reader(itertools.chain([first], stream), delimiter=delimiter):
+		if not row:
+			continue
+		if row[0].strip().lower() in HEADERS:
+			continue
+		if len(row) < 3:
+			yield None
+			continue
+		code, title, units = normalizeCode(row[0]), row[1].strip(), row[2].strip()
+		if not code or not title or not units:
+			yield None
+			continue
+		yield (code, title, units)
+
+
+# Function importCatalog()
+# Purpose: Write a stream of catalog rows into barcodes in large transactions
+# Syntax: importCatalog(<connection>, <rows>, <upsert>, <chunk_size>, <progress>)
+# Returns: dict with read, written, skipped and invalid row counts
+# Note: rows is an iterable such as readCatalog(); None entries count as invalid.
+#       Existing codes are skipped unless upsert is True, which replaces title and units.
+#       Each chunk is one executemany in an explicit transaction, followed by one statement
+#       adding the chunk's new codes to barcodes_fts. progress, if given, is called as
+#       progress(<counts>) after every chunk.
+def importCatalog(db, rows, upsert=False, chunkSize=50000, progress=None):
+
+	if upsert:
+		SQLquery = '''INSERT INTO barcodes(code, title, units) VALUES(?,?,?)
+			ON CONFLICT(code) DO UPDATE SET title = excluded.title, units = excluded.units'''
+	else:
+		SQLquery = '''INSERT OR IGNORE INTO barcodes(code, title, units) VALUES(?,?,?)'''
+
+	counts = {'read': 0, 'written': 0, 'skipped': 0, 'invalid': 0}
+	rows = iter(rows)
+	c = db.cursor()
+	try:
+		while True:
+			batch = list(itertools.islice(rows, chunkSize))
+			if not batch:
+				break
+			chunk = [row for row in batch if row is not None]
+			counts['read'] += len(batch)
+			counts['invalid'] += len(batch) - len(chunk)
+
+			# rowcount sums rows the statement wrote; total_changes would also count trigger writes
+			with unitOfWork(db):
+				c.execute('''SELECT IFNULL(MAX(rowid), 0) FROM barcodes''')
+				last = c.fetchone()[0]
+				c.executemany(SQLquery, chunk)
+				written = c.rowcount if chunk else 0
+				# New codes get rowids above the previous maximum; upserted codes keep theirs and
+				# are re-indexed by the barcodes_fts_update trigger
+				c.execute('''INSERT INTO barcodes_fts(rowid, title) SELECT rowid, title FROM barcodes WHERE rowid > ?''', (last,))
+			counts['written'] += written
+			counts['skipped'] += len(chunk) - written
+
+			if progress is not None:
+				progress(dict(counts))
+	finally:
+		c.close()
+		# Cached entries, including cached misses, may no longer match the table
+		invalidateBarcode(db, None)
+
+	return counts
+
+
+if __name__ == '__main__':
+
+	# Usage: python3 CatalogHelpers.py <catalog_file> <database_path> [upsert]
+	from Schema import createSchema
+
+	if len(sys.argv) < 3:
+		print('Usage: python3 CatalogHelpers.py <catalog_file> <database_path> [upsert]')
+		sys.exit(1)
+
+	db = createSchema(sys.argv[2], 'bulk-load')
+	start = time.perf_counter()
+	def report(counts):
+		print('{0} rows read, {1} written, {2:.1f}s'.format(counts['read'], counts['written'], time.perf_counter() - start))
+	with open(sys.argv[1], newline='') as stream:
+		counts = importCatalog(db, readCatalog(stream), len(sys.argv) > 3 and sys.argv[3] == 'upsert', progress=report)
+	print('Imported {0}: {1} written, {2} skipped, {3} invalid'.format(sys.argv[1], counts['written'], counts['skipped'], counts['invalid']))
+	db.close()
@@ -0,0 +1,181 @@
+# ChangeHelpers.py implements the append-only donation change feed
+
+import sys, datetime, threading, traceback
+from TransactionHelpers import afterCommit, commit
+from ArchiveHelpers import unionSource
+
+# Functions:
+# recordChange()
+# publishChanges()
+# changesSince()
+# latestChange()
+# donationDeltas()
+# pruneChanges()
+# subscribe()
+# unsubscribe()
+
+# Change kinds written to donation_changes.kind
+	# add / delete: donation created or removed
+	# claim / unclaim / complete: donation state transition
+	# items: items in the donation added, edited or removed
+KINDS = ('add', 'delete', 'claim', 'unclaim', 'complete', 'items')
+
+# Subscribers per database key: cacheKey -> [callback, ...], and last sequence delivered
+_subscribers = dict()
+_published = dict()
+_subscriberLock = threading.Lock()
+
+# Donation ids per IN (...) query in donationDeltas()
+IN_BATCH_SIZE = 500
+
+
+# Function recordChange()
+# Purpose: Append a change to the feed inside the caller's transaction
+# Syntax: recordChange(<cursor>, <donation_id>, <kind>)
+# Returns: sequence number of the change
+# Note: Caller owns the transaction and calls publishChanges() after committing
+def recordChange(c, did, kind):
+	now = datetime.datetime.now().replace(microsecond=0)
+	c.execute('''INSERT INTO donation_changes(did, kind, at) VALUES(?,?,?)''', (did, kind, now))
+	return c.lastrowid
+
+
+# Function publishChanges()
+# Purpose: Deliver committed changes to this process's subscribers
+# Syntax: publishChanges(<connection>)
+# Note: Deferred to the outermost commit inside a unit of work; a no-op without subscribers.
+#       Other processes do not see these callbacks and should poll changesSince().
+def publishChanges(db):
+	afterCommit(db, lambda: _publish(db))
+
+
+# Function _publish reads changes past the last delivered sequence and hands them to subscribers
+def _publish(db):
+
+	key = getattr(db, 'cacheKey', None)
+	with _subscriberLock:
+		callbacks = list(_subscribers.get(key, []))
+		since = _published.get(key, 0)
+	if not callbacks:
+		return
+
+	changes = changesSince(db, since, None)
+	if not changes:
+		return
+	with _subscriberLock:
+		if _published.get(key, 0) >= changes[-1][0]:
+			return # Another commit already delivered these
+		changes = [change for change in changes if change[0] > _published.get(key, 0)]
+		_published[key] = changes[-1][0]
+	# The write is already committed: a failing subscriber is reported, never raised to the writer
+	for callback in callbacks:
+		try:
+			callback(changes)
+		except Exception:
+			print('Change subscriber {0!r} failed:'.format(callback), file=sys.stderr)
+			traceback.print_exc()
+
+
+# Function changesSince()
+# Purpose: Get feed entries after a sequence number
+# Syntax: changesSince(<connection>, <sequence>, <limit>)
+# Returns: list of (seq, did, kind, at) in sequence order; [] if none
+# Note: limit None returns every newer change
+def changesSince(db, seq, limit=1000):
+
+	c = db.cursor()
+	if limit is None:
+		c.execute('''SELECT seq, did, kind, at FROM donation_changes WHERE seq > ? ORDER BY seq''', (seq,))
+	else:
+		c.execute('''SELECT seq, did, kind, at FROM donation_changes WHERE seq > ? ORDER BY seq LIMIT ?''', (seq, limit))
+	result = c.fetchall()
+	c.close()
+	return result
+
+
+# Function latestChange()
+# Purpose: Get the newest sequence number, for a client starting from a full read
+# Syntax: latestChange(<connection>)
+# Returns: sequence number, 0 if the feed is empty
+def latestChange(db):
+
+	c = db.cursor()
+	c.execute('''SELECT MAX(seq) FROM donation_changes''')
+	result = c.fetchone()
+	c.close()
+
+	if result[0] is not None:
+		return result[0]
+	else:
+		return 0
+
+
+# Function donationDeltas()
+# Purpose: Get what a client view needs to catch up from a sequence number
+# Syntax: donationDeltas(<connection>, <sequence>, <limit>)
+# Returns: (new_sequence, changed_donation_rows, deleted_donation_ids)
+# Note: Changed rows are read as they are now, so several changes to one donation
+#       collapse into one row. Pass new_sequence back on the next call.
+#       Archived donations are still rows, not deletions, if the archive is attached;
+#       on a connection without it they are reported as deleted.
+def donationDeltas(db, seq, limit=1000):
+
+	changes = changesSince(db, seq, limit)
+	if not changes:
+		return (seq, [], [])
+
+	dids = list(dict.fromkeys(change[1] for change in changes))
+	rows = dict()
+	c = db.cursor()
+	for i in range(0, len(dids), IN_BATCH_SIZE):
+		batch = dids[i:i + IN_BATCH_SIZE]
+		c.execute(''.join(['SELECT * FROM ', unionSource(db, 'donations'), ' WHERE id IN (', ','.join('?' * len(batch)), ')']), batch)
+		for row in c.fetchall():
+			rows[row[0]] = row
+	c.close()
+
+	changed = [rows[did] for did in dids if did in rows]
+	deleted = [did for did in dids if did not in rows]
+	return (changes[-1][0], changed, deleted)
+
+
+# Function pruneChanges()
+# Purpose: Drop feed entries every client has already consumed
+# Syntax: pruneChanges(<connection>, <sequence>)
+# Returns: number of entries removed
+# Note: Sequence numbers are never reused, so pruning does not confuse clients
+def pruneChanges(db, seq):
+
+	c = db.cursor()
+	c.execute('''DELETE FROM donation_changes WHERE seq <= ?''', (seq,))
+	result = c.rowcount
+	commit(db)
+	c.close()
+	return result
+
+
+# Function subscribe()
+# Purpose: Receive changes committed through this process as they happen
+# Syntax: subscribe(<connection>, <callback>)
+# Note: callback(<changes>) gets the list of new (seq, did, kind, at) entries after each
+#       commit on any connection to the same database. Keep callbacks short; they run on
+#       the committing thread. An exception from callback is printed to stderr and does not
+#       fail the write or stop delivery to other callbacks.
+def subscribe(db, callback):
+
+	key = getattr(db, 'cacheKey', None)
+	with _subscriberLock:
+		if key not in _published:
+			_published[key] = latestChange(db)
+		_subscribers.setdefault(key, []).append(callback)
+
+
+# Function unsubscribe()
+# Purpose: Stop delivering changes to a callback
+# Syntax: unsubscribe(<connection>, <callback>)
+def unsubscribe(db, callback):
+
+	key = getattr(db, 'cacheKey', None)
+	with _subscriberLock:
+		if callback in _subscribers.get(key, []):
+			_subscribers[key].remove(callback)
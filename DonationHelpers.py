@@ -1,4 +1,12 @@
-import datetime
+import datetime, base64, json
+from TransactionHelpers import commit
+from ChangeHelpers import recordChange, publishChanges
+from LocationHelpers import validLocation, writeDonationLocation, removeDonationLocation
+from RollupHelpers import applyRollup, retractRollup
+from InventoryHelpers import applyInventory, retractInventory, transitionInventory
+from ArchiveHelpers import unionSource
+from CacheHelpers import RowCache
+from MetricsHelpers import instrumentModule
 # DonationHelpers.py implements helper functions for manipulating the item table
 
 # Functions:
@@ -11,6 +19,12 @@ import datetime
 # getProviderComplete()
 # getReceiverPending()
 # getReceiverComplete()
+# getProviderPendingPage() / getProviderCompletePage()
+# getReceiverPendingPage() / getReceiverCompletePage() / getUnclaimedPage()
+# streamProviderPending() / streamProviderComplete() / streamReceiverPending() / streamReceiverComplete()
+# streamUnclaimed() / streamDonationItems() / streamAllDonations() / streamAllItems()
+# attachItems() / getProviderPendingWithItems() / getProviderCompleteWithItems()
+# getReceiverPendingWithItems() / getReceiverCompleteWithItems() / getUnclaimedWithItems()
 # viewDonationItems()
 # claimDonation()
 # unclaimDonation()
@@ -19,14 +33,31 @@ import datetime
 # existBarcode() 
 # existItem() 
 # existDonation() 
+# getBarcode()
+# invalidateBarcode()
+# barcodeCacheStats()
+
+# Donation ids per items query in attachItems(), below SQLite's host parameter limit
+IN_BATCH_SIZE = 500
+
+# Rows fetched per round trip by the stream*() getters
+STREAM_BATCH_SIZE = 500
+
+# Cached barcode catalog: code -> (title, units), or None for unknown codes, see CacheHelpers.py
+BARCODE_CACHE_SIZE = 8192
+_barcodeCache = RowCache('barcodes', BARCODE_CACHE_SIZE)
 
 # Function addDonation()
 # Purpose: Creates a new donation in donation table
-# Syntax: addDonation(<connection>, <provider>, <receiver>)
+# Syntax: addDonation(<connection>, <provider>, <receiver>, <(lat, lon)>)
 # Returns: donation.id if donation is successfully created, else -1
 # Note: receiver should be None unless receiver is known in advance
-def addDonation(db, provider, receiver):
+# Note: location is optional pickup coordinates for getUnclaimedNear(); -1 if out of range
+def addDonation(db, provider, receiver, location=None):
 	
+	if location is not None and not validLocation(location[0], location[1]):
+		return -1
+
 	c = db.cursor()
 	now = datetime.datetime.now().replace(microsecond=0)
 	
@@ -37,8 +68,12 @@ def addDonation(db, provider, receiver):
 		# If receiver specified
 		c.execute('''INSERT INTO donations(provider, receiver, created, completed) VALUES(?,?,?,?)''', (provider, receiver, now, 0))
 	result = c.lastrowid
-	db.commit()
+	if location is not None:
+		writeDonationLocation(c, result, location[0], location[1])
+	recordChange(c, result, 'add')
+	commit(db)
 	c.close()
+	publishChanges(db)
 
 	if result is not None:	# Per https://www.python.org/dev/peps/pep-0249/#lastrowid no insert returns None
 		return result
@@ -54,8 +89,11 @@ def deleteDonation(db, did):
 	c = db.cursor()
 
 	# Delete donation and items
+	_beforeItemsChange(c, did)
 	c.execute('''DELETE FROM donations WHERE id = ?''', (did,))
+	deleted = c.rowcount
 	c.execute('''DELETE FROM items WHERE did = ?''', (did,))
+	removeDonationLocation(c, did)
 
 	# Confirm donation deletion
 	c.execute('''SELECT * FROM donations WHERE id = ?''', (did,))
@@ -66,6 +104,10 @@ def deleteDonation(db, did):
 	result = c.fetchall()
 	success = True if success and len(result) is 0 else False
 
+	if deleted:
+		_afterItemsChange(db, c, did, 'delete')
+	else:
+		commit(db)
 	c.close()
 	return success
 
@@ -90,9 +132,11 @@ def editDonation(db, did, iid, count):
 		SQLargs = (iid, did)
 
 	# Execute expression and check for success
+	_beforeItemsChange(c, did)
 	c.execute(SQLquery, SQLargs)
 	c.execute('''SELECT * FROM items WHERE id = ? AND did = ?''', (iid, did))
 	result = c.fetchone()
+	_afterItemsChange(db, c, did)
 	c.close()
 	newCount = result[4] if result is not None else 0
 
@@ -112,22 +156,10 @@ def addItemByManual(db, did, title, count, unit):
 	if not existDonation(db, did):
 		return -1
 
-	# Test for matching item in table
 	c = db.cursor()
-	c.execute('''SELECT id, count FROM items WHERE did=? AND title=? AND units=?''', (did, title, unit))
-	result = c.fetchone()
-
-	# Item in table: add count to existing item
-	if result is not None: 
-		newCount = result[1] + count
-		c.execute('''UPDATE items SET count = ? WHERE id = ?''', (newCount, result[0]))
-
-	# Item not in table: add new item to table
-	else:
-		c.execute('''INSERT INTO items(did, title, count, units) VALUES(?,?,?,?)''', (did, title, count, unit))
-
-	result = c.lastrowid
-	db.commit()
+	_beforeItemsChange(c, did)
+	result = _mergeItem(c, did, None, title, unit, count)
+	_afterItemsChange(db, c, did)
 	c.close()
 
 	if result is not None:	# Per https://www.python.org/dev/peps/pep-0249/#lastrowid no insert returns None
@@ -146,52 +178,72 @@ def addItemByBarcode(db, did, code, count):
 	if not existDonation(db, did):
 		return -1
 
-	if not existBarcode(db, code):
+	# Get barcode data
+	codeData = getBarcode(db, code)
+	if codeData is None:
 		return -1
 
 	# Permit negative count for quick scanning: 1 code == 1 count
 	if count < 1:
 		count = 1
 
-	# Get barcode data
 	c = db.cursor()
-	c.execute('''SELECT title, units FROM barcodes WHERE code = ?''', (code,))
-	codeData = c.fetchone()
+	_beforeItemsChange(c, did)
+	result = _mergeItem(c, did, code, codeData[0], codeData[1], count)
+	_afterItemsChange(db, c, did)
+	c.close()
+
+	if result is not None:	# Per https://www.python.org/dev/peps/pep-0249/#lastrowid no insert returns None
+		return result
+	else: 
+		return -1
+
+# Function _mergeItem adds count to the donation's item with the same title and units, or inserts it
+# Returns: the item id; a barcode, if given, labels the row as the last code scanned
+# Note: Shared with ScanSession.flush(); run between _beforeItemsChange() and _afterItemsChange()
+def _mergeItem(c, did, code, title, units, count):
 
 	# Test for matching item in table
-	c.execute('''SELECT id, count FROM items WHERE did=? AND title=? AND units=?''', (did, codeData[0], codeData[1]))
+	c.execute('''SELECT id, count FROM items WHERE did=? AND title=? AND units=?''', (did, title, units))
 	result = c.fetchone()
 
 	# Item in table: add count to existing item
-	if result is not None: 
-		newCount = result[1] + count
-		c.execute('''UPDATE items SET count = ?, barcode = ? WHERE id = ?''', (newCount, code, result[0]))
+	if result is not None:
+		if code is None:
+			c.execute('''UPDATE items SET count = ? WHERE id = ?''', (result[1] + count, result[0]))
+		else:
+			c.execute('''UPDATE items SET count = ?, barcode = ? WHERE id = ?''', (result[1] + count, code, result[0]))
+		return result[0]
 
 	# Item not in table: add new item to table
-	else:
-		c.execute('''INSERT INTO items(did, barcode, title, count, units) VALUES(?,?,?,?,?)''', (did, code, codeData[0], count, codeData[1]))
+	c.execute('''INSERT INTO items(did, barcode, title, count, units) VALUES(?,?,?,?,?)''', (did, code, title, count, units))
+	return c.lastrowid
 
-	result = c.lastrowid
-	db.commit()
-	c.close()
 
-	if result is not None:	# Per https://www.python.org/dev/peps/pep-0249/#lastrowid no insert returns None
-		return result
-	else: 
-		return -1
+# Function _beforeItemsChange withdraws a donation's contribution to every table derived from its items
+# Note: Every write to a donation's items calls this first and _afterItemsChange() after, in the
+#       same transaction; a new derived table adds its retract/apply hooks to this pair only
+def _beforeItemsChange(c, did):
+	retractRollup(c, did)
+	retractInventory(c, did)
+
+
+# Function _afterItemsChange restores the contribution, records kind in the change feed and commits
+# Note: Subscribers hear of the change after commit, or after the outermost unit of work commits
+def _afterItemsChange(db, c, did, kind='items'):
+	applyRollup(c, did)
+	applyInventory(c, did)
+	recordChange(c, did, kind)
+	commit(db)
+	publishChanges(db)
+
 
 # Function _getDonations gets donations as defined by the two-bit string types.
 # types LSD is pending(0)/completed(1) | types MSD is provider(0)/receiver(1)
 def _getDonations(db, uid, types):
 
-	# Decode types bit string
-	role = 'receiver' if (0b10 & types == 0b10) else 'provider'
-	status = 'completed' if (0b1 & types == 0b1) else 'pending'
-
 	# Build SQL query
-	SQLquery = 'SELECT * FROM donations WHERE'
-	SQLquery = ''.join([SQLquery, ' receiver = ?']) if role is 'receiver' else ''.join([SQLquery, ' provider = ?'])
-	SQLquery = ''.join([SQLquery, ' AND completed != 0']) if status == 'completed' else ''.join([SQLquery, ' AND completed = 0'])
+	SQLquery = ''.join(['SELECT * FROM ', _donationSource(db, types), ' WHERE', _donationFilter(types)])
 	
 	# Get and return rows
 	c = db.cursor()
@@ -201,6 +253,80 @@ def _getDonations(db, uid, types):
 	return result
 
 
+# Function _donationFilter returns the WHERE conditions for the two-bit string types
+def _donationFilter(types):
+
+	# Decode types bit string
+	role = 'receiver' if (0b10 & types == 0b10) else 'provider'
+	status = 'completed' if (0b1 & types == 0b1) else 'pending'
+
+	SQLfilter = ' receiver = ?' if role == 'receiver' else ' provider = ?'
+	SQLfilter = ''.join([SQLfilter, ' AND completed != 0']) if status == 'completed' else ''.join([SQLfilter, ' AND completed = 0'])
+	return SQLfilter
+
+
+# Function _donationSource names the donation rows for types: completed donations may be archived
+def _donationSource(db, types):
+	return unionSource(db, 'donations') if (0b1 & types == 0b1) else 'donations'
+
+
+# Function _getDonationsPage gets one page of donations as defined by types (see _getDonations)
+# Syntax: _getDonationsPage(<connection>, <uid>, <types>, <page_size>, <cursor>, <newest_first>)
+# Returns: (rows, next_cursor); next_cursor is None on the last page
+# Note: Keyset pagination on (created, id): each page is an index range read from the
+#       cursor position, so page cost does not grow with table size as OFFSET would.
+#       Pending pages are read straight from the index; completed pages sort the matches.
+#       A page_size below 1 or a malformed cursor returns an empty last page.
+def _getDonationsPage(db, uid, types, limit=50, cursor=None, newest=True):
+
+	if limit < 1:
+		return ([], None)
+
+	SQLquery = ''.join(['SELECT * FROM ', _donationSource(db, types), ' WHERE', _donationFilter(types)])
+	SQLargs = [uid]
+
+	# Resume after the last row of the previous page
+	if cursor is not None:
+		position = _decodeCursor(cursor)
+		if position is None:
+			return ([], None)
+		SQLquery = ''.join([SQLquery, ' AND (created, id) < (?, ?)' if newest else ' AND (created, id) > (?, ?)'])
+		SQLargs.extend(position)
+
+	SQLquery = ''.join([SQLquery, ' ORDER BY created DESC, id DESC' if newest else ' ORDER BY created, id', ' LIMIT ?'])
+	SQLargs.append(limit + 1) # One extra row tells whether another page exists
+
+	c = db.cursor()
+	c.execute(SQLquery, SQLargs)
+	result = c.fetchall()
+	c.close()
+
+	if len(result) > limit:
+		result = result[:limit]
+		return (result, _encodeCursor(result[-1]))
+	return (result, None)
+
+
+# Function _encodeCursor packs a donation row's (created, id) into an opaque page cursor
+def _encodeCursor(row):
+	return base64.urlsafe_b64encode(json.dumps([row[3], row[0]]).encode()).decode()
+
+
+# Function _decodeCursor unpacks a page cursor, returning None if it is malformed
+# A cursor is a JSON [created, id] pair as written by _encodeCursor(); anything else is rejected
+def _decodeCursor(cursor):
+	try:
+		position = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+	except (ValueError, TypeError, AttributeError):
+		return None
+	if not isinstance(position, list) or len(position) != 2:
+		return None
+	created, did = position
+	if not isinstance(created, (str, int)) or isinstance(created, bool) or not isinstance(did, int) or isinstance(did, bool):
+		return None
+	return (created, did)
+
+
 # Function getProviderPending returns all pending donations by provider
 def getProviderPending(db, uid):
 	return _getDonations(db, uid, 0)
@@ -226,6 +352,33 @@ def getUnclaimed(db):
 	return _getDonations(db, 'pending', 2)
 
 
+# Function getProviderPendingPage returns a page of pending donations by provider
+def getProviderPendingPage(db, uid, limit=50, cursor=None, newest=True):
+	return _getDonationsPage(db, uid, 0, limit, cursor, newest)
+
+
+# Function getProviderCompletePage returns a page of completed donations by provider
+def getProviderCompletePage(db, uid, limit=50, cursor=None, newest=True):
+	return _getDonationsPage(db, uid, 1, limit, cursor, newest)
+
+
+# Function getReceiverPendingPage returns a page of pending donations by receiver
+def getReceiverPendingPage(db, uid, limit=50, cursor=None, newest=True):
+	return _getDonationsPage(db, uid, 2, limit, cursor, newest)
+
+
+# Function getReceiverCompletePage returns a page of completed donations by receiver
+def getReceiverCompletePage(db, uid, limit=50, cursor=None, newest=True):
+	return _getDonationsPage(db, uid, 3, limit, cursor, newest)
+
+
+# Function getUnclaimedPage returns a page of unclaimed packages
+# Syntax: getUnclaimedPage(<connection>, <page_size>, <cursor>, <newest_first>)
+# Returns: (rows, next_cursor); pass next_cursor back for the following page, None when done
+def getUnclaimedPage(db, limit=50, cursor=None, newest=True):
+	return _getDonationsPage(db, 'pending', 2, limit, cursor, newest)
+
+
 # Function getDonationItems()
 # Purpose: returns a list of items by donation id
 # Syntax: getDonationItems(<connection>, <donation_id>)
@@ -233,59 +386,140 @@ def getUnclaimed(db):
 def getDonationItems(db, did):
 
 	c = db.cursor()
-	c.execute('''SELECT * from items WHERE did = ?''', (did,))
+	c.execute(''.join(['SELECT * FROM ', unionSource(db, 'items'), ' WHERE did = ?']), (did,))
 	result = c.fetchall()
 	c.close()
 	return result
 
 
+# Function attachItems()
+# Purpose: Pair donation rows with their items using batched IN (...) queries
+# Syntax: attachItems(<connection>, <donation_list>)
+# Returns: list of (donation, item_list) in donation order; item_list matches getDonationItems()
+# Note: One items query per IN_BATCH_SIZE donations instead of one per donation
+def attachItems(db, donations):
+
+	items = dict((d[0], []) for d in donations)
+	dids = list(items.keys())
+
+	c = db.cursor()
+	for i in range(0, len(dids), IN_BATCH_SIZE):
+		batch = dids[i:i + IN_BATCH_SIZE]
+		c.execute(''.join(['SELECT * FROM ', unionSource(db, 'items'), ' WHERE did IN (', ','.join('?' * len(batch)), ')']), batch)
+		for row in c.fetchall():
+			items[row[1]].append(row)
+	c.close()
+
+	return [(d, items[d[0]]) for d in donations]
+
+
+# Function getProviderPendingWithItems returns pending donations by provider with their items
+def getProviderPendingWithItems(db, uid):
+	return attachItems(db, _getDonations(db, uid, 0))
+
+
+# Function getProviderCompleteWithItems returns completed donations by provider with their items
+def getProviderCompleteWithItems(db, uid):
+	return attachItems(db, _getDonations(db, uid, 1))
+
+
+# Function getReceiverPendingWithItems returns pending donations by receiver with their items
+def getReceiverPendingWithItems(db, uid):
+	return attachItems(db, _getDonations(db, uid, 2))
+
+
+# Function getReceiverCompleteWithItems returns completed donations by receiver with their items
+def getReceiverCompleteWithItems(db, uid):
+	return attachItems(db, _getDonations(db, uid, 3))
+
+
+# Function getUnclaimedWithItems returns unclaimed packages with their items
+def getUnclaimedWithItems(db):
+	return attachItems(db, _getDonations(db, 'pending', 2))
+
+
+# Function _streamRows()
+# Purpose: Yield the rows of a query lazily in fetchmany batches
+# Syntax: _streamRows(<connection>, <query>, <args>, <batch_size>)
+# Returns: generator of rows; memory is bounded by batch_size, not result size
+# Note: The cursor closes when the generator is exhausted, closed or garbage collected
+def _streamRows(db, SQLquery, SQLargs, batchSize):
+
+	c = db.cursor()
+	try:
+		c.execute(SQLquery, SQLargs)
+		while True:
+			rows = c.fetchmany(batchSize)
+			if not rows:
+				break
+			for row in rows:
+				yield row
+	finally:
+		c.close()
+
+
+# Function streamProviderPending yields pending donations by provider
+def streamProviderPending(db, uid, batchSize=STREAM_BATCH_SIZE):
+	return _streamRows(db, ''.join(['SELECT * FROM donations WHERE', _donationFilter(0)]), (uid,), batchSize)
+
+
+# Function streamProviderComplete yields completed donations by provider
+def streamProviderComplete(db, uid, batchSize=STREAM_BATCH_SIZE):
+	return _streamRows(db, ''.join(['SELECT * FROM ', _donationSource(db, 1), ' WHERE', _donationFilter(1)]), (uid,), batchSize)
+
+
+# Function streamReceiverPending yields pending donations by receiver
+def streamReceiverPending(db, uid, batchSize=STREAM_BATCH_SIZE):
+	return _streamRows(db, ''.join(['SELECT * FROM donations WHERE', _donationFilter(2)]), (uid,), batchSize)
+
+
+# Function streamReceiverComplete yields completed donations by receiver
+def streamReceiverComplete(db, uid, batchSize=STREAM_BATCH_SIZE):
+	return _streamRows(db, ''.join(['SELECT * FROM ', _donationSource(db, 3), ' WHERE', _donationFilter(3)]), (uid,), batchSize)
+
+
+# Function streamUnclaimed yields unclaimed packages
+def streamUnclaimed(db, batchSize=STREAM_BATCH_SIZE):
+	return _streamRows(db, ''.join(['SELECT * FROM donations WHERE', _donationFilter(2)]), ('pending',), batchSize)
+
+
+# Function streamDonationItems yields the items in a donation
+def streamDonationItems(db, did, batchSize=STREAM_BATCH_SIZE):
+	return _streamRows(db, ''.join(['SELECT * FROM ', unionSource(db, 'items'), ' WHERE did = ?']), (did,), batchSize)
+
+
+# Function streamAllDonations yields every donation in id order, for reporting
+def streamAllDonations(db, batchSize=STREAM_BATCH_SIZE):
+	return _streamRows(db, '''SELECT * FROM donations ORDER BY id''', (), batchSize)
+
+
+# Function streamAllItems yields every item in id order, for reporting
+def streamAllItems(db, batchSize=STREAM_BATCH_SIZE):
+	return _streamRows(db, '''SELECT * FROM items ORDER BY id''', (), batchSize)
+
+
 # Function claimDonation()
 # Purpose: assign a receiver to an unclaimed donation
 # Syntax: claimDonation(<connection>, <donation_id>, <recevier_uid>)
 # Returns: On successful update to donation receiver field returns True, else False
+# Note: State check and update are one conditional UPDATE, so when receivers race for a
+#       donation, across threads or processes sharing a database, exactly one succeeds.
+#       'pending' marks an unclaimed donation and is never a receiver uid.
 def claimDonation(db, did, rid):
-
-	final = False
-	c = db.cursor()
-	c.execute('''SELECT receiver, completed FROM donations WHERE id = ?''', (did,))
-	result = c.fetchone()
-
-	if result is not None:
-		if (result[0] == 'pending') and (result[1] == 0):
-			c.execute('''UPDATE donations SET receiver = ? WHERE id = ?''', (rid, did))
-			c.execute('''SELECT receiver FROM donations WHERE id = ?''', (did,))
-			result = c.fetchone()
-			if result is not None:
-				if result[0] == rid:
-					final = True
-	db.commit
-	c.close()
-	return final
+	if rid == 'pending':
+		return False
+	return _transition(db, did, 'claim', '''UPDATE donations SET receiver = ? WHERE id = ? AND receiver = 'pending' AND completed = 0''', (rid, did))
 
 
 # Function unclaimDonation()
 # Purpose: remove a receiver from a claimed donation
 # Syntax: unclaimDonation(<connection>, <donation_id>, <recevier_uid>)
 # Returns: On successful update to donation receiver field returns True, else False
+# Note: Fails for rid 'pending', which would match a donation nobody has claimed
 def unclaimDonation(db, did, rid):
-
-
-	final = False
-	c = db.cursor()
-	c.execute('''SELECT receiver, completed FROM donations WHERE id = ?''', (did,))
-	result = c.fetchone()
-
-	if result is not None:
-		if (result[0] == rid) and (result[1] == 0):
-			c.execute('''UPDATE donations SET receiver = ? WHERE id = ?''', ('pending', did))
-			c.execute('''SELECT receiver FROM donations WHERE id = ?''', (did,))
-			result = c.fetchone()
-			if result is not None:
-				if result[0] == 'pending':
-					final = True
-	db.commit
-	c.close()
-	return final
+	if rid == 'pending':
+		return False
+	return _transition(db, did, 'unclaim', '''UPDATE donations SET receiver = 'pending' WHERE id = ? AND receiver = ? AND completed = 0''', (did, rid))
 
 
 # Function completeDonation()
@@ -293,22 +527,26 @@ def unclaimDonation(db, did, rid):
 # Syntax: completeDonation(<connection>, <donation_id>)
 # Returns: On successful update returns True, else False
 def completeDonation(db, did):
+	now = datetime.datetime.now().replace(microsecond=0)
+	return _transition(db, did, 'complete', '''UPDATE donations SET completed = ? WHERE id = ? AND completed = 0''', (now, did))
 
-	final = False
-	c = db.cursor()
-	c.execute('''SELECT completed FROM donations WHERE id = ?''', (did,))
-	result = c.fetchone()
 
-	if result is not None:
-		if result[0] is 0:
-			now = datetime.datetime.now().replace(microsecond=0)
-			c.execute('''UPDATE donations SET completed = ? WHERE id = ?''', (now, did))
-			c.execute('''SELECT completed FROM donations WHERE id = ?''', (did,))
-			result = c.fetchone()
-			if result is not None:
-				if result[0] is now: final = True
-	db.commit
+# Function _transition applies a conditional state UPDATE, records it in the change feed and commits
+# Returns: True if exactly one donation row matched its expected state, else False
+def _transition(db, did, kind, SQLquery, SQLargs):
+
+	c = db.cursor()
+	c.execute(SQLquery, SQLargs)
+	final = c.rowcount == 1
+	if final:
+		if kind == 'complete':
+			applyRollup(c, did)
+		transitionInventory(c, did, kind)
+		recordChange(c, did, kind)
+	commit(db)
 	c.close()
+	if final:
+		publishChanges(db)
 	return final
 
 
@@ -325,14 +563,16 @@ def addBarcode(db, code, title, units):
 		c.close()
 		return False
 
-	# Add barcode 
+	# Add barcode and its search entry (Schema.py migration 16)
 	c.execute('''INSERT into barcodes(code, title, units) VALUES(?,?,?)''', (code, title, units))
+	c.execute('''INSERT INTO barcodes_fts(rowid, title) VALUES(?,?)''', (c.lastrowid, title))
 	
 	# Test success
 	c.execute('''SELECT * FROM barcodes WHERE code = ?''', (code,))
 	result = c.fetchone()
-	db.commit
+	commit(db)
 	c.close()
+	invalidateBarcode(db, code)
 
 	if result is not None:
 		return True
@@ -347,10 +587,7 @@ def addBarcode(db, code, title, units):
 # Note: code is unique column, so 0 and 1 are only lengths possible
 def existBarcode(db, code):
 	
-	c = db.cursor()
-	c.execute('''SELECT code FROM barcodes WHERE code=?''', (code,))
-	result = c.fetchone()
-	c.close()
+	result = getBarcode(db, code)
 
 	if result is not None:
 		return True
@@ -392,3 +629,45 @@ def existDonation(db, did):
 		return True
 	else:
 		return False
+
+
+# Function getBarcode()
+# Purpose: Look up a barcode's catalog entry through the barcode cache
+# Syntax: getBarcode(<connection>, <barcode>)
+# Returns: (title, units) if barcode exists, else None
+# Note: Bounded LRU per database, shared by its connections. Unknown codes are cached
+#       as None until addBarcode() or invalidateBarcode() clears them, or until another
+#       connection or process writes to barcodes (e.g. importCatalog()).
+def getBarcode(db, code):
+
+	hit, result, token = _barcodeCache.get(db, code)
+	if hit:
+		return result
+
+	c = db.cursor()
+	c.execute('''SELECT title, units FROM barcodes WHERE code = ?''', (code,))
+	result = c.fetchone()
+	c.close()
+
+	_barcodeCache.put(db, code, result, token)
+	return result
+
+
+# Function invalidateBarcode()
+# Purpose: Drop a cached barcode so the next lookup reads the barcodes table
+# Syntax: invalidateBarcode(<connection>, <barcode>)
+# Note: barcode None drops every cached barcode for the database, e.g. after a bulk import
+def invalidateBarcode(db, code):
+	_barcodeCache.invalidate(db, code)
+
+
+# Function barcodeCacheStats()
+# Purpose: Report barcode cache effectiveness
+# Syntax: barcodeCacheStats()
+# Returns: dict with hits, misses and size
+def barcodeCacheStats():
+	return _barcodeCache.info()
+
+
+# Record call counts, wall time and SQL statements per helper (see MetricsHelpers.py)
+instrumentModule(__name__)
@@ -0,0 +1,305 @@
+# DonationService.py implements a local HTTP/JSON service over DonationHelpers and UserHelpers
+
+import os, sys, json, time, socket, selectors, threading
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+import DonationHelpers, UserHelpers
+from AsyncHelpers import DONATION_HELPERS, USER_HELPERS
+from PoolHelpers import ConnectionPool
+from MetricsHelpers import exportMetrics
+
+# Endpoints (stdlib only; no authentication, so bind to a trusted interface):
+#
+#	POST /<helper>          body: JSON list of positional args, or object of keyword args
+#	                        200 {"result": <helper's return value>}
+#	GET  /stream/<stream>   query string: keyword args, e.g. /stream/streamUnclaimed
+#	                        200 chunked JSON array, one batch of rows per chunk
+#	GET  /health            200 {"result": true}
+#	GET  /metrics           200 per-helper counters as Prometheus text (see MetricsHelpers.py)
+#
+#	curl -d '["P_Usr_1", null]' localhost:8361/addDonation   -> {"result": 12}
+#	curl -d '{"did": 12, "rid": "R_Usr_1"}' localhost:8361/claimDonation
+#
+# Helpers take the connection first; the service supplies it from a ConnectionPool, so
+# getters and exist*() checks run on pooled readers and mutations on the writer.
+SERVICE_HELPERS = dict([(name, getattr(DonationHelpers, name)) for name in DONATION_HELPERS] +
+	[(name, getattr(UserHelpers, name)) for name in USER_HELPERS])
+SERVICE_STREAMS = dict((name, getattr(DonationHelpers, name)) for name in [
+	'streamProviderPending', 'streamProviderComplete', 'streamReceiverPending', 'streamReceiverComplete',
+	'streamUnclaimed', 'streamDonationItems', 'streamAllDonations', 'streamAllItems'])
+
+SERVICE_PORT = 8361
+KEEPALIVE_TIMEOUT = 15.0 # Seconds an idle keep-alive connection is kept open
+MAX_BODY = 1048576 # Largest request body accepted, in bytes
+
+
+# Class DonationRequestHandler answers one request per dispatch; DonationService re-queues
+# keep-alive connections between requests so an idle client never occupies a worker
+class DonationRequestHandler(BaseHTTPRequestHandler):
+
+	protocol_version = 'HTTP/1.1' # Persistent connections unless the client asks to close
+	server_version = 'DonationService/1.0'
+
+	def handle(self):
+		self.close_connection = True
+		self.handle_one_request()
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			BaseHTTPRequestHandler.log_message(self, format, *args)
+
+	def do_GET(self):
+
+		url = urlsplit(self.path)
+		parts = url.path.strip('/').split('/')
+		if parts == ['health']:
+			return self._send(200, {'result': True})
+		if parts == ['metrics']:
+			return self._sendText(200, exportMetrics())
+		if len(parts) != 2 or parts[0] != 'stream' or parts[1] not in SERVICE_STREAMS:
+			return self._send(404, {'error': 'unknown stream {0}'.format(url.path)})
+		self._stream(SERVICE_STREAMS[parts[1]], dict(parse_qsl(url.query)))
+
+	def do_POST(self):
+
+		# Every reply on a kept connection must consume the body first, or its bytes are read
+		# as the next request; a body that cannot be consumed closes the connection instead
+		try:
+			length = int(self.headers.get('Content-Length') or 0)
+		except ValueError:
+			length = -1
+		if length < 0 or 'Transfer-Encoding' in self.headers:
+			self.close_connection = True
+			return self._send(400, {'error': 'request body needs a valid Content-Length'})
+		if length > MAX_BODY:
+			self.close_connection = True
+			return self._send(413, {'error': 'request body too large'})
+		data = self.rfile.read(length)
+
+		name = urlsplit(self.path).path.strip('/')
+		if name not in SERVICE_HELPERS:
+			return self._send(404, {'error': 'unknown helper {0}'.format(name)})
+		try:
+			body = json.loads(data or b'[]')
+		except ValueError:
+			return self._send(400, {'error': 'body is not JSON'})
+		if isinstance(body, list):
+			args, kwargs = body, {}
+		elif isinstance(body, dict):
+			args, kwargs = [], body
+		else:
+			return self._send(400, {'error': 'body must be a JSON list or object'})
+
+		try:
+			result = self.server.pool.call(SERVICE_HELPERS[name], *args, **kwargs)
+		except TypeError as e:
+			return self._send(400, {'error': str(e)})
+		except Exception as e:
+			return self._send(500, {'error': '{0}: {1}'.format(type(e).__name__, e)})
+		self._send(200, {'result': result})
+
+	# Method _send writes a complete JSON response with Content-Length, keeping the connection
+	# unless the request set close_connection
+	def _send(self, status, payload):
+
+		body = json.dumps(payload, default=str).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		if self.close_connection:
+			self.send_header('Connection', 'close')
+		self.end_headers()
+		self.wfile.write(body)
+
+	# Method _sendText writes a complete plain-text response, keeping the connection
+	def _sendText(self, status, text):
+
+		body = text.encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	# Method _stream writes a listing as a chunked JSON array while rows are read in batches
+	# Note: Memory is bounded by one batch; the reader connection is held until the last chunk
+	def _stream(self, func, kwargs):
+
+		with self.server.pool.read() as db:
+			try:
+				rows = func(db, **kwargs)
+				first = next(rows, None)
+			except TypeError as e:
+				return self._send(400, {'error': str(e)})
+
+			self.send_response(200)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Transfer-Encoding', 'chunked')
+			self.end_headers()
+
+			batch = []
+			prefix = '['
+			if first is not None:
+				batch.append(first)
+				for row in rows:
+					batch.append(row)
+					if len(batch) >= DonationHelpers.STREAM_BATCH_SIZE:
+						self._chunk(prefix + ','.join(json.dumps(r, default=str) for r in batch))
+						batch = []
+						prefix = ','
+			self._chunk(prefix + ','.join(json.dumps(r, default=str) for r in batch) + ']')
+			self.wfile.write(b'0\r\n\r\n')
+
+	def _chunk(self, text):
+		data = text.encode()
+		self.wfile.write('{0:X}\r\n'.format(len(data)).encode() + data + b'\r\n')
+
+
+# Class DonationService accepts connections on one thread and answers requests on a worker pool
+# Syntax: DonationService(<database_path>, <host>, <port>, <workers>, <profile>, <archive_path>)
+# Note: workers defaults to the number of CPU cores, and the ConnectionPool gets one reader per
+#       worker. Idle keep-alive connections wait in a selector, not on a worker, and are closed
+#       after KEEPALIVE_TIMEOUT seconds. Pipelined requests are not supported.
+#
+#	service = DonationService('donations.db', port=0)
+#	threading.Thread(target=service.serve_forever).start()
+#	... service.server_address ...
+#	service.shutdown()
+class DonationService:
+
+	def __init__(self, path, host='127.0.0.1', port=SERVICE_PORT, workers=None, profile='throughput', archivePath=None, verbose=False):
+		self.workers = workers or os.cpu_count() or 1
+		self.verbose = verbose
+		self.pool = ConnectionPool(path, profile, readers=self.workers, archivePath=archivePath)
+		self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='http')
+		self._listener = socket.create_server((host, port), backlog=128)
+		self._listener.setblocking(False)
+		self.server_address = self._listener.getsockname()
+		self._selector = selectors.DefaultSelector()
+		self._selector.register(self._listener, selectors.EVENT_READ)
+		self._wake, self._wakeSignal = socket.socketpair() # Workers wake the selector to re-queue
+		self._wake.setblocking(False)
+		self._selector.register(self._wake, selectors.EVENT_READ)
+		self._returned = [] # Keep-alive connections handed back by workers
+		self._idle = dict() # connection -> time it went idle
+		self._lock = threading.Lock()
+		self._running = False
+		self._stopped = threading.Event()
+
+	# Method serve_forever()
+	# Purpose: Accept connections and dispatch requests until shutdown() is called
+	def serve_forever(self):
+
+		self._running = True
+		try:
+			while self._running:
+				for key, events in self._selector.select(timeout=1.0):
+					if key.fileobj is self._listener:
+						self._accept()
+					elif key.fileobj is self._wake:
+						self._requeue()
+					else:
+						# A request is arriving: hand the connection to a worker until it is answered
+						self._selector.unregister(key.fileobj)
+						del self._idle[key.fileobj]
+						self._executor.submit(self._serve, key.fileobj)
+				self._expire()
+		finally:
+			for conn in list(self._idle):
+				self._selector.unregister(conn)
+				conn.close()
+			self._idle = dict()
+			self._stopped.set()
+
+	# Method shutdown()
+	# Purpose: Stop serve_forever(), finish requests in progress, and close every connection
+	def shutdown(self):
+
+		self._running = False
+		self._wakeSignal.send(b'x')
+		self._stopped.wait()
+		self._executor.shutdown(wait=True)
+		with self._lock:
+			returned, self._returned = self._returned, []
+		for conn in returned:
+			conn.close()
+		self._selector.close()
+		self._listener.close()
+		self._wake.close()
+		self._wakeSignal.close()
+		self.pool.close()
+
+	def _accept(self):
+		try:
+			conn, address = self._listener.accept()
+		except BlockingIOError:
+			return
+		conn.setblocking(True)
+		conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self._watch(conn)
+
+	def _watch(self, conn):
+		self._idle[conn] = time.monotonic()
+		self._selector.register(conn, selectors.EVENT_READ)
+
+	# Method _serve answers one request on a worker thread, then returns or closes the connection
+	def _serve(self, conn):
+
+		conn.settimeout(KEEPALIVE_TIMEOUT) # Bounds a client that stalls mid-request
+		try:
+			handler = DonationRequestHandler(conn, conn.getpeername(), self)
+			keep = not handler.close_connection
+		except Exception:
+			keep = False
+		if keep and self._running:
+			with self._lock:
+				self._returned.append(conn)
+			try:
+				self._wakeSignal.send(b'x')
+			except OSError:
+				pass
+		else:
+			try:
+				conn.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+			conn.close()
+
+	def _requeue(self):
+		try:
+			while self._wake.recv(4096):
+				pass
+		except BlockingIOError:
+			pass
+		with self._lock:
+			returned, self._returned = self._returned, []
+		for conn in returned:
+			self._watch(conn)
+
+	def _expire(self):
+		cutoff = time.monotonic() - KEEPALIVE_TIMEOUT
+		for conn, since in list(self._idle.items()):
+			if since < cutoff:
+				self._selector.unregister(conn)
+				del self._idle[conn]
+				conn.close()
+
+
+if __name__ == '__main__':
+
+	# Usage: python3 DonationService.py <database_path> [port] [workers]
+	if len(sys.argv) < 2:
+		print('Usage: python3 DonationService.py <database_path> [port] [workers]')
+		sys.exit(1)
+
+	port = int(sys.argv[2]) if len(sys.argv) > 2 else SERVICE_PORT
+	workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+	service = DonationService(sys.argv[1], port=port, workers=workers, verbose=True)
+	print('Serving {0} on http://{1}:{2} with {3} workers'.format(sys.argv[1], service.server_address[0], service.server_address[1], service.workers))
+	try:
+		service.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		threading.Thread(target=service.shutdown).start()
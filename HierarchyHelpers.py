@@ -0,0 +1,110 @@
+# HierarchyHelpers.py implements the org hierarchy closure table over users.pid
+
+from ArchiveHelpers import unionSource
+
+# Functions:
+# linkUser()
+# unlinkUser()
+# getSubtree()
+# getAncestors()
+# isAncestor()
+# getSubtreeDonations()
+
+# user_tree holds one row per (ancestor, descendant) pair in the users.pid tree, including
+# each user as its own ancestor at depth 0, so subtree and ancestry questions are one indexed
+# lookup instead of a walk per level. Rows are written in the same transaction as the user.
+
+
+# Function linkUser()
+# Purpose: Add closure rows for a newly inserted user
+# Syntax: linkUser(<cursor>, <parent_id>, <user_id>)
+# Note: Caller owns the transaction. The root admin is its own parent and only gets depth 0.
+def linkUser(c, pid, uid):
+
+	c.execute('''INSERT OR IGNORE INTO user_tree(ancestor, descendant, depth) VALUES(?,?,0)''', (uid, uid))
+	if pid != uid:
+		c.execute('''INSERT OR IGNORE INTO user_tree(ancestor, descendant, depth)
+			SELECT ancestor, ?, depth + 1 FROM user_tree WHERE descendant = ?''', (uid, pid))
+
+
+# Function unlinkUser()
+# Purpose: Remove closure rows for a deleted user
+# Syntax: unlinkUser(<cursor>, <user_id>)
+# Note: Caller owns the transaction. Users with children are never deleted (see deleteUser()).
+def unlinkUser(c, uid):
+	c.execute('''DELETE FROM user_tree WHERE descendant = ?''', (uid,))
+
+
+# Function getSubtree()
+# Purpose: List every user under an account
+# Syntax: getSubtree(<connection>, <user_id>, <max_depth>)
+# Returns: list of (uid, depth) ordered by depth then uid, excluding uid itself; [] if none
+# Note: max_depth None means unlimited; 1 returns direct children only
+def getSubtree(db, uid, maxDepth=None):
+
+	SQLquery = 'SELECT descendant, depth FROM user_tree WHERE ancestor = ? AND depth > 0'
+	SQLargs = (uid,)
+	if maxDepth is not None:
+		SQLquery = ''.join([SQLquery, ' AND depth <= ?'])
+		SQLargs = (uid, maxDepth)
+	SQLquery = ''.join([SQLquery, ' ORDER BY depth, descendant'])
+
+	c = db.cursor()
+	c.execute(SQLquery, SQLargs)
+	result = c.fetchall()
+	c.close()
+	return result
+
+
+# Function getAncestors()
+# Purpose: List the chain of parents above an account
+# Syntax: getAncestors(<connection>, <user_id>)
+# Returns: list of (uid, depth) nearest parent first, excluding uid itself; [] if none
+def getAncestors(db, uid):
+
+	c = db.cursor()
+	c.execute('''SELECT ancestor, depth FROM user_tree WHERE descendant = ? AND depth > 0 ORDER BY depth''', (uid,))
+	result = c.fetchall()
+	c.close()
+	return result
+
+
+# Function isAncestor()
+# Purpose: Check whether one account sits above another in the hierarchy
+# Syntax: isAncestor(<connection>, <ancestor_id>, <user_id>)
+# Returns: True if ancestor_id is a parent, grandparent, etc. of user_id, else False
+def isAncestor(db, ancestor, uid):
+
+	c = db.cursor()
+	c.execute('''SELECT depth FROM user_tree WHERE ancestor = ? AND descendant = ? AND depth > 0''', (ancestor, uid))
+	result = c.fetchone()
+	c.close()
+
+	if result is not None:
+		return True
+	else:
+		return False
+
+
+# Function getSubtreeDonations()
+# Purpose: Get donations created by an account or any user under it
+# Syntax: getSubtreeDonations(<connection>, <user_id>, <status>)
+# Returns: list of donation rows ordered by id; [] if none
+# Note: status is 'pending', 'completed' or None for both. Completed donations moved to an
+#       attached archive are included; pending ones are never archived, so that query stays
+#       on the hot table.
+def getSubtreeDonations(db, uid, status=None):
+
+	source = 'donations' if status == 'pending' else unionSource(db, 'donations')
+	SQLquery = ''.join(['SELECT d.* FROM user_tree t JOIN ', source, ' d ON d.provider = t.descendant WHERE t.ancestor = ?'])
+	if status == 'pending':
+		SQLquery = ''.join([SQLquery, ' AND d.completed = 0'])
+	elif status == 'completed':
+		SQLquery = ''.join([SQLquery, ' AND d.completed != 0'])
+	SQLquery = ''.join([SQLquery, ' ORDER BY d.id'])
+
+	c = db.cursor()
+	c.execute(SQLquery, (uid,))
+	result = c.fetchall()
+	c.close()
+	return result
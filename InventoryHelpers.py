@@ -0,0 +1,184 @@
+# InventoryHelpers.py implements live counts of unclaimed items by title and units
+
+from TransactionHelpers import unitOfWork
+
+# Functions:
+# applyInventory()
+# retractInventory()
+# transitionInventory()
+# getInventory()
+# topInventory()
+# rebuildInventory()
+# checkInventory()
+
+# unclaimed_inventory holds the total count of each (title, units) across unclaimed donations.
+# Item helpers retract a donation's items before they change them and apply them again
+# afterwards, as for rollups; claim, unclaim and complete move a donation's items out of or
+# back into the inventory. The supply dashboard reads one row per item type instead of
+# walking every unclaimed donation's items.
+
+# Aggregate of unclaimed items in inventory shape
+	# {0} restricts it to matching donations, {1} is the total expression
+INVENTORY_SELECT = '''SELECT i.title, i.units, {1}
+	FROM donations d JOIN items i ON i.did = d.id
+	WHERE d.receiver = 'pending' AND d.completed = 0{0}
+	GROUP BY i.title, i.units'''
+
+# State changes that move a donation out of or into the inventory: kind -> (sign, filter)
+	# claim and unclaim always move it; completing only moves it if it was still unclaimed
+INVENTORY_TRANSITIONS = {
+	'claim': (-1, ''),
+	'unclaim': (1, ''),
+	'complete': (-1, " AND d.receiver = 'pending'"),
+}
+
+# Donation items in inventory shape regardless of state, for transitions
+TRANSITION_SELECT = '''SELECT i.title, i.units, ? * SUM(i.count)
+	FROM donations d JOIN items i ON i.did = d.id
+	WHERE d.id = ?{0}
+	GROUP BY i.title, i.units'''
+
+
+# Function _adjustInventory adds a signed aggregate of one donation's items to the inventory
+def _adjustInventory(c, did, sign, SQLselect):
+
+	c.execute(''.join(['INSERT INTO unclaimed_inventory(title, units, count) ', SQLselect,
+		' ON CONFLICT(title, units) DO UPDATE SET count = count + excluded.count']), (sign, did))
+	if sign < 0 and c.rowcount > 0:
+		# Drop emptied item types; the donation's own items pin the search to its groups
+		c.execute('''DELETE FROM unclaimed_inventory WHERE count = 0
+			AND (title, units) IN (SELECT title, units FROM items WHERE did = ?)''', (did,))
+
+
+# Function applyInventory()
+# Purpose: Add a donation's items to the inventory if it is unclaimed
+# Syntax: applyInventory(<cursor>, <donation_id>)
+# Note: Caller owns the transaction; a claimed or completed donation contributes nothing
+def applyInventory(c, did):
+	_adjustInventory(c, did, 1, INVENTORY_SELECT.format(' AND d.id = ?', '? * SUM(i.count)'))
+
+
+# Function retractInventory()
+# Purpose: Remove a donation's items from the inventory if it is unclaimed
+# Syntax: retractInventory(<cursor>, <donation_id>)
+# Note: Call before changing a donation's items, then applyInventory() after
+def retractInventory(c, did):
+	_adjustInventory(c, did, -1, INVENTORY_SELECT.format(' AND d.id = ?', '? * SUM(i.count)'))
+
+
+# Function transitionInventory()
+# Purpose: Account for a claim, unclaim or complete that was just applied to a donation
+# Syntax: transitionInventory(<cursor>, <donation_id>, <kind>)
+# Note: Call only after the state UPDATE matched, in the same transaction
+def transitionInventory(c, did, kind):
+
+	if kind in INVENTORY_TRANSITIONS:
+		sign, SQLfilter = INVENTORY_TRANSITIONS[kind]
+		_adjustInventory(c, did, sign, TRANSITION_SELECT.format(SQLfilter))
+
+
+# Function getInventory()
+# Purpose: Read unclaimed totals, optionally for one title and/or units
+# Syntax: getInventory(<connection>, <title>, <units>)
+# Returns: list of (title, units, count) ordered by title and units; [] if none
+#
+#	getInventory(db, 'Broccoli', 'lb') # [('Broccoli', 'lb', 42)]
+#	getInventory(db, units='each')
+def getInventory(db, title=None, units=None):
+
+	SQLquery = 'SELECT title, units, count FROM unclaimed_inventory'
+	SQLfilters = []
+	SQLargs = []
+	if title is not None:
+		SQLfilters.append('title = ?')
+		SQLargs.append(title)
+	if units is not None:
+		SQLfilters.append('units = ?')
+		SQLargs.append(units)
+	if SQLfilters:
+		SQLquery = ''.join([SQLquery, ' WHERE ', ' AND '.join(SQLfilters)])
+	if title is None:
+		SQLquery = ''.join([SQLquery, ' ORDER BY title, units'])
+
+	c = db.cursor()
+	c.execute(SQLquery, SQLargs)
+	result = c.fetchall()
+	c.close()
+	return result
+
+
+# Function topInventory()
+# Purpose: Read the most plentiful unclaimed item types
+# Syntax: topInventory(<connection>, <limit>, <units>)
+# Returns: list of (title, units, count) largest count first; [] if none
+# Note: Counts in different units are not comparable, so pass units to rank like with like
+def topInventory(db, limit=10, units=None):
+
+	c = db.cursor()
+	if units is None:
+		c.execute('''SELECT title, units, count FROM unclaimed_inventory ORDER BY count DESC LIMIT ?''', (limit,))
+	else:
+		c.execute('''SELECT title, units, count FROM unclaimed_inventory WHERE units = ? ORDER BY count DESC LIMIT ?''', (units, limit))
+	result = c.fetchall()
+	c.close()
+	return result
+
+
+# Function rebuildInventory()
+# Purpose: Recompute the inventory from donations and items
+# Syntax: rebuildInventory(<connection>)
+# Returns: number of item types written
+def rebuildInventory(db):
+
+	with unitOfWork(db):
+		c = db.cursor()
+		c.execute('''DELETE FROM unclaimed_inventory''')
+		c.execute(''.join(['INSERT INTO unclaimed_inventory(title, units, count) ', INVENTORY_SELECT.format('', 'SUM(i.count)')]))
+		result = c.rowcount
+		c.close()
+	return result
+
+
+# Function checkInventory()
+# Purpose: Compare the inventory against a fresh aggregate
+# Syntax: checkInventory(<connection>)
+# Returns: list of (title, units, stored, actual) that disagree; [] if consistent
+def checkInventory(db):
+
+	c = db.cursor()
+	c.execute('''SELECT title, units, count FROM unclaimed_inventory''')
+	stored = dict((row[:2], row[2]) for row in c.fetchall())
+	c.execute(INVENTORY_SELECT.format('', 'SUM(i.count)'))
+	actual = dict((row[:2], row[2]) for row in c.fetchall())
+	c.close()
+
+	result = []
+	for group in sorted(set(stored) | set(actual), key=lambda g: tuple(str(v) for v in g)):
+		if stored.get(group, 0) != actual.get(group, 0):
+			result.append(group + (stored.get(group, 0), actual.get(group, 0)))
+	return result
+
+
+if __name__ == '__main__':
+
+	# Usage: python3 InventoryHelpers.py <database_path> [rebuild|check|top]
+	import sys
+	from Schema import createSchema
+
+	if len(sys.argv) < 2:
+		print('Usage: python3 InventoryHelpers.py <database_path> [rebuild|check|top]')
+		sys.exit(1)
+
+	db = createSchema(sys.argv[1])
+	command = sys.argv[2] if len(sys.argv) > 2 else 'check'
+	if command == 'rebuild':
+		print('Rebuilt {0} inventory rows'.format(rebuildInventory(db)))
+	elif command == 'top':
+		for title, units, count in topInventory(db, 20):
+			print('{0}{1}{2}'.format(title.ljust(40), str(units).ljust(10), count))
+	else:
+		mismatches = checkInventory(db)
+		for row in mismatches:
+			print('MISMATCH: {0}'.format(row))
+		print('PASS: inventory consistent' if not mismatches else 'FAIL: {0} inventory rows differ'.format(len(mismatches)))
+	db.close()
@@ -0,0 +1,370 @@
+# LoadBenchmarks.py implements a mixed-workload load generator built on the StoriesWeekTwo story flows
+
+import os, sys, json, time, bisect, random, shutil, sqlite3, datetime, platform, argparse, itertools
+from Schema import createSchema, schemaVersion
+from TransactionHelpers import unitOfWork
+from UserHelpers import provisionUsers
+from RollupHelpers import rebuildRollups
+from InventoryHelpers import rebuildInventory
+from DonationHelpers import addDonation, deleteDonation, editDonation, addItemByManual, getDonationItems, getUnclaimedPage, getProviderPendingPage, getReceiverPendingPage, getReceiverCompletePage, claimDonation, unclaimDonation, completeDonation
+from Benchmarks import tempDatabase, percentile
+
+# FUNCTIONS:
+# seedDataset(path, donations, seed, ...) - Bulk-load a reproducible dataset of a given size
+# runWorkload(db, config, rng, operations) - Replay weighted story flows, timing each one
+# benchStories(config) - Seed, warm up and measure every configured scale
+# compareResults(old, new) - Per-operation deltas between two saved results
+#
+# Usage:
+#	python3 LoadBenchmarks.py --scales 1e3,1e4,1e5 --operations 5000 --output release-1.2.json
+#	python3 LoadBenchmarks.py --mix receiver-claim=30,receiver-list=70 --scales 1e6
+#	python3 LoadBenchmarks.py compare release-1.1.json release-1.2.json
+#
+# Every run with the same arguments seeds the same datasets and replays the same operations
+# in the same order, so two saved results differ only by the code under test (and the machine).
+
+# Story flows and their default weights; each flow reads what the user would see, then acts
+	# provider-add      AS A PROVIDER, I CAN CREATE A DONATION (intake keeps the dataset growing)
+	# provider-edit     AS A PROVIDER, I CAN EDIT MY PENDING DONATION PACKAGES
+	# provider-delete   AS A PROVIDER, I CAN DELETE A PENDING PACKAGE
+	# receiver-list     AS A RECEIVER, I CAN SEE UNCLAIMED DONATION PACKAGES
+	# receiver-claim    AS A RECEIVER, I CAN SEE MY PENDING DONATION PACKAGES (after claiming one)
+	# receiver-unclaim  AS A RECEIVER, I CAN CANCEL MY CLAIM TO PICK UP A DONATION PACKAGE
+	# receiver-complete AS A RECEIVER, I CAN PICK UP A CLAIMED PACKAGE
+	# receiver-past     AS A RECEIVER, I CAN SEE MY PAST DONATION PACKAGES
+DEFAULT_MIX = {
+	'provider-add': 10,
+	'provider-edit': 15,
+	'provider-delete': 5,
+	'receiver-list': 35,
+	'receiver-claim': 15,
+	'receiver-unclaim': 5,
+	'receiver-complete': 10,
+	'receiver-past': 5,
+}
+
+DEFAULT_CONFIG = {
+	'scales': [1000, 10000, 100000],
+	'operations': 5000,
+	'warmup': 500,
+	'mix': DEFAULT_MIX,
+	'providers': 100,
+	'receivers': 100,
+	'items': 3, # Items per seeded donation
+	'page': 20, # Rows per listing page
+	'profile': 'throughput',
+	'seed': 361,
+}
+
+# Seeded donation states: share unclaimed, claimed but pending, completed
+SEED_STATES = (0.6, 0.2, 0.2)
+SEED_EPOCH = datetime.datetime(2026, 1, 1) # Seeded timestamps fall in the two years before
+SEED_CHUNK = 100000
+TITLES = ['Item {0}'.format(i) for i in range(200)]
+UNITS = ['lb', 'each', 'oz', 'bunch']
+
+# Latency histogram buckets: upper bounds in microseconds, powers of two from 16us to ~8s
+HISTOGRAM_BOUNDS = [2 ** k for k in range(4, 24)]
+
+
+# Function seedDataset()
+# Purpose: Bulk-load users and donations in the shapes the story flows produce
+# Syntax: seedDataset(<database_path>, <donation_count>, <seed>, <providers>, <receivers>, <items_per_donation>)
+# Returns: seconds spent seeding
+# Note: Rows are written with executemany under the bulk-load profile, then rollups and the
+#       unclaimed inventory are rebuilt once; search indexes follow through their triggers.
+def seedDataset(path, donations, seed, providers=100, receivers=100, items=3):
+
+	rng = random.Random(seed)
+	start = time.perf_counter()
+	db = createSchema(path, 'bulk-load')
+
+	records = [('admin', 'admin', 0b1111, 'admin'), ('admin', 'P_Org', 0b110, 'P_Org'), ('admin', 'R_Org', 0b101, 'R_Org')]
+	records.extend(('P_Org', 'P_Usr_{0}'.format(i), 0b10, 'P_Usr_{0}'.format(i)) for i in range(1, providers + 1))
+	records.extend(('R_Org', 'R_Usr_{0}'.format(i), 0b1, 'R_Usr_{0}'.format(i)) for i in range(1, receivers + 1))
+	provisionUsers(db, records)
+
+	span = 2 * 365 * 86400
+	def donation(did):
+		created = SEED_EPOCH - datetime.timedelta(seconds=span * (donations - did) // donations)
+		roll = rng.random()
+		provider = 'P_Usr_{0}'.format(rng.randint(1, providers))
+		if roll < SEED_STATES[0]:
+			return (did, provider, 'pending', str(created), 0)
+		receiver = 'R_Usr_{0}'.format(rng.randint(1, receivers))
+		if roll < SEED_STATES[0] + SEED_STATES[1]:
+			return (did, provider, receiver, str(created), 0)
+		completed = created + datetime.timedelta(seconds=rng.randint(3600, 14 * 86400))
+		return (did, provider, receiver, str(created), str(min(completed, SEED_EPOCH)))
+
+	dids = iter(range(1, donations + 1))
+	while True:
+		chunk = [donation(did) for did in itertools.islice(dids, SEED_CHUNK)]
+		if not chunk:
+			break
+		rows = []
+		for row in chunk:
+			titles = rng.sample(TITLES, items)
+			rows.extend((row[0], title, rng.randint(1, 50), UNITS[TITLES.index(title) % len(UNITS)]) for title in titles)
+		with unitOfWork(db):
+			db.executemany('''INSERT INTO donations(id, provider, receiver, created, completed) VALUES(?,?,?,?,?)''', chunk)
+			db.executemany('''INSERT INTO items(did, title, count, units) VALUES(?,?,?,?)''', rows)
+
+	rebuildRollups(db)
+	rebuildInventory(db)
+	db.execute('ANALYZE')
+	db.close()
+	return time.perf_counter() - start
+
+
+# Function _flows builds the story flow callables for one connection and configuration
+# Each flow returns True if it reached its final step, False if there was nothing to act on
+def _flows(db, config, rng):
+
+	page = config['page']
+	provider = lambda: 'P_Usr_{0}'.format(rng.randint(1, config['providers']))
+	receiver = lambda: 'R_Usr_{0}'.format(rng.randint(1, config['receivers']))
+
+	def providerAdd():
+		did = addDonation(db, provider(), None)
+		for title in rng.sample(TITLES, config['items']):
+			addItemByManual(db, did, title, rng.randint(1, 50), UNITS[TITLES.index(title) % len(UNITS)])
+		return did > 0
+
+	def providerEdit():
+		rows = getProviderPendingPage(db, provider(), page)[0]
+		if not rows:
+			return False
+		did = rng.choice(rows)[0]
+		items = getDonationItems(db, did)
+		if not items:
+			return False
+		item = rng.choice(items)
+		return editDonation(db, did, item[0], 0 if rng.random() < 0.2 else rng.randint(1, 50))
+
+	def providerDelete():
+		rows = getProviderPendingPage(db, provider(), page)[0]
+		if not rows:
+			return False
+		return deleteDonation(db, rng.choice(rows)[0])
+
+	def receiverList():
+		rows = getUnclaimedPage(db, page)[0]
+		for row in rows[:3]: # Open the first few packages
+			getDonationItems(db, row[0])
+		return bool(rows)
+
+	def receiverClaim():
+		rows = getUnclaimedPage(db, page)[0]
+		if not rows:
+			return False
+		rid = receiver()
+		claimed = claimDonation(db, rng.choice(rows)[0], rid)
+		getReceiverPendingPage(db, rid, page)
+		return claimed
+
+	def receiverUnclaim():
+		rid = receiver()
+		rows = getReceiverPendingPage(db, rid, page)[0]
+		if not rows:
+			return False
+		return unclaimDonation(db, rng.choice(rows)[0], rid)
+
+	def receiverComplete():
+		rows = getReceiverPendingPage(db, receiver(), page)[0]
+		if not rows:
+			return False
+		return completeDonation(db, rng.choice(rows)[0])
+
+	def receiverPast():
+		rows = getReceiverCompletePage(db, receiver(), page)[0]
+		return bool(rows)
+
+	return {
+		'provider-add': providerAdd,
+		'provider-edit': providerEdit,
+		'provider-delete': providerDelete,
+		'receiver-list': receiverList,
+		'receiver-claim': receiverClaim,
+		'receiver-unclaim': receiverUnclaim,
+		'receiver-complete': receiverComplete,
+		'receiver-past': receiverPast,
+	}
+
+
+# Function runWorkload()
+# Purpose: Replay a weighted sequence of story flows and time each one
+# Syntax: runWorkload(<connection>, <config>, <rng>, <operation_count>)
+# Returns: (dict of flow -> list of (seconds, completed)), total seconds)
+def runWorkload(db, config, rng, operations):
+
+	flows = _flows(db, config, rng)
+	names = sorted(name for name, weight in config['mix'].items() if weight > 0)
+	weights = list(itertools.accumulate(config['mix'][name] for name in names))
+
+	samples = dict((name, []) for name in names)
+	start = time.perf_counter()
+	for i in range(operations):
+		name = names[min(len(names) - 1, bisect.bisect_right(weights, rng.random() * weights[-1]))]
+		began = time.perf_counter()
+		done = flows[name]()
+		samples[name].append((time.perf_counter() - began, bool(done)))
+	return samples, time.perf_counter() - start
+
+
+# Function _histogram counts latencies into HISTOGRAM_BOUNDS buckets, keyed by upper bound in us
+def _histogram(times):
+
+	counts = dict()
+	for seconds in times:
+		micros = seconds * 1e6
+		bound = next((b for b in HISTOGRAM_BOUNDS if micros <= b), None)
+		key = 'le{0}us'.format(bound) if bound is not None else 'gt{0}us'.format(HISTOGRAM_BOUNDS[-1])
+		counts[key] = counts.get(key, 0) + 1
+	return counts
+
+
+# Function _summarise reduces one flow's samples to latency statistics in milliseconds
+def _summarise(samples, seconds):
+
+	times = [sample[0] for sample in samples]
+	return {
+		'count': len(samples),
+		'misses': sum(1 for sample in samples if not sample[1]),
+		'ops/s': len(samples) / seconds if seconds > 0 else 0,
+		'mean': sum(times) / len(times) * 1000 if times else 0,
+		'p50': percentile(times, 50) * 1000,
+		'p90': percentile(times, 90) * 1000,
+		'p99': percentile(times, 99) * 1000,
+		'max': max(times) * 1000 if times else 0,
+		'histogram': _histogram(times),
+	}
+
+
+# Function benchStories()
+# Purpose: Seed each scale, warm up, then measure the mixed story workload
+# Syntax: benchStories(<config>)
+# Returns: result document (dict) ready for json.dump; see DEFAULT_CONFIG for config keys
+# Note: Dataset and workload randomness both derive from config['seed']. Each scale gets a
+#       fresh database so runs never share page cache or earlier mutations.
+def benchStories(config=None):
+
+	config = dict(DEFAULT_CONFIG, **(config or {}))
+	document = {
+		'suite': 'stories',
+		'config': config,
+		'environment': {
+			'python': platform.python_version(),
+			'sqlite': sqlite3.sqlite_version,
+			'platform': platform.platform(),
+			'cpus': os.cpu_count(),
+		},
+		'results': dict(),
+	}
+
+	for scale in config['scales']:
+		directory, path = tempDatabase()
+		try:
+			seeding = seedDataset(path, scale, config['seed'], config['providers'], config['receivers'], config['items'])
+			db = createSchema(path, config['profile'])
+			document['environment']['schema'] = schemaVersion(db)
+
+			rng = random.Random(config['seed'] + scale)
+			runWorkload(db, config, rng, config['warmup'])
+			samples, seconds = runWorkload(db, config, rng, config['operations'])
+			db.close()
+
+			total = [sample for name in samples for sample in samples[name]]
+			document['results'][str(scale)] = {
+				'seedSeconds': seeding,
+				'seconds': seconds,
+				'ops/s': len(total) / seconds if seconds > 0 else 0,
+				'total': _summarise(total, seconds),
+				'operations': dict((name, _summarise(samples[name], seconds)) for name in samples),
+			}
+		finally:
+			shutil.rmtree(directory, ignore_errors=True)
+
+	return document
+
+
+# Function compareResults()
+# Purpose: Line up two saved result documents by scale and flow
+# Syntax: compareResults(<old_document>, <new_document>)
+# Returns: list of (scale, flow, old_p50, new_p50, old_p99, new_p99, old_ops/s, new_ops/s)
+def compareResults(old, new):
+
+	rows = []
+	for scale in sorted(set(old['results']) & set(new['results']), key=int):
+		a, b = old['results'][scale], new['results'][scale]
+		for name in sorted(set(a['operations']) & set(b['operations'])) + ['total']:
+			x = a['total'] if name == 'total' else a['operations'][name]
+			y = b['total'] if name == 'total' else b['operations'][name]
+			rows.append((scale, name, x['p50'], y['p50'], x['p99'], y['p99'], x['ops/s'], y['ops/s']))
+	return rows
+
+
+def printStories(document):
+	for scale, result in document['results'].items():
+		print('{0} donations: seeded in {1:.1f}s, {2:.0f} ops/s'.format(scale, result['seedSeconds'], result['ops/s']))
+		print('  {0}{1}{2}{3}{4}{5}'.format('flow'.ljust(20), 'count'.ljust(8), 'misses'.ljust(8), 'p50 ms'.ljust(10), 'p99 ms'.ljust(10), 'max ms'))
+		for name, r in sorted(result['operations'].items()) + [('total', result['total'])]:
+			print('  {0}{1}{2}{3}{4}{5:.2f}'.format(name.ljust(20), str(r['count']).ljust(8), str(r['misses']).ljust(8), '{0:.3f}'.format(r['p50']).ljust(10), '{0:.3f}'.format(r['p99']).ljust(10), r['max']))
+
+
+def printComparison(rows):
+	print('{0}{1}{2}{3}{4}'.format('scale'.ljust(10), 'flow'.ljust(20), 'p50 ms'.ljust(22), 'p99 ms'.ljust(22), 'ops/s'))
+	for scale, name, p50a, p50b, p99a, p99b, opsa, opsb in rows:
+		change = lambda a, b: '{0:+.0f}%'.format((b - a) / a * 100) if a else 'n/a'
+		print('{0}{1}{2}{3}{4}'.format(scale.ljust(10), name.ljust(20),
+			'{0:.3f} -> {1:.3f} {2}'.format(p50a, p50b, change(p50a, p50b)).ljust(22),
+			'{0:.3f} -> {1:.3f} {2}'.format(p99a, p99b, change(p99a, p99b)).ljust(22),
+			'{0:.0f} -> {1:.0f} {2}'.format(opsa, opsb, change(opsa, opsb))))
+
+
+# Function _parseMix reads 'flow=weight,...' into a mix dict, keeping unnamed flows at 0
+def _parseMix(text):
+
+	mix = dict((name, 0) for name in DEFAULT_MIX)
+	for part in text.split(','):
+		name, weight = part.split('=')
+		if name.strip() not in DEFAULT_MIX:
+			raise argparse.ArgumentTypeError('unknown flow {0}'.format(name.strip()))
+		mix[name.strip()] = float(weight)
+	return mix
+
+
+if __name__ == '__main__':
+
+	if len(sys.argv) == 4 and sys.argv[1] == 'compare':
+		with open(sys.argv[2]) as f: old = json.load(f)
+		with open(sys.argv[3]) as f: new = json.load(f)
+		printComparison(compareResults(old, new))
+		sys.exit(0)
+
+	parser = argparse.ArgumentParser(description='Replay StoriesWeekTwo story flows as a mixed workload')
+	parser.add_argument('--scales', default=','.join(str(s) for s in DEFAULT_CONFIG['scales']), help='donation counts, e.g. 1e3,1e5,1e7')
+	parser.add_argument('--operations', type=int, default=DEFAULT_CONFIG['operations'], help='measured flows per scale')
+	parser.add_argument('--warmup', type=int, default=DEFAULT_CONFIG['warmup'], help='unmeasured flows per scale')
+	parser.add_argument('--mix', type=_parseMix, default=DEFAULT_MIX, help='flow weights, e.g. receiver-claim=30,receiver-list=70')
+	parser.add_argument('--providers', type=int, default=DEFAULT_CONFIG['providers'])
+	parser.add_argument('--receivers', type=int, default=DEFAULT_CONFIG['receivers'])
+	parser.add_argument('--items', type=int, default=DEFAULT_CONFIG['items'], help='items per seeded donation')
+	parser.add_argument('--page', type=int, default=DEFAULT_CONFIG['page'], help='rows per listing page')
+	parser.add_argument('--profile', default=DEFAULT_CONFIG['profile'], help='storage profile for the measured run')
+	parser.add_argument('--seed', type=int, default=DEFAULT_CONFIG['seed'])
+	parser.add_argument('--output', help='write the JSON result document here instead of stdout')
+	args = parser.parse_args()
+
+	config = dict(vars(args))
+	config['scales'] = [int(float(s)) for s in args.scales.split(',')]
+	output = config.pop('output')
+
+	document = benchStories(config)
+	if output:
+		with open(output, 'w') as f:
+			json.dump(document, f, indent=1, sort_keys=True)
+		printStories(document)
+	else:
+		json.dump(document, sys.stdout, indent=1, sort_keys=True)
+		print('')
@@ -0,0 +1,198 @@
+# LocationHelpers.py implements pickup locations and nearest-unclaimed-donation queries
+
+import math
+from TransactionHelpers import commit
+
+# Functions:
+# writeDonationLocation()
+# removeDonationLocation()
+# setDonationLocation()
+# getDonationLocation()
+# setUserLocation()
+# getUserLocation()
+# getUnclaimedNear()
+# getUnclaimedNearUser()
+# distanceKm()
+
+# Locations are indexed on a fixed grid of GRID_DEGREES cells, stored as integer
+# (cellLat, cellLon) next to the coordinates. A radius query reads only the cells
+# overlapping the radius's bounding box, then measures exact distances in Python.
+GRID_DEGREES = 0.05 # About 5.5 km north-south
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+# Function _cell returns the grid cell containing a coordinate
+def _cell(lat, lon):
+	return (int(math.floor(lat / GRID_DEGREES)), int(math.floor(lon / GRID_DEGREES)))
+
+
+# Function validLocation checks coordinates are in range
+def validLocation(lat, lon):
+	return lat is not None and lon is not None and -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+# Function distanceKm()
+# Purpose: Great-circle distance between two coordinates
+# Syntax: distanceKm(<lat1>, <lon1>, <lat2>, <lon2>)
+# Returns: distance in kilometres (haversine)
+def distanceKm(lat1, lon1, lat2, lon2):
+	p1, p2 = math.radians(lat1), math.radians(lat2)
+	dp, dl = p2 - p1, math.radians(lon2 - lon1)
+	a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+	return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# Function writeDonationLocation()
+# Purpose: Write a donation's location row inside the caller's transaction
+# Syntax: writeDonationLocation(<cursor>, <donation_id>, <lat>, <lon>)
+# Note: Caller validates coordinates and owns the transaction
+def writeDonationLocation(c, did, lat, lon):
+	cellLat, cellLon = _cell(lat, lon)
+	c.execute('''INSERT OR REPLACE INTO donation_locations(did, lat, lon, cellLat, cellLon) VALUES(?,?,?,?,?)''', (did, lat, lon, cellLat, cellLon))
+
+
+# Function removeDonationLocation()
+# Purpose: Remove a donation's location row inside the caller's transaction
+# Syntax: removeDonationLocation(<cursor>, <donation_id>)
+def removeDonationLocation(c, did):
+	c.execute('''DELETE FROM donation_locations WHERE did = ?''', (did,))
+
+
+# Function setDonationLocation()
+# Purpose: Set or replace a donation's pickup coordinates
+# Syntax: setDonationLocation(<connection>, <donation_id>, <lat>, <lon>)
+# Returns: True on success, False if coordinates are out of range or donation does not exist
+def setDonationLocation(db, did, lat, lon):
+
+	if not validLocation(lat, lon):
+		return False
+
+	c = db.cursor()
+	c.execute('''SELECT id FROM donations WHERE id=?''', (did,))
+	if c.fetchone() is None:
+		c.close()
+		return False
+
+	writeDonationLocation(c, did, lat, lon)
+	commit(db)
+	c.close()
+	return True
+
+
+# Function getDonationLocation()
+# Purpose: Get a donation's pickup coordinates
+# Syntax: getDonationLocation(<connection>, <donation_id>)
+# Returns: (lat, lon), or None if the donation has no location
+def getDonationLocation(db, did):
+
+	c = db.cursor()
+	c.execute('''SELECT lat, lon FROM donation_locations WHERE did=?''', (did,))
+	result = c.fetchone()
+	c.close()
+	return result
+
+
+# Function setUserLocation()
+# Purpose: Set or replace a user's home location, e.g. a receiver's pickup base
+# Syntax: setUserLocation(<connection>, <uid>, <lat>, <lon>)
+# Returns: True on success, False if coordinates are out of range or user does not exist
+def setUserLocation(db, uid, lat, lon):
+
+	if not validLocation(lat, lon):
+		return False
+
+	c = db.cursor()
+	c.execute('''SELECT uid FROM users WHERE uid=?''', (uid,))
+	if c.fetchone() is None:
+		c.close()
+		return False
+
+	c.execute('''INSERT OR REPLACE INTO user_locations(uid, lat, lon) VALUES(?,?,?)''', (uid, lat, lon))
+	commit(db)
+	c.close()
+	return True
+
+
+# Function getUserLocation()
+# Purpose: Get a user's home location
+# Syntax: getUserLocation(<connection>, <uid>)
+# Returns: (lat, lon), or None if the user has no location
+def getUserLocation(db, uid):
+
+	c = db.cursor()
+	c.execute('''SELECT lat, lon FROM user_locations WHERE uid=?''', (uid,))
+	result = c.fetchone()
+	c.close()
+	return result
+
+
+# Function _lonCellRanges returns the (min, max) cellLon ranges a bounding box covers
+# A box past the antimeridian wraps to the other end of the grid; one reaching a pole covers
+# every longitude, since the shortest path may cross the pole
+def _lonCellRanges(lat, lon, dLat, dLon):
+
+	if dLon >= 180 or lat + dLat >= 90 or lat - dLat <= -90:
+		return [(_cell(0, -180)[1], _cell(0, 180)[1])]
+	west, east = lon - dLon, lon + dLon
+	if west < -180:
+		return [(_cell(0, -180)[1], _cell(0, east)[1]), (_cell(0, west + 360)[1], _cell(0, 180)[1])]
+	if east > 180:
+		return [(_cell(0, west)[1], _cell(0, 180)[1]), (_cell(0, -180)[1], _cell(0, east - 360)[1])]
+	return [(_cell(0, west)[1], _cell(0, east)[1])]
+
+
+# Function getUnclaimedNear()
+# Purpose: Find the nearest unclaimed donations within a radius
+# Syntax: getUnclaimedNear(<connection>, <lat>, <lon>, <radius_km>, <limit>)
+# Returns: list of (donation, distance_km) nearest first; [] if none or coordinates invalid
+# Note: Only donations with a pickup location are considered. The query reads the grid
+#       cells under the radius's bounding box, not every unclaimed donation. A box that
+#       crosses the antimeridian reads the cells at both ends of the longitude range.
+def getUnclaimedNear(db, lat, lon, radius, limit=50):
+
+	if not validLocation(lat, lon) or radius <= 0:
+		return []
+
+	# Bounding box in degrees: the widest longitude span of a circle of angular radius d
+	# centred at lat is asin(sin(d) / cos(lat)); a circle reaching a pole spans every longitude
+	dLat = radius / KM_PER_DEGREE
+	if abs(lat) + dLat >= 90:
+		dLon = 180.0
+	else:
+		dLon = math.degrees(math.asin(min(1.0, math.sin(math.radians(dLat)) / math.cos(math.radians(lat)))))
+	minCell = _cell(max(lat - dLat, -90), -180)
+	maxCell = _cell(min(lat + dLat, 90), 180)
+	lonCells = _lonCellRanges(lat, lon, dLat, dLon)
+
+	# CROSS JOIN keeps donation_locations as the outer loop so the grid index drives the query
+	SQLquery = ''.join(['''SELECT d.*, l.lat, l.lon FROM donation_locations l CROSS JOIN donations d ON d.id = l.did
+		WHERE l.cellLat BETWEEN ? AND ? AND (''', ' OR '.join(['l.cellLon BETWEEN ? AND ?'] * len(lonCells)), ''')
+		AND d.receiver = 'pending' AND d.completed = 0'''])
+	SQLargs = [minCell[0], maxCell[0]]
+	for cells in lonCells:
+		SQLargs.extend(cells)
+	c = db.cursor()
+	c.execute(SQLquery, SQLargs)
+	rows = c.fetchall()
+	c.close()
+
+	result = []
+	for row in rows:
+		distance = distanceKm(lat, lon, row[-2], row[-1])
+		if distance <= radius:
+			result.append((row[:-2], distance))
+	result.sort(key=lambda r: (r[1], r[0][0]))
+	return result[:limit]
+
+
+# Function getUnclaimedNearUser()
+# Purpose: Find the nearest unclaimed donations to a user's home location
+# Syntax: getUnclaimedNearUser(<connection>, <uid>, <radius_km>, <limit>)
+# Returns: list of (donation, distance_km) nearest first; [] if the user has no location
+def getUnclaimedNearUser(db, uid, radius, limit=50):
+
+	location = getUserLocation(db, uid)
+	if location is None:
+		return []
+	return getUnclaimedNear(db, location[0], location[1], radius, limit)
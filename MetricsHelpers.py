@@ -0,0 +1,160 @@
+# MetricsHelpers.py implements per-helper call counts, wall time and SQL statement counts
+
+import os, sys, types, threading, functools, time, weakref
+
+# Functions:
+# instrumentModule()
+# enableMetrics()
+# metricsEnabled()
+# snapshotMetrics()
+# resetMetrics()
+# exportMetrics()
+
+# DonationHelpers and UserHelpers wrap every public function with instrumentModule() when they
+# load. While metrics are on, each call records into the registry under its function name:
+#	calls       times called
+#	errors      calls that raised
+#	seconds     wall time, including helpers it called
+#	statements  SQL statements it issued itself, counted by the connection's trace callback
+# Nested helpers (e.g. existDonation() inside addItemByManual()) are recorded separately, and
+# their statements count toward them, not the caller. Statements run while a stream*() generator
+# is consumed happen after the call returns and are not counted.
+#
+# Off by default, or on at startup with DONATION_METRICS=1. While off, a wrapper costs one
+# flag check. A connection keeps the counting callback after metrics are turned off (it then
+# does nothing); set_trace_callback(None) removes it.
+# The first instrumented call on a connection while metrics are on replaces any trace callback
+# already set on it; a callback set afterwards stays, and that connection is no longer counted.
+#
+#	enableMetrics(True)
+#	isProvider(db, 'P_Usr_1')
+#	snapshotMetrics()['UserHelpers.getPerms'] # {'calls': 1, 'errors': 0, 'seconds': ..., 'statements': 1}
+_enabled = os.environ.get('DONATION_METRICS', '') not in ('', '0')
+
+_registry = dict() # 'module.function' -> [calls, errors, seconds, statements]
+_registryLock = threading.Lock()
+_local = threading.local() # stack of [name, statements] for helpers running on this thread
+_traced = weakref.WeakSet() # Connections whose trace callback counts statements
+
+
+# Function instrumentModule()
+# Purpose: Replace a module's public functions with recording wrappers
+# Syntax: instrumentModule(<module_name>)
+# Note: Call at the end of the module so calls between its own functions are recorded too.
+#       Only functions defined in the module are wrapped, not names it imported.
+def instrumentModule(name):
+
+	module = sys.modules[name]
+	for attr, value in list(vars(module).items()):
+		if attr.startswith('_') or not isinstance(value, types.FunctionType) or value.__module__ != name:
+			continue
+		setattr(module, attr, _wrap(value, '{0}.{1}'.format(name, attr)))
+
+
+# Function _wrap builds the recording wrapper for one helper
+def _wrap(func, name):
+
+	@functools.wraps(func)
+	def helper(*args, **kwargs):
+
+		if not _enabled:
+			return func(*args, **kwargs)
+
+		if args and hasattr(args[0], 'set_trace_callback'):
+			_trace(args[0])
+		stack = getattr(_local, 'stack', None)
+		if stack is None:
+			stack = _local.stack = []
+		frame = [name, 0]
+		stack.append(frame)
+		failed = True
+		start = time.perf_counter()
+		try:
+			result = func(*args, **kwargs)
+			failed = False
+			return result
+		finally:
+			seconds = time.perf_counter() - start
+			stack.pop()
+			with _registryLock:
+				entry = _registry.get(name)
+				if entry is None:
+					entry = _registry[name] = [0, 0, 0.0, 0]
+				entry[0] += 1
+				entry[1] += failed
+				entry[2] += seconds
+				entry[3] += frame[1]
+
+	helper.instrumented = func
+	return helper
+
+
+# Function _count is the trace callback: credit a statement to this thread's innermost helper
+def _count(sql):
+
+	stack = getattr(_local, 'stack', None)
+	if stack and not sql.startswith('--'): # '--' lines are trigger bodies, part of their statement
+		stack[-1][1] += 1
+
+
+# Function _trace installs the counting callback on a connection once
+def _trace(db):
+
+	try:
+		if db in _traced:
+			return
+		_traced.add(db)
+	except TypeError:
+		pass # Plain sqlite3 connections cannot be remembered; set the callback on every call
+	db.set_trace_callback(_count)
+
+
+# Function enableMetrics()
+# Purpose: Turn recording on or off for every instrumented helper
+# Syntax: enableMetrics(<on>)
+def enableMetrics(on=True):
+	global _enabled
+	_enabled = bool(on)
+
+
+# Function metricsEnabled reports whether helpers are recording
+def metricsEnabled():
+	return _enabled
+
+
+# Function snapshotMetrics()
+# Purpose: Copy the registry
+# Syntax: snapshotMetrics(<reset>)
+# Returns: dict of 'module.function' -> {'calls', 'errors', 'seconds', 'statements'}
+# Note: reset=True clears the registry in the same step, for interval reporting
+def snapshotMetrics(reset=False):
+
+	with _registryLock:
+		result = dict((name, {'calls': e[0], 'errors': e[1], 'seconds': e[2], 'statements': e[3]}) for name, e in _registry.items())
+		if reset:
+			_registry.clear()
+	return result
+
+
+# Function resetMetrics clears the registry
+def resetMetrics():
+	with _registryLock:
+		_registry.clear()
+
+
+# Function exportMetrics()
+# Purpose: Render the registry in the Prometheus text exposition format
+# Syntax: exportMetrics()
+# Returns: text with helper_calls_total, helper_errors_total, helper_seconds_total and
+#          helper_statements_total, one sample per helper labelled module and function
+def exportMetrics():
+
+	snapshot = snapshotMetrics()
+	lines = []
+	for metric, key, kind in [('helper_calls_total', 'calls', 'counter'), ('helper_errors_total', 'errors', 'counter'),
+		('helper_seconds_total', 'seconds', 'counter'), ('helper_statements_total', 'statements', 'counter')]:
+		lines.append('# TYPE {0} {1}'.format(metric, kind))
+		for name in sorted(snapshot):
+			module, function = name.rsplit('.', 1)
+			lines.append('{0}{{module="{1}",function="{2}"}} {3}'.format(metric, module, function, snapshot[name][key]))
+	return '\n'.join(lines) + '\n'
@@ -0,0 +1,179 @@
+# PoolHelpers.py implements pooled read-only connections beside one dedicated writer connection
+
+import threading, contextlib
+from Schema import createSchema
+from TransactionHelpers import unitOfWork
+from ArchiveHelpers import attachArchive
+
+# Getters, exist*() checks and other read-only helpers take a connection from a pool of
+# read-only connections; mutations share a single writer connection. In WAL mode readers
+# see the last committed state without waiting for the writer, so listing traffic scales
+# across threads while intake keeps writing.
+#
+#	pool = ConnectionPool('donations.db', readers=8)
+#	packages = pool.call(getUnclaimed) # Runs on a pooled reader
+#	did = pool.call(addDonation, 'P_Usr_1', None) # Runs on the writer
+#	with pool.read() as db:
+#		items = getDonationItems(db, did)
+#	with pool.write() as db: # One transaction for the whole block
+#		addItemByManual(db, did, 'Kale', 2, 'lb')
+#	pool.close()
+POOL_READERS = 4
+POOL_TIMEOUT = 30.0 # Seconds a reader waits for a free connection before TimeoutError
+
+# Helpers that only read, by name prefix; call() sends everything else to the writer.
+# stream*() getters are excluded: their rows outlive the connection checkout.
+READ_PREFIXES = ('get', 'exist', 'is', 'valid', 'search', 'top')
+
+
+# Class ConnectionPool hands out read-only connections and serialises use of the writer
+# Syntax: ConnectionPool(<database_path>, <profile>, <readers>, <timeout>, <archive_path>)
+# Note: Reader connections open lazily up to readers; a thread that already holds one gets
+#       the same connection again when it nests read(), so nesting never waits on the pool.
+#       A connection moves between threads only through the pool, never while checked out.
+#       The writer is held by one thread at a time and is re-entrant for that thread; reads
+#       made by the thread holding it run on the writer so they see its uncommitted work.
+#       An in-memory database is private to one connection, so ':memory:' reads use the writer.
+class ConnectionPool:
+
+	def __init__(self, path=':memory:', profile='throughput', readers=POOL_READERS, timeout=POOL_TIMEOUT, archivePath=None):
+		self.path = path
+		self.profile = profile
+		self.readers = 0 if path == ':memory:' else readers
+		self.timeout = timeout
+		self.archivePath = archivePath
+		self.stats = {'opened': 0, 'waits': 0}
+		self._idle = [] # Free reader connections, most recently used last
+		self._open = 0
+		self._closed = False
+		self._available = threading.Condition()
+		self._local = threading.local()
+		self._writeLock = threading.RLock()
+		self._writer = self._connect(False) # Creates tables and migrates before any reader opens
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+		return False
+
+	def _connect(self, readOnly):
+		db = createSchema(self.path, self.profile, anyThread=True, readOnly=readOnly)
+		if self.archivePath is not None:
+			attachArchive(db, self.archivePath)
+		return db
+
+	# Method read()
+	# Purpose: Borrow a read-only connection for the calling thread
+	# Syntax: with pool.read() as db:
+	# Note: Raises TimeoutError if every reader stays busy for timeout seconds
+	@contextlib.contextmanager
+	def read(self):
+
+		# Reads inside a write() block see that block's uncommitted work
+		if self.readers == 0 or getattr(self._local, 'writing', 0):
+			with self.write() as db:
+				yield db
+			return
+
+		held = getattr(self._local, 'reader', None)
+		if held is not None:
+			yield held # Nested read: the outermost read() returns it to the pool
+			return
+
+		db = self._acquire()
+		self._local.reader = db
+		try:
+			yield db
+		finally:
+			self._local.reader = None
+			self._release(db)
+
+	# Method write()
+	# Purpose: Hold the writer connection for the calling thread
+	# Syntax: with pool.write() as db:
+	# Note: The block is one unit of work: it commits on exit and rolls back if it raises
+	@contextlib.contextmanager
+	def write(self):
+
+		with self._writeLock:
+			if self._closed:
+				raise RuntimeError('ConnectionPool is closed')
+			self._local.writing = getattr(self._local, 'writing', 0) + 1
+			try:
+				with unitOfWork(self._writer):
+					yield self._writer
+			finally:
+				self._local.writing -= 1
+
+	# Method call()
+	# Purpose: Run a helper on a reader or the writer, chosen by the helper's name
+	# Syntax: pool.call(<helper>, <args...>)
+	# Returns: the helper's result
+	def call(self, func, *args, **kwargs):
+
+		if func.__name__.startswith(READ_PREFIXES) and not getattr(self._local, 'writing', 0):
+			with self.read() as db:
+				return func(db, *args, **kwargs)
+		with self._writeLock:
+			if self._closed:
+				raise RuntimeError('ConnectionPool is closed')
+			return func(self._writer, *args, **kwargs) # Helpers commit their own writes
+
+	# Method close()
+	# Purpose: Close idle readers and the writer; readers still checked out close on return
+	def close(self):
+
+		with self._available:
+			self._closed = True
+			idle, self._idle = self._idle, []
+			self._open -= len(idle)
+			self._available.notify_all()
+		for db in idle:
+			db.close()
+		with self._writeLock:
+			self._writer.close()
+
+	# Method _acquire takes an idle reader, opens a new one under the limit, or waits
+	def _acquire(self):
+
+		with self._available:
+			waited = False
+			while True:
+				if self._closed:
+					raise RuntimeError('ConnectionPool is closed')
+				if self._idle:
+					return self._idle.pop()
+				if self._open < self.readers:
+					self._open += 1
+					break
+				if not waited:
+					self.stats['waits'] += 1
+					waited = True
+				if not self._available.wait(self.timeout):
+					raise TimeoutError('No read connection free after {0} seconds'.format(self.timeout))
+
+		# Open outside the lock so other threads can return connections meanwhile
+		try:
+			db = self._connect(True)
+		except BaseException:
+			with self._available:
+				self._open -= 1
+				self._available.notify()
+			raise
+		self.stats['opened'] += 1
+		return db
+
+	# Method _release returns a reader to the pool, ending any read transaction it left open
+	def _release(self, db):
+
+		if db.in_transaction:
+			db.rollback()
+		with self._available:
+			if not self._closed:
+				self._idle.append(db)
+				self._available.notify()
+				return
+			self._open -= 1
+		db.close()
@@ -0,0 +1,137 @@
+# RollupHelpers.py implements reporting rollups of completed donations
+
+from TransactionHelpers import unitOfWork
+from ArchiveHelpers import unionSource
+
+# Functions:
+# applyRollup()
+# retractRollup()
+# getRollupTotals()
+# rebuildRollups()
+# checkRollups()
+
+# donation_rollups holds item counts of completed donations grouped by provider, receiver,
+# title, units and month completed. Mutating helpers keep it current by retracting a
+# donation's contribution before they change it and applying it again afterwards, so
+# dashboards read O(groups) rows instead of scanning donations joined with items.
+ROLLUP_COLUMNS = ('provider', 'receiver', 'title', 'units', 'month')
+
+# Aggregate of completed donations in rollup shape
+	# {0} restricts it to matching donations, {1} is the total expression,
+	# {2} and {3} are the donation and item sources (hot tables, or hot and archived rows)
+ROLLUP_SELECT = '''SELECT d.provider, d.receiver, i.title, i.units, substr(d.completed, 1, 7), {1}
+	FROM {2} d JOIN {3} i ON i.did = d.id
+	WHERE d.completed != 0{0}
+	GROUP BY d.provider, d.receiver, i.title, i.units, substr(d.completed, 1, 7)'''
+
+
+# Function _adjustRollup adds sign times a donation's item counts to its rollup groups
+def _adjustRollup(c, did, sign):
+
+	c.execute(''.join(['INSERT INTO donation_rollups(provider, receiver, title, units, month, count) ',
+		ROLLUP_SELECT.format(' AND d.id = ?', '? * SUM(i.count)', 'donations', 'items'),
+		' ON CONFLICT(provider, receiver, title, units, month) DO UPDATE SET count = count + excluded.count']), (sign, did))
+	if sign < 0 and c.rowcount > 0:
+		# Drop emptied groups; provider and receiver pin the search to this donation's groups
+		c.execute('''DELETE FROM donation_rollups WHERE count = 0
+			AND provider = (SELECT provider FROM donations WHERE id = ?)
+			AND receiver = (SELECT receiver FROM donations WHERE id = ?)''', (did, did))
+
+
+# Function applyRollup()
+# Purpose: Add a donation's items to the rollups if it is completed
+# Syntax: applyRollup(<cursor>, <donation_id>)
+# Note: Caller owns the transaction; a pending donation contributes nothing
+def applyRollup(c, did):
+	_adjustRollup(c, did, 1)
+
+
+# Function retractRollup()
+# Purpose: Remove a donation's items from the rollups if it is completed
+# Syntax: retractRollup(<cursor>, <donation_id>)
+# Note: Call before changing a donation or its items, then applyRollup() after
+def retractRollup(c, did):
+	_adjustRollup(c, did, -1)
+
+
+# Function getRollupTotals()
+# Purpose: Read donated totals grouped by any rollup columns
+# Syntax: getRollupTotals(<connection>, <group_by>, <column>=<value>, ...)
+# Returns: list of (<group_by values...>, total) ordered by group; [] if none or bad column
+# Note: group_by and filters use ROLLUP_COLUMNS, e.g.
+#	getRollupTotals(db, ('month',), provider='P_Usr_1')
+#	getRollupTotals(db, ('title', 'units'), month='2026-10')
+def getRollupTotals(db, groupBy, **filters):
+
+	groupBy = tuple(groupBy)
+	if any(column not in ROLLUP_COLUMNS for column in groupBy + tuple(filters)):
+		return []
+
+	SQLquery = ''.join(['SELECT ', ''.join(column + ', ' for column in groupBy), 'SUM(count) FROM donation_rollups'])
+	if filters:
+		SQLquery = ''.join([SQLquery, ' WHERE ', ' AND '.join(column + ' = ?' for column in filters)])
+	if groupBy:
+		SQLquery = ''.join([SQLquery, ' GROUP BY ', ', '.join(groupBy), ' ORDER BY ', ', '.join(groupBy)])
+
+	c = db.cursor()
+	c.execute(SQLquery, tuple(filters.values()))
+	result = c.fetchall()
+	c.close()
+	return [row for row in result if row[-1] is not None]
+
+
+# Function rebuildRollups()
+# Purpose: Recompute every rollup from donations and items
+# Note: Attach the archive first (ArchiveHelpers) or archived donations drop out of the totals
+# Syntax: rebuildRollups(<connection>)
+# Returns: number of rollup groups written
+def rebuildRollups(db):
+
+	with unitOfWork(db):
+		c = db.cursor()
+		c.execute('''DELETE FROM donation_rollups''')
+		c.execute(''.join(['INSERT INTO donation_rollups(provider, receiver, title, units, month, count) ', ROLLUP_SELECT.format('', 'SUM(i.count)', unionSource(db, 'donations'), unionSource(db, 'items'))]))
+		result = c.rowcount
+		c.close()
+	return result
+
+
+# Function checkRollups()
+# Purpose: Compare the rollups against a fresh aggregate
+# Syntax: checkRollups(<connection>)
+# Returns: list of (provider, receiver, title, units, month, stored, actual) that disagree; [] if consistent
+def checkRollups(db):
+
+	c = db.cursor()
+	c.execute('''SELECT provider, receiver, title, units, month, count FROM donation_rollups''')
+	stored = dict((row[:5], row[5]) for row in c.fetchall())
+	c.execute(ROLLUP_SELECT.format('', 'SUM(i.count)', unionSource(db, 'donations'), unionSource(db, 'items')))
+	actual = dict((row[:5], row[5]) for row in c.fetchall())
+	c.close()
+
+	result = []
+	for group in sorted(set(stored) | set(actual), key=lambda g: tuple(str(v) for v in g)):
+		if stored.get(group, 0) != actual.get(group, 0):
+			result.append(group + (stored.get(group, 0), actual.get(group, 0)))
+	return result
+
+
+if __name__ == '__main__':
+
+	# Usage: python3 RollupHelpers.py <database_path> [rebuild|check]
+	import sys
+	from Schema import createSchema
+
+	if len(sys.argv) < 2:
+		print('Usage: python3 RollupHelpers.py <database_path> [rebuild|check]')
+		sys.exit(1)
+
+	db = createSchema(sys.argv[1])
+	if len(sys.argv) > 2 and sys.argv[2] == 'rebuild':
+		print('Rebuilt {0} rollup groups'.format(rebuildRollups(db)))
+	else:
+		mismatches = checkRollups(db)
+		for row in mismatches:
+			print('MISMATCH: {0}'.format(row))
+		print('PASS: rollups consistent' if not mismatches else 'FAIL: {0} rollup groups differ'.format(len(mismatches)))
+	db.close()
@@ -0,0 +1,114 @@
+# ScanHelpers.py implements buffered barcode scanning into a single donation
+
+import time
+from DonationHelpers import existDonation, getBarcode, _mergeItem, _beforeItemsChange, _afterItemsChange
+from TransactionHelpers import unitOfWork
+
+# Class ScanSession collects barcode scans for one donation and writes them in batches
+# Syntax: ScanSession(<connection>, <donation_id>, <batch_size>, <interval_seconds>)
+# Note: Scans are merged in memory by barcode and flushed when batch_size scans are buffered,
+#       when interval seconds have passed since the last flush (checked on each scan), or on
+#       close(). Each flush is one transaction and keeps addItemByBarcode() semantics: scans
+#       with the same title/units accumulate into one item row.
+#
+#	with ScanSession(db, did) as session:
+#		session.scan('4073')
+#		session.scan('4725', 3)
+#	results = session.results # [(code, count, item_id or -1), ...] in scan order
+class ScanSession:
+
+	def __init__(self, db, did, batchSize=100, interval=None):
+		self.db = db
+		self.did = did
+		self.batchSize = batchSize
+		self.interval = interval
+		self.valid = existDonation(db, did) # Validate donation once per session
+		self.results = [] # (code, count, item_id) per scan, -1 on failure, None until flushed
+		self._codes = dict() # barcode -> (title, units), None if unknown
+		self._pending = [] # (results_index, code, count) per buffered scan
+		self._lastFlush = time.monotonic()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+		return False
+
+	# Method scan()
+	# Purpose: Buffer one scan
+	# Syntax: session.scan(<barcode>, <count>)
+	# Returns: True if scan accepted, False if donation invalid or barcode unknown
+	# Note: Defaults to 1 if arg count < 1 for autoscan, as addItemByBarcode()
+	def scan(self, code, count=1):
+
+		if not self.valid or self._lookup(code) is None:
+			self.results.append((code, count, -1))
+			return False
+
+		if count < 1:
+			count = 1
+		self._pending.append((len(self.results), code, count))
+		self.results.append((code, count, None))
+
+		if len(self._pending) >= self.batchSize:
+			self.flush()
+		elif self.interval is not None and time.monotonic() - self._lastFlush >= self.interval:
+			self.flush()
+		return True
+
+	# Method flush()
+	# Purpose: Write buffered scans in one transaction
+	# Syntax: session.flush()
+	# Returns: list of (code, count, item_id) for the flushed scans; item_id -1 on failure
+	def flush(self):
+
+		pending, self._pending = self._pending, []
+		self._lastFlush = time.monotonic()
+		if not pending:
+			return []
+
+		# Merge scans by item identity; the last code scanned labels the row, as addItemByBarcode()
+		groups = dict() # (title, units) -> [total_count, last_code]
+		for index, code, count in pending:
+			title, units = self._lookup(code)
+			group = groups.setdefault((title, units), [0, code])
+			group[0] += count
+			group[1] = code
+
+		ids = dict()
+		c = self.db.cursor()
+		try:
+			with unitOfWork(self.db):
+				# Donation may have been deleted since the session opened
+				c.execute('''SELECT id FROM donations WHERE id=?''', (self.did,))
+				if c.fetchone() is None:
+					self.valid = False
+				else:
+					_beforeItemsChange(c, self.did)
+					for (title, units), (count, code) in groups.items():
+						ids[(title, units)] = _mergeItem(c, self.did, code, title, units, count)
+					_afterItemsChange(self.db, c, self.did) # Commits and publishes with the unit
+		finally:
+			c.close()
+
+		flushed = []
+		for index, code, count in pending:
+			self.results[index] = (code, count, ids.get(self._lookup(code), -1))
+			flushed.append(self.results[index])
+		return flushed
+
+	# Method close()
+	# Purpose: Flush remaining scans and end the session
+	# Syntax: session.close()
+	# Returns: list of (code, count, item_id) for every scan in the session
+	def close(self):
+		self.flush()
+		return self.results
+
+	# Method _lookup returns (title, units) for a barcode, reading each code once per session
+	def _lookup(self, code):
+
+		if code not in self._codes:
+			self._codes[code] = getBarcode(self.db, code)
+		return self._codes[code]
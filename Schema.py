@@ -1,16 +1,244 @@
 # Schema.py implements the database
 
-import sys, sqlite3, datetime
+import os, sys, sqlite3, datetime, itertools
+from urllib.request import pathname2url
 from sqlite3 import Error
 
+# Class Database is the connection type returned by createSchema()
+# cacheKey names the underlying database so in-process caches are shared by every
+# connection to the same file, while each in-memory database gets its own key
+# archive is True while ArchiveHelpers has an archive database attached to the connection
+class Database(sqlite3.Connection):
+
+	_memoryKeys = itertools.count(1)
+	archive = False
+
+	def __init__(self, *args, **kwargs):
+		sqlite3.Connection.__init__(self, *args, **kwargs)
+		path = args[0] if args else kwargs.get('database')
+		if path == ':memory:' or path == '':
+			self.cacheKey = ':memory:{0}'.format(next(Database._memoryKeys))
+		else:
+			self.cacheKey = os.path.abspath(path)
+
+# Storage profiles: PRAGMA settings applied when a connection is opened
+	# journal: journal_mode (WAL lets readers proceed while a writer commits)
+	# synchronous: fsync level (FULL survives power loss, NORMAL is safe in WAL, OFF for disposable loads)
+	# cache: page cache size in KiB (negative values per sqlite convention)
+	# mmap: bytes of the database file read through memory mapping
+PROFILES = {
+	'durable': {'journal': 'WAL', 'synchronous': 'FULL', 'cache': -16000, 'mmap': 268435456},
+	'throughput': {'journal': 'WAL', 'synchronous': 'NORMAL', 'cache': -64000, 'mmap': 1073741824},
+	'bulk-load': {'journal': 'WAL', 'synchronous': 'OFF', 'cache': -256000, 'mmap': 1073741824},
+}
+
+# Migrations: ordered (version, description, statements) applied once each by migrate()
+	# Append new steps with the next version number; never edit a released step
+MIGRATIONS = [
+	(1, 'index donations by provider and status', [
+		'''CREATE INDEX IF NOT EXISTS donations_provider ON donations(provider, completed)''']),
+	(2, 'index donations by receiver and status', [
+		'''CREATE INDEX IF NOT EXISTS donations_receiver ON donations(receiver, completed)''']),
+	(3, 'index items by donation, title and units', [
+		'''CREATE INDEX IF NOT EXISTS items_did_title_units ON items(did, title, units)''']),
+	(4, 'index users by parent', [
+		'''CREATE INDEX IF NOT EXISTS users_pid ON users(pid)''']),
+	(5, 'org hierarchy closure table', [
+		'''CREATE TABLE IF NOT EXISTS user_tree(
+			ancestor TEXT NOT NULL,
+			descendant TEXT NOT NULL,
+			depth INTEGER NOT NULL,
+			PRIMARY KEY(ancestor, descendant)) WITHOUT ROWID''',
+		'''CREATE INDEX IF NOT EXISTS user_tree_descendant ON user_tree(descendant, depth)''',
+		'''INSERT OR IGNORE INTO user_tree(ancestor, descendant, depth)
+			WITH RECURSIVE tree(ancestor, descendant, depth) AS (
+				SELECT uid, uid, 0 FROM users
+				UNION ALL
+				SELECT u.pid, tree.descendant, tree.depth + 1 FROM tree JOIN users u ON u.uid = tree.ancestor
+				WHERE u.pid != u.uid)
+			SELECT ancestor, descendant, depth FROM tree''']),
+	(6, 'extend donation indexes with created for keyset pages', [
+		'''CREATE INDEX IF NOT EXISTS donations_provider_created ON donations(provider, completed, created)''',
+		'''CREATE INDEX IF NOT EXISTS donations_receiver_created ON donations(receiver, completed, created)''',
+		'''DROP INDEX IF EXISTS donations_provider''',
+		'''DROP INDEX IF EXISTS donations_receiver''']),
+	(7, 'donation change feed', [
+		'''CREATE TABLE IF NOT EXISTS donation_changes(
+			seq INTEGER PRIMARY KEY AUTOINCREMENT,
+			did INTEGER NOT NULL,
+			kind TEXT NOT NULL,
+			at TIMESTAMP)''']),
+	(8, 'pickup locations with grid index', [
+		'''CREATE TABLE IF NOT EXISTS donation_locations(
+			did INTEGER PRIMARY KEY,
+			lat REAL NOT NULL,
+			lon REAL NOT NULL,
+			cellLat INTEGER NOT NULL,
+			cellLon INTEGER NOT NULL)''',
+		'''CREATE INDEX IF NOT EXISTS donation_locations_cell ON donation_locations(cellLat, cellLon)''',
+		'''CREATE TABLE IF NOT EXISTS user_locations(
+			uid TEXT PRIMARY KEY,
+			lat REAL NOT NULL,
+			lon REAL NOT NULL)''']),
+	(9, 'reporting rollups of completed donations', [
+		'''CREATE TABLE IF NOT EXISTS donation_rollups(
+			provider TEXT NOT NULL,
+			receiver TEXT NOT NULL,
+			title TEXT NOT NULL,
+			units TEXT NOT NULL,
+			month TEXT NOT NULL,
+			count INTEGER NOT NULL,
+			PRIMARY KEY(provider, receiver, title, units, month))''',
+		'''CREATE INDEX IF NOT EXISTS donation_rollups_receiver ON donation_rollups(receiver, month)''',
+		'''CREATE INDEX IF NOT EXISTS donation_rollups_month ON donation_rollups(month)''',
+		'''INSERT INTO donation_rollups(provider, receiver, title, units, month, count)
+			SELECT d.provider, d.receiver, i.title, i.units, substr(d.completed, 1, 7), SUM(i.count)
+			FROM donations d JOIN items i ON i.did = d.id
+			WHERE d.completed != 0
+			GROUP BY d.provider, d.receiver, i.title, i.units, substr(d.completed, 1, 7)''']),
+	# Triggers rather than helper hooks keep the indexes current, since items are also written by
+	# bulk loaders that bypass the helpers; only title changes touch the index, not count edits
+	(10, 'full-text search over item and barcode titles', [
+		'''CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+			title, content='items', content_rowid='id', tokenize='unicode61 remove_diacritics 2')''',
+		'''CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+			INSERT INTO items_fts(rowid, title) VALUES(new.id, new.title);
+			END''',
+		'''CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+			INSERT INTO items_fts(items_fts, rowid, title) VALUES('delete', old.id, old.title);
+			END''',
+		'''CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF id, title ON items BEGIN
+			INSERT INTO items_fts(items_fts, rowid, title) VALUES('delete', old.id, old.title);
+			INSERT INTO items_fts(rowid, title) VALUES(new.id, new.title);
+			END''',
+		'''INSERT INTO items_fts(items_fts) VALUES('rebuild')''',
+		'''CREATE VIRTUAL TABLE IF NOT EXISTS barcodes_fts USING fts5(
+			title, content='barcodes', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')''',
+		'''CREATE TRIGGER IF NOT EXISTS barcodes_fts_insert AFTER INSERT ON barcodes BEGIN
+			INSERT INTO barcodes_fts(rowid, title) VALUES(new.rowid, new.title);
+			END''',
+		'''CREATE TRIGGER IF NOT EXISTS barcodes_fts_delete AFTER DELETE ON barcodes BEGIN
+			INSERT INTO barcodes_fts(barcodes_fts, rowid, title) VALUES('delete', old.rowid, old.title);
+			END''',
+		'''CREATE TRIGGER IF NOT EXISTS barcodes_fts_update AFTER UPDATE OF title ON barcodes BEGIN
+			INSERT INTO barcodes_fts(barcodes_fts, rowid, title) VALUES('delete', old.rowid, old.title);
+			INSERT INTO barcodes_fts(rowid, title) VALUES(new.rowid, new.title);
+			END''',
+		'''INSERT INTO barcodes_fts(barcodes_fts) VALUES('rebuild')''']),
+	(11, 'live inventory of unclaimed items', [
+		'''CREATE TABLE IF NOT EXISTS unclaimed_inventory(
+			title TEXT NOT NULL,
+			units TEXT NOT NULL,
+			count INTEGER NOT NULL,
+			PRIMARY KEY(title, units))''',
+		'''CREATE INDEX IF NOT EXISTS unclaimed_inventory_count ON unclaimed_inventory(count)''',
+		'''CREATE INDEX IF NOT EXISTS unclaimed_inventory_units_count ON unclaimed_inventory(units, count)''',
+		'''INSERT INTO unclaimed_inventory(title, units, count)
+			SELECT i.title, i.units, SUM(i.count)
+			FROM donations d JOIN items i ON i.did = d.id
+			WHERE d.receiver = 'pending' AND d.completed = 0
+			GROUP BY i.title, i.units''']),
+	(12, 'index completed donations by completion time for archival', [
+		'''CREATE INDEX IF NOT EXISTS donations_completed ON donations(completed) WHERE completed != 0''']),
+	# CacheHelpers.RowCache re-reads a counter after commits from other connections and
+	# processes, and drops its cached rows for the table if the counter moved
+	(13, 'version counter for cached users', [
+		'''CREATE TABLE IF NOT EXISTS cache_versions(
+			name TEXT PRIMARY KEY,
+			version INTEGER NOT NULL) WITHOUT ROWID''',
+		'''INSERT OR IGNORE INTO cache_versions(name, version) VALUES('users', 0)''',
+		'''CREATE TRIGGER IF NOT EXISTS users_version_insert AFTER INSERT ON users BEGIN
+			UPDATE cache_versions SET version = version + 1 WHERE name = 'users';
+			END''',
+		'''CREATE TRIGGER IF NOT EXISTS users_version_update AFTER UPDATE OF uid, perms ON users BEGIN
+			UPDATE cache_versions SET version = version + 1 WHERE name = 'users';
+			END''',
+		'''CREATE TRIGGER IF NOT EXISTS users_version_delete AFTER DELETE ON users BEGIN
+			UPDATE cache_versions SET version = version + 1 WHERE name = 'users';
+			END''']),
+	(14, 'version counter for cached barcodes', [
+		'''INSERT OR IGNORE INTO cache_versions(name, version) VALUES('barcodes', 0)''',
+		'''CREATE TRIGGER IF NOT EXISTS barcodes_version_insert AFTER INSERT ON barcodes BEGIN
+			UPDATE cache_versions SET version = version + 1 WHERE name = 'barcodes';
+			END''',
+		'''CREATE TRIGGER IF NOT EXISTS barcodes_version_update AFTER UPDATE ON barcodes BEGIN
+			UPDATE cache_versions SET version = version + 1 WHERE name = 'barcodes';
+			END''',
+		'''CREATE TRIGGER IF NOT EXISTS barcodes_version_delete AFTER DELETE ON barcodes BEGIN
+			UPDATE cache_versions SET version = version + 1 WHERE name = 'barcodes';
+			END''']),
+	# Without AUTOINCREMENT, deleting the newest donation hands its id out again, and a new
+	# donation would then hide an archived one with the same id (see ArchiveHelpers.py)
+	(15, 'never reuse donation ids', [
+		'''CREATE TABLE donations_autoincrement(
+			id INTEGER PRIMARY KEY AUTOINCREMENT,
+			provider TEXT NOT NULL,
+			receiver TEXT DEFAULT "pending",
+			created TIMESTAMP,
+			completed TIMESTAMP DEFAULT 0)''',
+		'''INSERT INTO donations_autoincrement(id, provider, receiver, created, completed)
+			SELECT id, provider, receiver, created, completed FROM donations''',
+		'''DROP TABLE donations''',
+		'''ALTER TABLE donations_autoincrement RENAME TO donations''',
+		'''CREATE INDEX IF NOT EXISTS donations_provider_created ON donations(provider, completed, created)''',
+		'''CREATE INDEX IF NOT EXISTS donations_receiver_created ON donations(receiver, completed, created)''',
+		'''CREATE INDEX IF NOT EXISTS donations_completed ON donations(completed) WHERE completed != 0''']),
+	# A per-row insert trigger made importCatalog() about 4x slower; the importer now adds each
+	# chunk's new codes to barcodes_fts in one statement, and addBarcode() adds its own row.
+	# Updates and deletes stay on triggers. Raw inserts into barcodes need rebuildSearch().
+	(16, 'index new barcodes from their writers', [
+		'''DROP TRIGGER IF EXISTS barcodes_fts_insert''']),
+]
+
+# Function applyProfile()
+# Purpose: Apply a named storage profile to an open connection
+# Syntax: applyProfile(<connection>, <profile_name>)
+# Returns: True if profile applied, else False
+# Note: In-memory databases report journal_mode 'memory' regardless of profile
+def applyProfile(db, profile):
+
+	if profile not in PROFILES:
+		return False
+	settings = PROFILES[profile]
+
+	c = db.cursor()
+	c.execute('PRAGMA journal_mode = {0}'.format(settings['journal']))
+	c.execute('PRAGMA synchronous = {0}'.format(settings['synchronous']))
+	c.execute('PRAGMA cache_size = {0}'.format(int(settings['cache'])))
+	c.execute('PRAGMA mmap_size = {0}'.format(int(settings['mmap'])))
+	c.close()
+	return True
+
+
 # Set up tables and return connection
-def createSchema():
+# Syntax: createSchema(<database_path>, <profile_name>, <any_thread>, <read_only>)
+# Note: Defaults to an in-memory database. Tables are only created if missing,
+#       so a file database keeps its rows across restarts and processes.
+#       anyThread lets the connection be passed between threads (e.g. closed by a pool
+#       owner); callers must still ensure only one thread uses it at a time.
+#       readOnly opens an existing file database that cannot be written through this
+#       connection; tables and migrations are left to a read-write connection.
+def createSchema(path=':memory:', profile='durable', anyThread=False, readOnly=False):
 	try:
-		db = sqlite3.connect(':memory:')
+		if readOnly:
+			uri = 'file:{0}?mode=ro'.format(pathname2url(os.path.abspath(path)))
+			db = sqlite3.connect(uri, factory=Database, check_same_thread=not anyThread, uri=True)
+			db.cacheKey = os.path.abspath(path) # Share caches with read-write connections
+		else:
+			db = sqlite3.connect(path, factory=Database, check_same_thread=not anyThread)
 	except Error as e:
 		print(e)
 		sys.exit(1)
 
+	if not applyProfile(db, profile):
+		print('Unknown storage profile: {0}'.format(profile))
+		db.close()
+		sys.exit(1)
+
+	if readOnly:
+		db.execute('PRAGMA query_only = ON')
+		return db
+
 	c = db.cursor()
 
 	# pid is uid of parent account (authenticating Org or Admin)
@@ -19,35 +247,94 @@ def createSchema():
 		# x: Orgizational Access (create/delete accounts)
 		# y: Provider Access (create donations, et al.)
 		# z: Receiver Access (claim donations, et al.)
-	c.execute('''CREATE TABLE users(
+	c.execute('''CREATE TABLE IF NOT EXISTS users(
 		pid TEXT NOT NULL,
 		perms INTEGER,
-		uid TEXT NOT NULL UNIQUE, 
+		uid TEXT NOT NULL UNIQUE,
 		hash TEXT)''')
 
 	# barcodes contains title and unit type for barcoded items
-	c.execute('''CREATE TABLE barcodes(
+	c.execute('''CREATE TABLE IF NOT EXISTS barcodes(
 		code TEXT NOT NULL UNIQUE,
 		title TEXT NOT NULL,
 		units INTEGER NOT NULL)''')
 
 
 	# did is associated donation id
-	c.execute('''CREATE TABLE items(
+	c.execute('''CREATE TABLE IF NOT EXISTS items(
 		id INTEGER PRIMARY KEY,
 		did INTEGER NOT NULL,
-		barcode TEXT, 
-		title TEXT NOT NULL, 
-		count INTEGER NOT NULL, 
+		barcode TEXT,
+		title TEXT NOT NULL,
+		count INTEGER NOT NULL,
 		units TEXT NOT NULL)''')
 
-	c.execute('''CREATE TABLE donations(
-		id INTEGER PRIMARY KEY, 
-		provider TEXT NOT NULL, 
+	c.execute('''CREATE TABLE IF NOT EXISTS donations(
+		id INTEGER PRIMARY KEY,
+		provider TEXT NOT NULL,
 		receiver TEXT DEFAULT "pending",
 		created TIMESTAMP,
-		completed TIMESTAMP DEFAULT 0)''') 
+		completed TIMESTAMP DEFAULT 0)''')
+
+	# schema_version records each applied migration
+	c.execute('''CREATE TABLE IF NOT EXISTS schema_version(
+		version INTEGER PRIMARY KEY,
+		description TEXT,
+		applied TIMESTAMP)''')
 
 	db.commit()
 	c.close()
+
+	if migrate(db) < 0:
+		db.close()
+		sys.exit(1)
+
 	return db
+
+
+# Function schemaVersion()
+# Purpose: Report the highest migration applied to a database
+# Syntax: schemaVersion(<connection>)
+# Returns: version number, 0 if no migrations applied
+def schemaVersion(db):
+
+	c = db.cursor()
+	c.execute('''SELECT MAX(version) FROM schema_version''')
+	result = c.fetchone()
+	c.close()
+
+	if result[0] is not None:
+		return result[0]
+	else:
+		return 0
+
+
+# Function migrate()
+# Purpose: Apply every migration newer than the database's schema version, in order
+# Syntax: migrate(<connection>)
+# Returns: schema version after upgrade, -1 if a migration failed
+# Note: Each migration runs in its own transaction and is rolled back on failure
+def migrate(db):
+
+	current = schemaVersion(db)
+	for version, description, statements in sorted(MIGRATIONS, key=lambda m: m[0]):
+		if version <= current:
+			continue
+
+		c = db.cursor()
+		try:
+			c.execute('BEGIN')
+			for statement in statements:
+				c.execute(statement)
+			now = datetime.datetime.now().replace(microsecond=0)
+			c.execute('''INSERT INTO schema_version(version, description, applied) VALUES(?,?,?)''', (version, description, now))
+			db.commit()
+		except Error as e:
+			db.rollback()
+			print('Migration {0} failed: {1}'.format(version, e))
+			return -1
+		finally:
+			c.close()
+		current = version
+
+	return current
@@ -0,0 +1,111 @@
+# SearchHelpers.py implements full-text search over item and barcode titles
+
+import re
+from TransactionHelpers import unitOfWork
+
+# Functions:
+# matchQuery()
+# searchUnclaimed()
+# searchBarcodes()
+# rebuildSearch()
+
+# items_fts and barcodes_fts are FTS5 indexes over items.title and barcodes.title, kept in
+# sync by triggers (Schema.py migration 10). New barcodes are indexed by their writers,
+# addBarcode() and importCatalog(), in bulk (migration 16). A search reads the index's posting lists for
+# its terms instead of every unclaimed donation's items, so cost follows the number of
+# matching items rather than the size of the items table.
+
+# Donations per rows query in searchUnclaimed(), below SQLite's host parameter limit
+SEARCH_BATCH_SIZE = 500
+
+# Words in user input; everything else (quotes, operators, punctuation) is dropped
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+# Function matchQuery()
+# Purpose: Turn user input into a safe FTS5 MATCH expression
+# Syntax: matchQuery(<text>, <any_term>)
+# Returns: expression string, or None if text has no searchable words
+# Note: Each word is quoted and prefix matched, so 'potato' also finds 'Potatoes' and user
+#       input cannot inject FTS operators. Words must all match unless anyTerm is True.
+def matchQuery(text, anyTerm=False):
+
+	terms = _TERM.findall(text or '')
+	if not terms:
+		return None
+	return (' OR ' if anyTerm else ' AND ').join('"{0}"*'.format(term) for term in terms)
+
+
+# Function searchUnclaimed()
+# Purpose: Find unclaimed donations containing items whose titles match a search
+# Syntax: searchUnclaimed(<connection>, <text>, <limit>, <any_term>)
+# Returns: list of (donation, matching_item_list) most relevant first; [] if nothing matches
+# Note: A donation's relevance is the sum of its matching items' bm25 scores, so packages
+#       with more and better matching items rank first. Ties go to the older donation.
+#
+#	for donation, items in searchUnclaimed(db, 'kale potato', anyTerm=True):
+#		print(donation[0], [item[3] for item in items])
+def searchUnclaimed(db, text, limit=50, anyTerm=False):
+
+	query = matchQuery(text, anyTerm)
+	if query is None or limit < 1:
+		return []
+
+	# Rank donations from the index alone; CROSS JOIN keeps items_fts as the outer loop
+	c = db.cursor()
+	c.execute('''SELECT i.did, SUM(f.rank) AS score, group_concat(i.id) FROM items_fts f
+		CROSS JOIN items i ON i.id = f.rowid
+		CROSS JOIN donations d ON d.id = i.did
+		WHERE items_fts MATCH ? AND d.receiver = 'pending' AND d.completed = 0
+		GROUP BY i.did ORDER BY score, i.did LIMIT ?''', (query, limit))
+	ranked = c.fetchall()
+
+	# Fetch rows for the ranked donations and their matching items only
+	donations = dict()
+	items = dict((did, []) for did, score, ids in ranked)
+	iids = [int(iid) for did, score, ids in ranked for iid in ids.split(',')]
+	dids = list(items.keys())
+	for i in range(0, len(dids), SEARCH_BATCH_SIZE):
+		batch = dids[i:i + SEARCH_BATCH_SIZE]
+		c.execute(''.join(['SELECT * FROM donations WHERE id IN (', ','.join('?' * len(batch)), ')']), batch)
+		for row in c.fetchall():
+			donations[row[0]] = row
+	for i in range(0, len(iids), SEARCH_BATCH_SIZE):
+		batch = iids[i:i + SEARCH_BATCH_SIZE]
+		c.execute(''.join(['SELECT * FROM items WHERE id IN (', ','.join('?' * len(batch)), ') ORDER BY id']), batch)
+		for row in c.fetchall():
+			items[row[1]].append(row)
+	c.close()
+
+	return [(donations[did], items[did]) for did in dids if did in donations]
+
+
+# Function searchBarcodes()
+# Purpose: Find catalog entries whose titles match a search
+# Syntax: searchBarcodes(<connection>, <text>, <limit>, <any_term>)
+# Returns: list of (code, title, units) most relevant first; [] if nothing matches
+def searchBarcodes(db, text, limit=20, anyTerm=False):
+
+	query = matchQuery(text, anyTerm)
+	if query is None or limit < 1:
+		return []
+
+	c = db.cursor()
+	c.execute('''SELECT b.code, b.title, b.units FROM barcodes_fts f
+		CROSS JOIN barcodes b ON b.rowid = f.rowid
+		WHERE barcodes_fts MATCH ? ORDER BY f.rank, b.code LIMIT ?''', (query, limit))
+	result = c.fetchall()
+	c.close()
+	return result
+
+
+# Function rebuildSearch()
+# Purpose: Rebuild both search indexes from the items and barcodes tables
+# Syntax: rebuildSearch(<connection>)
+# Note: Needed only after VACUUM, which may renumber barcodes rowids, or after writes made
+#       with triggers disabled, or after raw inserts into barcodes. Items are keyed by their INTEGER PRIMARY KEY and never drift.
+def rebuildSearch(db):
+
+	with unitOfWork(db):
+		db.execute('''INSERT INTO items_fts(items_fts) VALUES('rebuild')''')
+		db.execute('''INSERT INTO barcodes_fts(barcodes_fts) VALUES('rebuild')''')
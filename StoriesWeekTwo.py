@@ -1,7 +1,17 @@
-import datetime, random
+import datetime, random, io, os, json, shutil, tempfile, threading, http.client
 from Schema import createSchema
-from UserHelpers import existUser, validUser, writeUser, changePassword
-from DonationHelpers import addDonation, deleteDonation, editDonation, addItemByManual, addItemByBarcode, getProviderPending, getReceiverPending, getReceiverComplete, getUnclaimed, getDonationItems, claimDonation, unclaimDonation, completeDonation, existDonation, existItem, existBarcode, addBarcode
+from UserHelpers import existUser, validUser, writeUser, changePassword, isProvider, provisionUsers
+from HierarchyHelpers import getSubtree, getAncestors, isAncestor, getSubtreeDonations
+from ChangeHelpers import changesSince, donationDeltas
+from LocationHelpers import setDonationLocation, getUnclaimedNear
+from SearchHelpers import searchUnclaimed, searchBarcodes
+from InventoryHelpers import applyInventory, getInventory, topInventory, checkInventory
+from RollupHelpers import checkRollups
+from CatalogHelpers import readCatalog, importCatalog
+from MetricsHelpers import enableMetrics, metricsEnabled
+from TransactionHelpers import unitOfWork, afterCommit
+from DonationService import DonationService
+from DonationHelpers import getBarcode, addDonation, deleteDonation, editDonation, addItemByManual, addItemByBarcode, getProviderPending, getProviderComplete, getReceiverPending, getReceiverComplete, getUnclaimed, getUnclaimedPage, getUnclaimedWithItems, getReceiverPendingPage, getDonationItems, claimDonation, unclaimDonation, completeDonation, existDonation, existItem, existBarcode, addBarcode
 
 # FUNCTIONS:
 # printDonation
@@ -214,9 +224,8 @@ def storyReceiverSeePast(db, test, story, rid):
 # populate users fills the users table
 def populateUsers(db, parents, users, perms, pwd):
 
-	# Build user table against params
-	for ppid, uid, perm, wd in zip(parents, users, perms, pwd):
-		writeUser(db, ppid, uid, perm, wd)
+	# Build user table against params in one transaction
+	provisionUsers(db, zip(parents, users, perms, pwd))
 
 
 # Syntax: printDonation(<donation_list>)	
@@ -283,6 +292,7 @@ def addDonationRandom(db, pid, rid, items, minCount, maxCount):
 
 	c = db.cursor()
 	c.executemany('''INSERT INTO items(barcode, title, units, count, did) VALUES(?,?,?,?,?)''', chosenItems) 
+	applyInventory(c, did) # Bulk insert bypasses the item helpers
 	db.commit()
 	c.close()
 	return did
@@ -357,6 +367,194 @@ def testGRComplete(db, uid):
 	return result
 
 
+# Function testUnitOfWork checks commit, rollback and savepoint behaviour of unitOfWork(), including caches
+def testUnitOfWork(db, test, oid, pid):
+
+	# Record test, initializing key if necessary
+	testFunc = 'unitOfWork'
+	if testFunc not in test.keys(): test[testFunc] = [0, 0]
+	checks = []
+	committed = []
+
+	# Committed unit: every helper's writes land together and afterCommit() callbacks run
+	with unitOfWork(db):
+		did = addDonation(db, pid, None)
+		iid = addItemByManual(db, did, 'Unit Of Work Check', 1, 'each')
+		afterCommit(db, lambda: committed.append(did))
+	checks.append(existDonation(db, did) and existItem(db, iid) and committed == [did])
+
+	# Rolled back unit: nothing written, no callbacks, and no uncommitted rows left in the caches
+	try:
+		with unitOfWork(db):
+			writeUser(db, oid, 'UoW_Usr', 0b10, 'pwd')
+			addBarcode(db, '000000000001', 'Unit Of Work Check', 'each')
+			inside = isProvider(db, 'UoW_Usr') and getBarcode(db, '000000000001') is not None
+			rolled = addDonation(db, pid, None)
+			afterCommit(db, lambda: committed.append(rolled))
+			raise RuntimeError('roll back')
+	except RuntimeError:
+		pass
+	c = db.cursor()
+	c.execute('''SELECT uid FROM users WHERE uid = ?''', ('UoW_Usr',))
+	user = c.fetchone()
+	c.close()
+	checks.append(inside and user is None and not isProvider(db, 'UoW_Usr'))
+	checks.append(getBarcode(db, '000000000001') is None and not existDonation(db, rolled) and committed == [did])
+
+	# Nested unit: a savepoint rolls back alone and the outer unit still commits
+	with unitOfWork(db):
+		editDonation(db, did, iid, 2)
+		try:
+			with unitOfWork(db):
+				inner = addItemByManual(db, did, 'Unit Of Work Savepoint', 1, 'each')
+				raise RuntimeError('roll back savepoint')
+		except RuntimeError:
+			pass
+	checks.append(not existItem(db, inner) and [item[4] for item in getDonationItems(db, did)] == [2])
+
+	deleteDonation(db, did)
+	for passed in checks:
+		test[testFunc][0] += 1 # Increment test count
+		if not passed: test[testFunc][1] += 1 # Record failure
+
+
+# Catalog file for testCatalogImport: three valid rows and one missing its units
+CATALOG_CHECK = 'code,title,units\n000000000101,Catalog Check A,lb\n000000000102,Catalog Check B,each\n000000000103,Catalog Check C\n000000000104,Catalog Check D,lb\n'
+
+# Function testCatalogImport pins importCatalog() counts for a fresh import, a repeat and an upsert
+# Note: Triggers on barcodes write more rows than the import itself; the counts must not include them
+def testCatalogImport(db, test):
+
+	# Record test, initializing key if necessary
+	testFunc = 'importCatalog'
+	if testFunc not in test.keys(): test[testFunc] = [0, 0]
+
+	progress = []
+	expected = [
+		(False, {'read': 4, 'written': 3, 'skipped': 0, 'invalid': 1}),
+		(False, {'read': 4, 'written': 0, 'skipped': 3, 'invalid': 1}),
+		(True, {'read': 4, 'written': 3, 'skipped': 0, 'invalid': 1}),
+	]
+	for upsert, counts in expected:
+		test[testFunc][0] += 1 # Increment test count
+		result = importCatalog(db, readCatalog(io.StringIO(CATALOG_CHECK)), upsert, progress=progress.append)
+		if result != counts or progress[-1] != counts: test[testFunc][1] += 1 # Record failure
+
+	test[testFunc][0] += 1 # Increment test count
+	if getBarcode(db, '000000000104') != ('Catalog Check D', 'lb'): test[testFunc][1] += 1 # Record failure
+
+
+# Function testServiceKeepAlive checks that error replies leave a keep-alive connection usable
+# Note: Each request's body must be consumed before the reply, or it is parsed as the next request
+def testServiceKeepAlive(test):
+
+	# Record test, initializing key if necessary
+	testFunc = 'serviceKeepAlive'
+	if testFunc not in test.keys(): test[testFunc] = [0, 0]
+
+	directory = tempfile.mkdtemp(prefix='donations-check-')
+	service = DonationService(os.path.join(directory, 'donations.db'), port=0, workers=2)
+	server = threading.Thread(target=service.serve_forever)
+	server.start()
+	conn = http.client.HTTPConnection(service.server_address[0], service.server_address[1], timeout=10)
+	try:
+		# Unknown helper with a body, then a valid call on the same connection
+		expected = [('/nope', b'[1, 2, 3]', 404), ('/existDonation', b'[1]', 200)]
+		for path, body, status in expected:
+			test[testFunc][0] += 1 # Increment test count
+			conn.request('POST', path, body)
+			response = conn.getresponse()
+			response.read()
+			if response.status != status: test[testFunc][1] += 1 # Record failure
+
+		# Oversized body: refused unread and the connection closed; the client reconnects
+		test[testFunc][0] += 1 # Increment test count
+		conn.putrequest('POST', '/existDonation')
+		conn.putheader('Content-Length', '2097152')
+		conn.endheaders()
+		response = conn.getresponse()
+		response.read()
+		if response.status != 413 or response.getheader('Connection') != 'close': test[testFunc][1] += 1 # Record failure
+
+		test[testFunc][0] += 1 # Increment test count
+		conn.request('POST', '/existDonation', b'[1]')
+		response = conn.getresponse()
+		if response.status != 200 or json.loads(response.read()) != {'result': False}: test[testFunc][1] += 1 # Record failure
+	finally:
+		conn.close()
+		service.shutdown()
+		server.join()
+		shutil.rmtree(directory, ignore_errors=True)
+
+
+# Statements allowed to scan: the first-user probe in writeUser() reads a single row
+ALLOWED_SCANS = ['SELECT * FROM users']
+
+# Function testQueryPlans runs the helpers on a scratch donation and fails any statement planned as a SCAN
+def testQueryPlans(db, test, pid, rid):
+
+	# Record test, initializing key if necessary
+	testFunc = 'queryPlans'
+	if testFunc not in test.keys(): test[testFunc] = [0, 0]
+
+	# Capture every statement the helpers issue (trace gives bound values inline)
+	# Metrics would take over the trace callback, so pause them while capturing
+	statements = []
+	metrics = metricsEnabled()
+	enableMetrics(False)
+	db.set_trace_callback(statements.append)
+	addBarcode(db, '000000000000', 'Query Plan Check', 'each')
+	did = addDonation(db, pid, None)
+	iid = addItemByManual(db, did, 'Query Plan Check', 1, 'each')
+	addItemByBarcode(db, did, '000000000000', 1)
+	editDonation(db, did, iid, 2)
+	existDonation(db, did)
+	existItem(db, iid)
+	existBarcode(db, '000000000000')
+	getProviderPending(db, pid)
+	getProviderComplete(db, pid)
+	getUnclaimed(db)
+	getUnclaimedPage(db, 1, getUnclaimedPage(db, 1)[1])
+	getUnclaimedWithItems(db)
+	setDonationLocation(db, did, 45.52, -122.68)
+	getUnclaimedNear(db, 45.52, -122.68, 5.0, 10)
+	searchUnclaimed(db, 'query plan')
+	searchBarcodes(db, 'query plan')
+	getInventory(db, 'Query Plan Check', 'each')
+	topInventory(db, 10, 'each')
+	claimDonation(db, did, rid)
+	getReceiverPending(db, rid)
+	getReceiverPendingPage(db, rid, 1, None, False)
+	unclaimDonation(db, did, rid)
+	completeDonation(db, did)
+	getReceiverComplete(db, rid)
+	getDonationItems(db, did)
+	isProvider(db, pid)
+	validUser(db, pid, pid)
+	getSubtree(db, pid)
+	getAncestors(db, pid)
+	isAncestor(db, rid, pid)
+	getSubtreeDonations(db, pid, 'pending')
+	changesSince(db, 0, 10)
+	donationDeltas(db, 0, 10)
+	deleteDonation(db, did)
+	db.set_trace_callback(None)
+	enableMetrics(metrics)
+
+	c = db.cursor()
+	for sql in statements:
+		if sql.split(None, 1)[0].upper() not in ('SELECT', 'UPDATE', 'DELETE'): continue
+		if sql in ALLOWED_SCANS: continue
+		test[testFunc][0] += 1 # Increment test count
+		c.execute('EXPLAIN QUERY PLAN ' + sql)
+		# Full-text MATCH is reported as a SCAN of the virtual table but reads only the index
+		scans = [row[3] for row in c.fetchall() if row[3].startswith('SCAN') and 'VIRTUAL TABLE INDEX 0:M' not in row[3]]
+		if scans:
+			test[testFunc][1] += 1 # Record failure
+			print('QUERY PLAN SCAN: {0} -> {1}'.format(sql, '; '.join(scans)))
+	c.close()
+
+
 if __name__ == '__main__':
 
 	random.seed() #Randomize RNG
@@ -435,6 +633,24 @@ if __name__ == '__main__':
 	# STORY: Receiver can see past donations
 	storyReceiverSeePast(db, test, stories[6], 'R_Usr_1')
 
+	# CHECK: Units of work commit, roll back and nest as savepoints without leaving cached state
+	testUnitOfWork(db, test, 'P_Org', 'P_Usr_1')
+
+	# CHECK: Catalog imports report rows written, not rows written by triggers
+	testCatalogImport(db, test)
+
+	# CHECK: Error replies from the service keep the next request on the connection intact
+	testServiceKeepAlive(test)
+
+	# CHECK: No helper query regresses to a full table scan
+	testQueryPlans(db, test, 'P_Usr_1', 'R_Usr_1')
+
+	# CHECK: Live inventory matches a fresh aggregate after every story
+	test['checkInventory'] = [1, 0 if checkInventory(db) == [] else 1]
+
+	# CHECK: Reporting rollups match a fresh aggregate after every story
+	test['checkRollups'] = [1, 0 if checkRollups(db) == [] else 1]
+
 	# RESULTS: Print test results
 	printHeader(stories[0])
 	printResults(test)
@@ -0,0 +1,107 @@
+# TransactionHelpers.py implements shared transactions across helper calls
+
+import threading, contextlib
+
+# Functions:
+# unitOfWork()
+# inUnitOfWork()
+# commit()
+# afterCommit()
+
+# Open unit of work depth per connection: id(connection) -> depth
+# Entries only exist while a with block holds the connection, so ids cannot be reused
+_depths = dict()
+_depthLock = threading.Lock()
+
+# Callbacks waiting for the outermost commit: id(connection) -> one list per open block
+_hooks = dict()
+
+
+# Function unitOfWork()
+# Purpose: Make every helper call inside a with block share one transaction
+# Syntax: with unitOfWork(<connection>):
+# Note: The outermost block commits once on exit and rolls back if an exception escapes.
+#       Nested blocks are savepoints: an exception rolls back only that block's work and
+#       is re-raised, so a caller that handles it keeps the outer transaction.
+#
+#	with unitOfWork(db):
+#		did = addDonation(db, 'P_Usr_1', None)
+#		for title, count, units in items:
+#			addItemByManual(db, did, title, count, units)
+@contextlib.contextmanager
+def unitOfWork(db):
+
+	with _depthLock:
+		depth = _depths.get(id(db), 0)
+		_depths[id(db)] = depth + 1
+		_hooks.setdefault(id(db), []).append([])
+
+	savepoint = 'unit_{0}'.format(depth)
+	try:
+		if depth == 0:
+			# Join work already pending on the connection rather than committing it early
+			if not db.in_transaction:
+				db.execute('BEGIN')
+		else:
+			db.execute('SAVEPOINT {0}'.format(savepoint))
+
+		try:
+			yield db
+		except BaseException:
+			if depth == 0:
+				db.rollback()
+			else:
+				db.execute('ROLLBACK TO {0}'.format(savepoint))
+				db.execute('RELEASE {0}'.format(savepoint))
+			with _depthLock:
+				_hooks[id(db)][-1] = [] # Work was undone, so its callbacks never run
+			raise
+
+		if depth == 0:
+			db.commit()
+		else:
+			db.execute('RELEASE {0}'.format(savepoint))
+	finally:
+		with _depthLock:
+			hooks = _hooks[id(db)].pop()
+			if depth == 0:
+				del _depths[id(db)]
+				del _hooks[id(db)]
+			else:
+				_depths[id(db)] = depth
+				_hooks[id(db)][-1].extend(hooks) # Released work commits with the parent
+				hooks = []
+
+	for func in hooks:
+		func()
+
+
+# Function inUnitOfWork()
+# Purpose: Check whether a connection is inside a unitOfWork() block
+# Syntax: inUnitOfWork(<connection>)
+# Returns: True if inside a unit of work, else False
+def inUnitOfWork(db):
+	with _depthLock:
+		return id(db) in _depths
+
+
+# Function commit()
+# Purpose: Commit a helper's writes unless a unitOfWork() will commit them
+# Syntax: commit(<connection>)
+def commit(db):
+	if not inUnitOfWork(db):
+		db.commit()
+
+
+# Function afterCommit()
+# Purpose: Run a callback once the caller's writes are committed
+# Syntax: afterCommit(<connection>, <callback>)
+# Note: Outside a unit of work the writes are already committed and callback runs now.
+#       Inside one it runs after the outermost commit, and never if the work is rolled back.
+def afterCommit(db, func):
+
+	with _depthLock:
+		if id(db) in _hooks:
+			_hooks[id(db)][-1].append(func)
+			return
+	func()
@@ -1,6 +1,49 @@
 # UserHelpers.py implements helper functions for manipulating the user table
 
 import hashlib # Hash passwords with SHA256
+import sqlite3, collections, csv
+from concurrent.futures import ProcessPoolExecutor
+from HierarchyHelpers import linkUser, unlinkUser
+from TransactionHelpers import unitOfWork, commit
+from CacheHelpers import RowCache
+from MetricsHelpers import instrumentModule
+
+# Role bits of users.perms, see Schema.py
+ADMIN = 0b1000
+ORG = 0b0100
+PROVIDER = 0b0010
+RECEIVER = 0b0001
+
+# Cached permissions: uid -> perms per database, see CacheHelpers.py
+PERM_CACHE_SIZE = 4096
+_permCache = RowCache('users', PERM_CACHE_SIZE)
+
+# Function hashPassword()
+# Purpose: Hash a password for storage in users.hash
+# Syntax: hashPassword(<pwd>)
+# Returns: SHA256 hex digest of pwd
+def hashPassword(pwd):
+	return hashlib.sha256(pwd.encode()).hexdigest()
+
+
+# Function _permitChild applies the parent/child permission rules of writeUser()
+# Returns: True if a parent holding pperms may assign perms to a child
+def _permitChild(pperms, perms):
+
+	# If creating admin, parent must be admin
+	if (0b1000 & perms == 0b1000) and (0b1000 & pperms != 0b1000):
+		return False
+
+	# If creating org, parent must be admin
+	if (0b100 & perms == 0b100) and (0b1000 & pperms != 0b1000):
+		return False
+
+	# Assigned child roles must be enabled in parent some role must be assigned
+	if (0b1 & perms != 0b1 & pperms) and (0b10 & perms != 0b10 & pperms) or (0b0011 & perms == 0):
+		return False
+
+	return True
+
 
 # Function existUser() 
 # Purpose: Check for user id existence in users table
@@ -28,8 +71,7 @@ def existUser(db, uid):
 def validUser(db, uid, pwd):
 
 	# hash pwd argument
-	hash_object = hashlib.sha256(pwd.encode())
-	hex_dig = hash_object.hexdigest()
+	hex_dig = hashPassword(pwd)
 
 	# get current hash
 	c = db.cursor()
@@ -53,14 +95,13 @@ def validUser(db, uid, pwd):
 def changePassword(db, uid, pwdOld, pwdNew):
 
 	# hash new pwd argument
-	hash_object = hashlib.sha256(pwdNew.encode())
-	hex_dig = hash_object.hexdigest()
+	hex_dig = hashPassword(pwdNew)
 
 	# confirm old pwd is valid
 	if validUser(db, uid, pwdOld):
 		c = db.cursor()
 		c.execute('''UPDATE users SET hash = ? WHERE uid = ?''', (hex_dig, uid))
-		db.commit()
+		commit(db)
 		c.close()
 
 	# test for success
@@ -79,8 +120,7 @@ def changePassword(db, uid, pwdOld, pwdNew):
 def writeUser(db, pid, uid, perms, pwd):
 
 	# hash pwd argument
-	hash_object = hashlib.sha256(pwd.encode())
-	hex_dig = hash_object.hexdigest()
+	hex_dig = hashPassword(pwd)
 
 	# First user into table gets administrative access!
 	c = db.cursor()
@@ -89,6 +129,7 @@ def writeUser(db, pid, uid, perms, pwd):
 	if result is None:
 		firstUser = True
 		c.execute('''INSERT INTO users(pid, perms, uid, hash) VALUES(?,?,?,?)''', (pid, 0b1111, uid, hex_dig))
+		linkUser(c, pid, uid)
 
 	# Otherwise table not empty:
 	else:
@@ -100,16 +141,7 @@ def writeUser(db, pid, uid, perms, pwd):
 			return False
 		pperms = result[0]
 
-		# If creating admin, parent must be admin
-		if (0b1000 & perms == 0b1000) and (0b1000 & pperms != 0b1000):
-			return False
-	
-		# If creating org, parent must be admin
-		if (0b100 & perms == 0b100) and (0b1000 & pperms != 0b1000):
-			return False
-
-		# Assigned child roles must be enabled in parent some role must be assigned
-		if (0b1 & perms != 0b1 & pperms) and (0b10 & perms != 0b10 & pperms) or (0b0011 & perms == 0):
+		if not _permitChild(pperms, perms):
 			return False
 
 		# Get pid and confirm ownership
@@ -119,6 +151,7 @@ def writeUser(db, pid, uid, perms, pwd):
 		# If user does not exist, create and add hash
 		if result is None:
 			c.execute('''INSERT INTO users(pid, perms, uid, hash) VALUES(?,?,?,?)''', (pid, perms, uid, hex_dig))
+			linkUser(c, pid, uid)
 
 		# If user exists and pid owns user, update all but hash
 		elif (result is not None) and (result[0] == pid):
@@ -128,8 +161,9 @@ def writeUser(db, pid, uid, perms, pwd):
 	# test for success
 	c.execute('''SELECT perms FROM users WHERE uid=?''', (uid,))
 	result = c.fetchone()
-	db.commit()
+	commit(db)
 	c.close()
+	invalidatePerms(db, uid)
 
 	# If user exists...
 	if result is not None:
@@ -144,50 +178,144 @@ def writeUser(db, pid, uid, perms, pwd):
 	return False
 
 
-# Function isAdmin()
-# Purpose: Checks whether argument uid has admin permissions
-# Syntax: isAdmin(<connection>, <uid>)
-# Returns: True if uid has admin permissions, else False
-def isAdmin(db, uid):
+# Function provisionUsers()
+# Purpose: Write many users in one transaction, with writeUser() rules and results
+# Syntax: provisionUsers(<connection>, <records>, <hash_workers>)
+# Returns: list of True/False per record, in record order
+# Note: records is an iterable of (parent_id, user_id, permissions, pwd), e.g. readUserRecords().
+#       Parents may be created earlier in the same batch. Rules are checked against a parent map
+#       loaded once, then all inserts and updates are written with executemany and one commit.
+#       hash_workers > 1 hashes new passwords in a process pool; SHA256 of a short password is
+#       cheaper than the round trip to a worker, so only very large batches benefit.
+def provisionUsers(db, records, workers=None):
 
-	# If requesting user doesn't exist, inadequte permissions
-	if not existUser(db, uid):
-		return False
+	records = list(records)
+	results = [False] * len(records)
 
-	# Get user permissions
+	# Preload uid -> [pid, perms] for every existing user
 	c = db.cursor()
-	c.execute('''SELECT perms FROM users WHERE uid=?''', (uid,))
-	result = c.fetchone()
-	c.close()
+	c.execute('''SELECT uid, pid, perms FROM users''')
+	users = {row[0]: [row[1], row[2]] for row in c.fetchall()}
 
-	# apply bitmask and check for desired bit
-	if result[0] & 0b1000 == 0b1000:
-		return True
+	inserts = collections.OrderedDict() # uid -> [pid, perms, pwd] for new users
+	updates = collections.OrderedDict() # uid -> perms for existing users
+	for i, (pid, uid, perms, pwd) in enumerate(records):
+
+		# First user into table gets administrative access!
+		if not users:
+			users[uid] = [pid, 0b1111]
+			inserts[uid] = [pid, 0b1111, pwd]
+			results[i] = True
+			continue
+
+		# Parent must exist and permit the child's roles
+		if pid not in users or not _permitChild(users[pid][1], perms):
+			continue
+
+		# If user does not exist, create and add hash
+		if uid not in users:
+			users[uid] = [pid, perms]
+			inserts[uid] = [pid, perms, pwd]
+			results[i] = True
+
+		# If user exists and pid owns user, update all but hash
+		elif users[uid][0] == pid:
+			users[uid][1] = perms
+			if uid in inserts:
+				inserts[uid][1] = perms
+			else:
+				updates[uid] = perms
+			results[i] = True
+
+	# Hash passwords for new users only; existing hashes belong to changePassword()
+	pwds = [row[2] for row in inserts.values()]
+	if workers is not None and workers > 1 and len(pwds) > 1:
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			hashes = list(pool.map(hashPassword, pwds, chunksize=max(1, len(pwds) // (workers * 4))))
 	else:
-		return False	
+		hashes = [hashPassword(pwd) for pwd in pwds]
+
+	try:
+		with unitOfWork(db):
+			c.executemany('''INSERT INTO users(pid, perms, uid, hash) VALUES(?,?,?,?)''',
+				[(row[0], row[1], uid, h) for (uid, row), h in zip(inserts.items(), hashes)])
+			for uid, row in inserts.items():
+				linkUser(c, row[0], uid)
+			c.executemany('''UPDATE users SET perms = ? WHERE uid = ?''', [(perms, uid) for uid, perms in updates.items()])
+	except sqlite3.Error as e:
+		print(e)
+		results = [False] * len(records)
+	c.close()
 
+	for uid in list(inserts) + list(updates):
+		invalidatePerms(db, uid)
+	return results
 
-# Function isOrg()
-# Purpose: Checks whether argument uid has organizational permissions
-# Syntax: isOrg(<connection>, <uid>)
-# Returns: True if uid has organizational permissions, else False
-def isOrg(db, uid):
 
-	# If requesting user doesn't exist, inadequte permissions
-	if not existUser(db, uid):
-		return False
+# Function readUserRecords()
+# Purpose: Stream (parent_id, user_id, permissions, pwd) records from CSV for provisionUsers()
+# Syntax: readUserRecords(<text_stream>)
+# Returns: generator of record tuples
+# Note: A header row starting with "parent" is skipped. Permissions accept 0b/0x/decimal forms.
+def readUserRecords(stream):
+
+	for row in csv.reader(stream):
+		if not row or row[0].strip().lower() == 'parent':
+			continue
+		pid, uid, perms, pwd = [field.strip() for field in row[:4]]
+		yield (pid, uid, int(perms, 0), pwd)
+
+
+# Function deleteUser()
+# Purpose: Remove a user from users table
+# Syntax: deleteUser(<connection>, <parent_id>, <user_id>)
+# Returns True on success / False on failure
+# Note: Only the owning parent or an admin may delete; users owning accounts cannot be deleted
+def deleteUser(db, pid, uid):
 
-	# Get user permissions
 	c = db.cursor()
-	c.execute('''SELECT perms FROM users WHERE uid=?''', (uid,))
+	c.execute('''SELECT pid FROM users WHERE uid=?''', (uid,))
+	result = c.fetchone()
+	if result is None or uid == pid:
+		c.close()
+		return False
+
+	# Parent must own user or be admin
+	if result[0] != pid and not isAdmin(db, pid):
+		c.close()
+		return False
+
+	# Refuse to orphan child accounts
+	c.execute('''SELECT uid FROM users WHERE pid=? AND uid != pid''', (uid,))
+	if c.fetchone() is not None:
+		c.close()
+		return False
+
+	c.execute('''DELETE FROM users WHERE uid=?''', (uid,))
+	unlinkUser(c, uid)
+	commit(db)
+	c.execute('''SELECT uid FROM users WHERE uid=?''', (uid,))
 	result = c.fetchone()
 	c.close()
+	invalidatePerms(db, uid)
+
+	return result is None
+
+
+# Function isAdmin()
+# Purpose: Checks whether argument uid has admin permissions
+# Syntax: isAdmin(<connection>, <uid>)
+# Returns: True if uid has admin permissions, else False
+def isAdmin(db, uid):
+	return _hasRole(db, uid, ADMIN)
 
-	# apply bitmask and check for desired bit
-	if result[0] & 0b0100 == 0b0100:
-		return True
-	else:
-		return False	
+
+# Function isOrg()
+# Purpose: Checks whether argument uid has organizational permissions
+# Syntax: isOrg(<connection>, <uid>)
+# Returns: True if uid has organizational permissions, else False
+def isOrg(db, uid):
+	return _hasRole(db, uid, ORG)
 
 
 # Function isProvider()
@@ -195,22 +323,7 @@ def isOrg(db, uid):
 # Syntax: isProvider(<connection>, <uid>)
 # Returns: True if uid has provider permissions, else False
 def isProvider(db, uid):
-
-	# If requesting user doesn't exist, inadequte permissions
-	if not existUser(db, uid):
-		return False
-
-	# Get user permissions
-	c = db.cursor()
-	c.execute('''SELECT perms FROM users WHERE uid=?''', (uid,))
-	result = c.fetchone()
-	c.close()
-
-	# apply bitmask and check for desired bit
-	if result[0] & 0b0010 == 0b0010:
-		return True
-	else:
-		return False	
+	return _hasRole(db, uid, PROVIDER)
 
 
 # Function isReceiver()
@@ -218,19 +331,47 @@ def isProvider(db, uid):
 # Syntax: isReceiver(<connection>, <uid>)
 # Returns: True if uid has receiver permissions, else False
 def isReceiver(db, uid):
+	return _hasRole(db, uid, RECEIVER)
 
-	# If requesting user doesn't exist, inadequte permissions
-	if not existUser(db, uid):
+
+# Function _hasRole applies a role bitmask to the cached permissions of uid
+# If requesting user doesn't exist, inadequate permissions
+def _hasRole(db, uid, role):
+	perms = getPerms(db, uid)
+	if perms is None:
 		return False
+	return perms & role == role
+
+
+# Function getPerms()
+# Purpose: Resolve every role bit for a user with at most one query
+# Syntax: getPerms(<connection>, <uid>)
+# Returns: perms bit string (see Schema.py), or None if uid does not exist
+# Note: Results are cached per database in a bounded LRU shared by its connections.
+#       Missing users are cached too; writeUser() and deleteUser() invalidate entries, and
+#       user writes from other connections or processes are noticed on the next lookup.
+def getPerms(db, uid):
+
+	hit, perms, token = _permCache.get(db, uid)
+	if hit:
+		return perms
 
-	# Get user permissions
 	c = db.cursor()
 	c.execute('''SELECT perms FROM users WHERE uid=?''', (uid,))
 	result = c.fetchone()
 	c.close()
+	perms = result[0] if result is not None else None
 
-	# apply bitmask and check for desired bit
-	if result[0] & 0b0001 == 0b0001:
-		return True
-	else:
-		return False	
+	_permCache.put(db, uid, perms, token)
+	return perms
+
+
+# Function invalidatePerms()
+# Purpose: Drop a user's cached permissions so the next lookup reads the users table
+# Syntax: invalidatePerms(<connection>, <uid>)
+def invalidatePerms(db, uid):
+	_permCache.invalidate(db, uid)
+
+
+# Record call counts, wall time and SQL statements per helper (see MetricsHelpers.py)
+instrumentModule(__name__)
@@ -0,0 +1,147 @@
+# WriterHelpers.py implements a single writer thread that group-commits queued helper calls
+
+import time, queue, threading
+from concurrent.futures import Future
+from Schema import createSchema
+from TransactionHelpers import unitOfWork
+
+# Mutations submitted to a WriteQueue run one after another on the writer's own connection.
+# Everything queued within one tick shares a transaction, so a burst of N writes costs one
+# commit (one fsync under the durable profile) instead of N, and workers never contend for
+# the database write lock with each other.
+#
+#	writer = WriteQueue('donations.db')
+#	future = writer.submit(addDonation, 'P_Usr_1', None)
+#	did = future.result() # Same value addDonation() returns, once the batch has committed
+#	writer.close()
+WRITE_BATCH_SIZE = 256
+WRITE_BATCH_LATENCY = 0.002 # Seconds the writer waits to fill a batch after its first call
+
+_STOP = object()
+
+
+# Class WriteQueue runs helper calls on a dedicated writer thread in group-committed batches
+# Syntax: WriteQueue(<database_path>, <profile>, <max_batch>, <max_latency_seconds>)
+# Note: A batch closes when max_batch calls are queued or max_latency has passed since its
+#       first call, whichever comes first; 0 latency batches only what is already queued.
+#       Each call runs in its own savepoint, so a call that raises is rolled back alone and
+#       its future carries the exception. Futures resolve only after the batch commits.
+class WriteQueue:
+
+	def __init__(self, path=':memory:', profile='durable', maxBatch=WRITE_BATCH_SIZE, maxLatency=WRITE_BATCH_LATENCY):
+		self.path = path
+		self.profile = profile
+		self.maxBatch = maxBatch
+		self.maxLatency = maxLatency
+		self.stats = {'calls': 0, 'batches': 0, 'failed': 0}
+		self._queue = queue.Queue()
+		self._closed = False
+		self._lock = threading.Lock()
+		self._ready = threading.Event()
+		self._db = None
+		self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+		self._thread.start()
+		self._ready.wait()
+		if self._db is None:
+			raise RuntimeError('WriteQueue could not open {0}'.format(path))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+		return False
+
+	# Method submit()
+	# Purpose: Queue a helper call for the writer thread
+	# Syntax: writer.submit(<helper>, <args...>)
+	# Returns: Future whose result() is the helper's return value, or raises what it raised
+	# Note: Pass the helper's arguments without the connection; the writer supplies its own
+	def submit(self, func, *args, **kwargs):
+
+		future = Future()
+		with self._lock:
+			if self._closed:
+				raise RuntimeError('WriteQueue is closed')
+			self._queue.put((future, func, args, kwargs))
+		return future
+
+	# Method close()
+	# Purpose: Commit everything already queued, then stop the writer and close its connection
+	def close(self):
+
+		with self._lock:
+			if self._closed:
+				return
+			self._closed = True
+			self._queue.put(_STOP)
+		self._thread.join()
+
+	# Method _run is the writer thread: it owns the connection for its whole life
+	def _run(self):
+
+		try:
+			self._db = db = createSchema(self.path, self.profile)
+		finally:
+			self._ready.set() # createSchema() exits the thread if the database cannot open
+		try:
+			stopping = False
+			while not stopping:
+				batch, stopping = self._collect()
+				if batch:
+					self._commit(db, batch)
+		finally:
+			db.close()
+
+	# Method _collect blocks for a first call, then gathers more until the batch is full or due
+	def _collect(self):
+
+		first = self._queue.get()
+		if first is _STOP:
+			return [], True
+
+		batch = [first]
+		deadline = time.monotonic() + self.maxLatency
+		while len(batch) < self.maxBatch:
+			remaining = deadline - time.monotonic()
+			try:
+				call = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+			except queue.Empty:
+				break
+			if call is _STOP:
+				return batch, True
+			batch.append(call)
+		return batch, False
+
+	# Method _commit runs a batch in one transaction and resolves its futures after commit
+	def _commit(self, db, batch):
+
+		outcomes = []
+		try:
+			with unitOfWork(db):
+				for future, func, args, kwargs in batch:
+					if not future.set_running_or_notify_cancel():
+						outcomes.append(None) # Cancelled while queued: never run
+						continue
+					try:
+						with unitOfWork(db):
+							outcomes.append((True, func(db, *args, **kwargs)))
+					except Exception as e:
+						outcomes.append((False, e))
+		except Exception as e:
+			# Commit failed: nothing in the batch was written
+			for future, func, args, kwargs in batch:
+				if not future.done():
+					future.set_exception(e)
+			self.stats['failed'] += len(batch)
+			return
+
+		for (future, func, args, kwargs), outcome in zip(batch, outcomes):
+			if outcome is None:
+				continue
+			if outcome[0]:
+				future.set_result(outcome[1])
+			else:
+				future.set_exception(outcome[1])
+		self.stats['calls'] += len(batch)
+		self.stats['batches'] += 1